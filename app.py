@@ -1,42 +1,115 @@
 import streamlit as st
 import logging
-from io import BytesIO
-from transformers import LongformerTokenizer
+import os
 import hashlib
-import matplotlib.pyplot as plt
-import time
-from wordcloud import WordCloud
 
+from src.context import CONTEXT_CANDIDATES, CONTEXT_TOKEN_BUDGET, ContextBuilder, cached_embedding_lookup
 from src.data_loader import read_file
-from src.preprocessor import FileTextPreprocessor, setup_nltk
-from src.utils.openai_utils import generate_answer, get_embedding
-from src.utils.pinecone_utils import query_pinecone, upsert_chunks
-from src.utils.exceptions import DuplicateDocumentError, DatabaseConnectionError, InvalidQueryError
+from src.ingestion import IngestionWorker
+from src.preprocessor import FileTextPreprocessor, load_tokenizer, setup_nltk
+from src.retrieval import HybridRetriever
+from src.utils.openai_utils import get_embedding, get_embeddings, stream_answer
+from src.utils.pinecone_utils import add_change_listener, delete_vectors, query_pinecone, upsert_chunks
+from src.utils.answer_cache import SemanticAnswerCache
+from src.utils.bm25_index import BM25Index
+from src.utils.hash_index import DocumentHashIndex
+from src.utils.job_queue import DONE, DUPLICATE, FAILED, QUEUED, JobQueue
+from src.utils.exceptions import DatabaseConnectionError, InvalidQueryError
+from src.utils.telemetry import span, start_metrics_server
 
 st.set_page_config(page_title='Luthor - Chat with your work', page_icon='🤖', layout='wide')
 
-# Setup NLTK
-setup_nltk()
-
 @st.cache_resource
 def load_models():
-    return {'tokenizer': LongformerTokenizer.from_pretrained('allenai/longformer-base-4096')}
+    # Streamlit re-runs this script on every interaction, so setup happens once per process
+    setup_nltk()
+    return {'tokenizer': load_tokenizer()}
 
 models = load_models()
 tokenizer = models['tokenizer']
 
 # Initialise preprocessor
-preprocessor = FileTextPreprocessor(tokenizer)
+preprocessor = FileTextPreprocessor(tokenizer, chunking='structure')
+
+@st.cache_resource
+def load_hash_index():
+    return DocumentHashIndex(os.environ.get('LUTHOR_INDEX_PATH', 'luthor_index.sqlite'))
+
+hash_index = load_hash_index()
+
+@st.cache_resource
+def load_term_index():
+    return BM25Index(os.environ.get('LUTHOR_TERM_INDEX_PATH', 'luthor_terms'))
+
+term_index = load_term_index()
+retriever = HybridRetriever(term_index, preprocessor.tokenize_text, query_pinecone)
+
+@st.cache_resource
+def load_answer_cache():
+    cache = SemanticAnswerCache(threshold=float(os.environ.get('ANSWER_CACHE_THRESHOLD', 0.95)),
+                                ttl=float(os.environ.get('ANSWER_CACHE_TTL', 3600)))
+    # Answers may change once documents are added or removed
+    add_change_listener(cache.invalidate)
+    return cache
+
+answer_cache = load_answer_cache()
+
+@st.cache_resource
+def load_context_builder():
+    return ContextBuilder(int(os.environ.get('CONTEXT_TOKEN_BUDGET', CONTEXT_TOKEN_BUDGET)),
+                          embedding_lookup=cached_embedding_lookup())
+
+context_builder = load_context_builder()
+
+@st.cache_resource
+def load_metrics_server():
+    # Prometheus scrapes METRICS_PORT; Streamlit itself has no route for it
+    return start_metrics_server()
+
+load_metrics_server()
+
+@st.cache_resource
+def load_job_queue():
+    # Only this app's workers run its jobs: they own the BM25 index and the answer cache
+    # Content whose stored version was replaced or deleted since its job finished is ingested again
+    return JobQueue(os.environ.get('LUTHOR_JOB_QUEUE_PATH', 'luthor_jobs.sqlite'), consumer='streamlit',
+                    is_stored=hash_index.has_document)
+
+job_queue = load_job_queue()
+
+@st.cache_resource
+def load_ingestion_worker():
+    # Started once per server process; jobs left unfinished by a previous run are picked up again
+    worker = IngestionWorker(job_queue, get_embeddings, upsert_chunks, hash_index, delete_vectors, term_index)
+    worker.start()
+    return worker
+
+load_ingestion_worker()
 
 def setup_logging():
     logging.basicConfig(filename='luthor_app.log', level=logging.INFO,
                         format='%(asctime)s - %(levelname)s - %(message)s')
+    if os.environ.get('LUTHOR_TRACE_LOG'):
+        # One JSON line per finished span
+        logging.getLogger('luthor.trace').setLevel(logging.DEBUG)
 
 def get_file_hash(file_content):
-    return hashlib.md5(file_content.getvalue()).hexdigest()
+    # Hash the upload's buffer in place rather than a copy of it
+    return hashlib.md5(file_content.getbuffer()).hexdigest()
+
+def get_document_text(uploaded_file):
+    # Extracted text is kept per upload so reruns do not parse the file again
+    texts = st.session_state.setdefault('document_texts', {})
+    if uploaded_file.file_id not in texts:
+        texts[uploaded_file.file_id] = read_file(uploaded_file, uploaded_file.name, workers=os.cpu_count() or 1)
+    return texts[uploaded_file.file_id]
 
 @st.cache_data
 def generate_word_cloud(text):
+    # Imported here because plotting is only needed once a document is shown
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
+
     wordcloud = WordCloud(width=600, height=300, background_color='white', colormap='binary').generate(text)
     fig, ax = plt.subplots()
     ax.imshow(wordcloud, interpolation='bilinear')
@@ -45,11 +118,9 @@ def generate_word_cloud(text):
 
 def measure_processing_time(func):
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        processing_time = end_time - start_time
-        st.sidebar.write(f'{func.__name__} processing time: {processing_time:.2f} seconds')
+        with span(func.__name__) as request_span:
+            result = func(*args, **kwargs)
+        st.sidebar.write(f'{func.__name__} processing time: {request_span.duration:.2f} seconds')
         return result
     return wrapper
 
@@ -61,12 +132,20 @@ def main():
     st.sidebar.info('This app processes documents and answers questions based on their content.')
 
     uploaded_files = st.file_uploader('Upload documents', type=['txt', 'pdf', 'docx'], accept_multiple_files=True)
+    # Off by default: unrelated documents often share a name such as contract.pdf
+    replace_by_name = st.checkbox('Uploads replace stored documents with the same name',
+                                  help='Only the changed parts of a replaced document are re-embedded.')
 
     if uploaded_files:
-        for uploaded_file in uploaded_files:
-            process_uploaded_file(uploaded_file)
-
-        all_text = ' '.join([read_file(file, file.name) for file in uploaded_files])
+        # Streamlit reruns the script on every interaction; only handle new uploads
+        processed = st.session_state.setdefault('processed_files', set())
+        new_files = [file for file in uploaded_files if file.file_id not in processed]
+        if new_files:
+            enqueue_uploaded_files(new_files, replace_by_name)
+        processed.update(file.file_id for file in new_files)
+        show_ingestion_jobs()
+
+        all_text = ' '.join([get_document_text(file) for file in uploaded_files])
         st.subheader('Word Cloud of Uploaded Documents')
         st.pyplot(generate_word_cloud(all_text))
 
@@ -81,56 +160,41 @@ def main():
     if query:
         process_query(query, date_range, doc_type, legal_area)
 
-@measure_processing_time
-def process_uploaded_file(uploaded_file):
-    try:
-        with st.spinner('Processing file...'):
-            file_content = BytesIO(uploaded_file.read())
-            file_content.seek(0)
-            file_hash = get_file_hash(file_content)
-
-            if check_duplicate_document(file_hash):
-                raise DuplicateDocumentError('This document has already been uploaded and stored.')
-
-            text = read_file(file_content, uploaded_file.name)
-            _, segments, _, _, _, chunks = preprocessor.preprocess_doc(text)
-
-            vectors = create_vectors(chunks, file_hash, uploaded_file.name)
-
-            upsert_chunks(vectors)
-
-        st.success('File processed and stored successfully!')
-        logging.info(f'File uploaded and processed: {uploaded_file.name}')
-
-    except DuplicateDocumentError as e:
-        st.warning(str(e))
-        logging.info(f'Duplicate document upload attempt: {uploaded_file.name}')
-    except Exception as e:
-        st.error(f'An unexpected error occurred while processing the file: {str(e)}')
-        logging.exception(f'Unexpected error processing file: {uploaded_file.name}')
-
-def create_vectors(chunks, file_hash, file_name):
-    vectors = []
-    for i, chunk in enumerate(chunks):
-        chunk_embedding = get_embedding(chunk)
-        vector = {
-            "id": f"{file_hash}_{i}",
-            "values": chunk_embedding,
-            "metadata": {
-                "file_hash": file_hash,
-                "file_name": file_name,
-                "chunk_id": str(i),
-                "text": chunk[:1000]  # Limit text to 1000 characters
-            }
-        }
-        vectors.append(vector)
-    return vectors
+def enqueue_uploaded_files(uploaded_files, replace_by_name=False):
+    # The background worker does the ingestion, so the upload returns as soon as the jobs are queued
+    job_ids = st.session_state.setdefault('ingestion_jobs', [])
+    for uploaded_file in uploaded_files:
+        if check_duplicate_document(get_file_hash(uploaded_file)):
+            st.warning(f'{uploaded_file.name} has already been uploaded and stored.')
+            logging.info(f'Duplicate document upload attempt: {uploaded_file.name}')
+            continue
+        # Queuing the same content again returns its existing job
+        job = job_queue.enqueue(uploaded_file.name, uploaded_file.getvalue(),
+                                document_key=uploaded_file.name if replace_by_name else None)
+        if job.id not in job_ids:
+            job_ids.append(job.id)
+        logging.info(f'File uploaded and queued as job {job.id}: {uploaded_file.name}')
+
+@st.fragment(run_every=2)
+def show_ingestion_jobs():
+    # Reruns on its own every few seconds, without rerunning the rest of the page
+    job_ids = st.session_state.get('ingestion_jobs')
+    if not job_ids:
+        return
+    for job in reversed(job_queue.jobs(job_ids)):
+        if job.status == DONE:
+            st.success(f'{job.file_name} processed and stored successfully ({job.message}).')
+        elif job.status == DUPLICATE:
+            st.warning(f'{job.file_name} has already been uploaded and stored.')
+        elif job.status == FAILED:
+            st.error(f'An unexpected error occurred while processing {job.file_name}: {job.error}')
+        elif job.status == QUEUED and job.error:
+            st.progress(job.progress, text=f'{job.file_name}: retrying after an error ({job.error})')
+        else:
+            st.progress(job.progress, text=f'{job.file_name}: {job.stage or "queued"}...')
 
 def check_duplicate_document(file_hash):
-    # Implement this function to check if the document already exists
-    # Return True if it's a duplicate, False otherwise
-    # Return False as a placeholder
-    return False
+    return hash_index.has_document(file_hash)
 
 @measure_processing_time
 def process_query(query, date_range, doc_type, legal_area):
@@ -138,16 +202,30 @@ def process_query(query, date_range, doc_type, legal_area):
         raise InvalidQueryError('Please enter a valid query.')
 
     try:
-        with st.spinner('Generating answer...'):
-            query_embedding = get_embedding(query)
-
+        with st.spinner('Searching documents...'):
             filters = create_filters(date_range, doc_type, legal_area)
-            matches = query_pinecone(query_embedding, filters=filters)
-
-            context = create_context(matches)
-            answer = generate_answer(query, context)
-
-        display_results(answer, matches)
+            query_embedding, cached = None, None
+
+            # Quoted phrases and citations are looked up locally, without an embedding call
+            candidates = retriever.exact_lookup(query, filters, top_k=CONTEXT_CANDIDATES)
+            if candidates is None:
+                query_embedding = get_embedding(query)
+                cached = answer_cache.lookup(query_embedding, filters)
+                if not cached:
+                    candidates = retriever.search(query, query_embedding, filters, top_k=CONTEXT_CANDIDATES)
+
+            if cached:
+                answer, matches = cached
+            else:
+                context, matches = context_builder.build(query, candidates)
+
+        if cached:
+            display_results(answer, matches)
+        else:
+            # Stream the answer so the first tokens show while the rest is generated
+            answer = display_results(stream_answer(query, context), matches)
+            if query_embedding is not None:
+                answer_cache.store(query_embedding, filters, answer, matches)
         logging.info(f'Query processed: {query}')
 
     except DatabaseConnectionError:
@@ -167,23 +245,27 @@ def create_filters(date_range, doc_type, legal_area):
         filters["legal_area"] = legal_area
     return filters
 
-def create_context(matches):
-    context = []
-    for match in matches:
-        text = match['metadata'].get('text', '')
-        file_name = match['metadata'].get('file_name', 'Unknown File')
-        citation = f"[Source: {file_name}]"
-        context.append(f"{text} {citation}")
-    return " ".join(context)
-
 def display_results(answer, matches):
-    st.subheader("Answer:")
-    st.write(answer)
+    """
+    Show the sources, then the answer.
+
+    Args:
+        answer: The answer text, or an iterator of answer fragments to render as they arrive.
+        matches: The retrieved matches the answer is based on.
 
+    Returns:
+        str: The full answer text.
+    """
     st.subheader("Sources:")
     unique_sources = set(match['metadata'].get('file_name', 'Unknown File') for match in matches)
     for source in unique_sources:
         st.write(f"- {source}")
 
+    st.subheader("Answer:")
+    if isinstance(answer, str):
+        st.write(answer)
+        return answer
+    return st.write_stream(answer)
+
 if __name__ == "__main__":
     main()
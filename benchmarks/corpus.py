@@ -0,0 +1,118 @@
+"""
+Deterministic synthetic corpus of legal memos for benchmarks.
+
+The same seed always yields the same memos and queries, so results are comparable
+across commits and machines.
+"""
+import random
+from io import BytesIO
+from typing import List, Tuple
+
+PARTIES = ['Acme Corp.', 'Buyer', 'Seller', 'the Landlord', 'the Tenant', 'the Employer', 'the Contractor',
+           'Northwind LLC', 'the Licensee', 'the Guarantor']
+SUBJECTS = ['limitation period', 'indemnification clause', 'non-compete covenant', 'termination notice',
+            'force majeure provision', 'liquidated damages', 'warranty of fitness', 'assignment restriction',
+            'governing law clause', 'confidentiality obligation', 'security deposit', 'arbitration agreement']
+AREAS = ['contract', 'employment', 'property', 'corporate', 'tort', 'intellectual property']
+CITATIONS = ['Section 4.2', 'Art. 12', '§ 3', '42 U.S.C. 1983', 'Smith v. Jones', 'Rule 56', 'Clause 9.1',
+             'Hadley v. Baxendale', '15 U.S.C. 78', 'Section 17(b)']
+VERBS = ['requires', 'permits', 'prohibits', 'limits', 'extends', 'excludes', 'conditions', 'governs']
+QUALIFIERS = ['in writing', 'within thirty days', 'without prior consent', 'upon material breach',
+              'to the extent permitted by law', 'subject to the cap', 'notwithstanding the foregoing',
+              'for a period of six years', 'on a pro rata basis', 'save for gross negligence']
+CONCLUSIONS = ['is likely enforceable', 'is unlikely to be upheld', 'should be renegotiated',
+               'creates a material risk', 'does not apply on these facts', 'requires further review']
+HEADINGS = ['I. Question Presented', 'II. Brief Answer', 'III. Facts', 'IV. Discussion', 'V. Conclusion']
+
+def _sentence(rng: random.Random) -> str:
+    sentence = (f"Under {rng.choice(CITATIONS)}, the {rng.choice(SUBJECTS)} {rng.choice(VERBS)} "
+                f"{rng.choice(PARTIES)} to act {rng.choice(QUALIFIERS)}")
+    if rng.random() < 0.4:
+        sentence += f", and the {rng.choice(SUBJECTS)} {rng.choice(CONCLUSIONS)}"
+    return sentence + '.'
+
+def memo(index: int, paragraphs: int = 12, seed: int = 0) -> str:
+    """
+    One synthetic legal memo.
+
+    Args:
+        index (int): Memo number; different numbers give different memos.
+        paragraphs (int): Paragraphs per section, on average.
+        seed (int): Corpus seed.
+
+    Returns:
+        str: The memo text, with a header block and numbered section headings.
+    """
+    rng = random.Random(f"{seed}:{index}")
+    subject = rng.choice(SUBJECTS)
+    lines = [
+        'MEMORANDUM',
+        f"TO: Partner {index % 17}",
+        f"FROM: Associate {index % 23}",
+        f"DATE: 20{10 + index % 15:02d}-{1 + index % 12:02d}-{1 + index % 28:02d}",
+        f"RE: {rng.choice(PARTIES)} - {subject} ({rng.choice(AREAS)})",
+        '',
+    ]
+    for heading in HEADINGS:
+        lines.append(heading)
+        for _ in range(max(1, rng.randint(paragraphs // 2, paragraphs + paragraphs // 2) // len(HEADINGS))):
+            lines.append(' '.join(_sentence(rng) for _ in range(rng.randint(3, 7))))
+            lines.append('')
+    return '\n'.join(lines)
+
+def memos(count: int, paragraphs: int = 12, seed: int = 0) -> List[Tuple[str, str]]:
+    """The first ``count`` memos of the corpus as (file name, text)."""
+    return [(f"memo_{i:05d}.txt", memo(i, paragraphs, seed)) for i in range(count)]
+
+def queries(count: int, seed: int = 0) -> List[str]:
+    """
+    Questions over the corpus: mostly conceptual, with every fifth a citation lookup
+    and every seventh a quoted phrase, which take the exact-lookup path.
+    """
+    rng = random.Random(f"{seed}:queries")
+    questions = []
+    for i in range(count):
+        if i % 5 == 4:
+            questions.append(f"What does {rng.choice(CITATIONS)} say about the {rng.choice(SUBJECTS)}?")
+        elif i % 7 == 6:
+            questions.append(f'Which memos mention "{rng.choice(QUALIFIERS)}"?')
+        else:
+            questions.append(f"Is the {rng.choice(SUBJECTS)} binding on {rng.choice(PARTIES)} "
+                             f"{rng.choice(QUALIFIERS)}?")
+    return questions
+
+def to_docx(text: str) -> bytes:
+    """Render text as a .docx document, one paragraph per line."""
+    from docx import Document
+
+    document = Document()
+    for line in text.split('\n'):
+        document.add_paragraph(line)
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def to_pdf(text: str, lines_per_page: int = 50) -> bytes:
+    """Render text as a PDF with ``lines_per_page`` wrapped lines per page."""
+    import textwrap
+
+    import fitz  # PyMuPDF
+
+    lines = [wrapped for line in text.split('\n') for wrapped in (textwrap.wrap(line, 95) or [''])]
+    document = fitz.open()
+    for start in range(0, len(lines), lines_per_page):
+        page = document.new_page()
+        page.insert_text((50, 60), '\n'.join(lines[start:start + lines_per_page]), fontsize=9)
+    data = document.tobytes()
+    document.close()
+    return data
+
+def render(text: str, extension: str) -> bytes:
+    """The memo as the content of a file with the given extension (.txt, .docx or .pdf)."""
+    if extension == '.txt':
+        return text.encode('utf-8')
+    if extension == '.docx':
+        return to_docx(text)
+    if extension == '.pdf':
+        return to_pdf(text)
+    raise ValueError(f"Unsupported file extension: {extension}")
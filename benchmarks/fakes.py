@@ -0,0 +1,196 @@
+"""
+Deterministic offline stand-ins for the OpenAI and Pinecone clients.
+
+They are installed in place of the real clients (see offline_services), so the code
+under benchmark runs unchanged: batching, retries, caching and upsert batching are all
+exercised, and only the network round trip is replaced by an optional fixed latency.
+"""
+import asyncio
+import re
+import time
+import zlib
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+
+from src.utils import openai_utils, pinecone_utils
+from src.utils.vector_store import LocalVectorStore
+
+_TERM_PATTERN = re.compile(r'\w+')
+
+def hashed_embedding(text: str, dimension: int) -> np.ndarray:
+    """
+    Unit-length bag-of-words embedding: each term adds +1 or -1 to a coordinate chosen by
+    its CRC32. Texts sharing terms get similar vectors, as with a real model.
+    """
+    vector = np.zeros(dimension, dtype=np.float32)
+    for term in _TERM_PATTERN.findall(text.lower()):
+        code = zlib.crc32(term.encode('utf-8'))
+        vector[code % dimension] += 1.0 if code & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = norm = 1.0
+    return vector / norm
+
+class FakeOpenAI:
+    def __init__(self, dimension: int = pinecone_utils.EMBEDDING_DIMENSION, latency: float = 0.0,
+                 answer: str = 'The limitation period is six years under Section 4.2.'):
+        """
+        Stand-in for the OpenAI client's embeddings and chat completions.
+
+        Args:
+            dimension (int): Embedding dimension.
+            latency (float): Seconds each request takes, simulating the network.
+            answer (str): Text every chat completion returns, streamed word by word.
+        """
+        self.dimension = dimension
+        self.latency = latency
+        self.answer = answer
+        self.requests = 0
+        self.embeddings = SimpleNamespace(create=self._embed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+
+    def _request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _embed(self, input, model: str, **kwargs):
+        self._request()
+        return self._embedding_response(input)
+
+    def _embedding_response(self, input) -> SimpleNamespace:
+        texts = [input] if isinstance(input, str) else input
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=hashed_embedding(text, self.dimension).tolist())
+                                     for i, text in enumerate(texts)])
+
+    def _complete(self, model: str, messages: List[dict], stream: bool = False, **kwargs):
+        self._request()
+        if stream:
+            return self._stream()
+        return self._completion()
+
+    def _completion(self) -> SimpleNamespace:
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answer))])
+
+    def _stream(self) -> Iterator[SimpleNamespace]:
+        for i, word in enumerate(self.answer.split(' ')):
+            content = word if i == 0 else ' ' + word
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+class AsyncFakeOpenAI(FakeOpenAI):
+    def __init__(self, *args, **kwargs):
+        """
+        Stand-in for the AsyncOpenAI client, taking the same arguments as FakeOpenAI.
+
+        Requests wait on the event loop rather than blocking it, so concurrent requests
+        overlap as they would over a connection pool.
+        """
+        super().__init__(*args, **kwargs)
+        self.embeddings = SimpleNamespace(create=self._aembed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._acomplete))
+
+    async def _arequest(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _aembed(self, input, model: str, **kwargs):
+        await self._arequest()
+        return self._embedding_response(input)
+
+    async def _acomplete(self, model: str, messages: List[dict], stream: bool = False, **kwargs):
+        await self._arequest()
+        if stream:
+            return self._astream()
+        return self._completion()
+
+    async def _astream(self) -> AsyncIterator[SimpleNamespace]:
+        for chunk in self._stream():
+            yield chunk
+
+    async def close(self):
+        pass
+
+class FakePineconeIndex:
+    def __init__(self, dimension: int = pinecone_utils.EMBEDDING_DIMENSION, latency: float = 0.0):
+        """
+        Stand-in for a Pinecone index, keeping the vectors in an exact in-memory store.
+
+        Args:
+            dimension (int): Vector dimension.
+            latency (float): Seconds each request takes, simulating the network.
+        """
+        self.store = LocalVectorStore(dimension=dimension)
+        self.latency = latency
+        self.requests = 0
+
+    def _request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upsert(self, vectors: List[dict], **kwargs):
+        self._request()
+        return {'upserted_count': self.store.upsert(vectors)}
+
+    def query(self, vector: List[float], filter: Optional[dict] = None, top_k: int = 5,
+              include_values: bool = False, include_metadata: bool = True, **kwargs):
+        self._request()
+        return {'matches': self.store.query(vector, filters=filter, top_k=top_k, include_values=include_values)}
+
+    def delete(self, ids: List[str], **kwargs):
+        self._request()
+        self.store.delete(ids)
+        return {}
+
+class AsyncFakePineconeIndex:
+    def __init__(self, index: FakePineconeIndex):
+        """
+        Stand-in for Pinecone's asyncio index, querying the vectors of a FakePineconeIndex.
+
+        Args:
+            index (FakePineconeIndex): The index whose store, latency and request count are shared.
+        """
+        self.index = index
+
+    async def query(self, vector: List[float], filter: Optional[dict] = None, top_k: int = 5,
+                    include_metadata: bool = True, **kwargs):
+        self.index.requests += 1
+        if self.index.latency:
+            await asyncio.sleep(self.index.latency)
+        matches = self.index.store.query(vector, filters=filter, top_k=top_k)
+        return SimpleNamespace(matches=[SimpleNamespace(**match) for match in matches])
+
+    async def close(self):
+        pass
+
+@contextmanager
+def offline_services(dimension: int = pinecone_utils.EMBEDDING_DIMENSION, latency: float = 0.0):
+    """
+    Route openai_utils and pinecone_utils to the fakes for the duration of the block.
+
+    The embedding cache is cleared on entry and exit so measurements do not leak into
+    each other.
+
+    Yields:
+        SimpleNamespace: The installed 'openai', 'async_openai', 'index' and 'async_index' fakes.
+    """
+    index = FakePineconeIndex(dimension, latency)
+    fakes = SimpleNamespace(openai=FakeOpenAI(dimension, latency), async_openai=AsyncFakeOpenAI(dimension, latency),
+                            index=index, async_index=AsyncFakePineconeIndex(index))
+    saved = (openai_utils._client, openai_utils._async_client, pinecone_utils._index, pinecone_utils._async_index,
+             pinecone_utils._store)
+    openai_utils._client, openai_utils._async_client = fakes.openai, fakes.async_openai
+    pinecone_utils._index, pinecone_utils._async_index = fakes.index, fakes.async_index
+    pinecone_utils.set_vector_store(pinecone_utils.PineconeVectorStore())
+    openai_utils.embedding_cache.clear()
+    try:
+        yield fakes
+    finally:
+        openai_utils._client, openai_utils._async_client = saved[0], saved[1]
+        pinecone_utils._index, pinecone_utils._async_index = saved[2], saved[3]
+        pinecone_utils.set_vector_store(saved[4])
+        openai_utils.embedding_cache.clear()
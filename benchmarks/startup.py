@@ -0,0 +1,69 @@
+"""
+Cold-start benchmark.
+
+Usage:
+    python -m benchmarks.startup [--repeat N] [--output FILE]
+
+Each step runs in a fresh interpreter, as on a new container, and the median wall time
+over the repeats is reported as JSON. Set LUTHOR_ASSETS_DIR, NLTK_DATA and
+TIKTOKEN_CACHE_DIR as in the image to measure a baked start.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Name and Python source of each measured step
+STEPS = {
+    'interpreter': 'pass',
+    'import_openai_utils': 'import src.utils.openai_utils',
+    'import_pinecone_utils': 'import src.utils.pinecone_utils',
+    'import_ingestion': 'import src.ingestion',
+    'import_api': 'import src.api',
+    'setup_nltk': 'from src.preprocessor import setup_nltk; setup_nltk()',
+    'load_tokenizer': 'from src.preprocessor import load_tokenizer; load_tokenizer()',
+    'preprocessor': ('from src.ingestion import default_preprocessor; from src.preprocessor import setup_nltk; '
+                     'setup_nltk(); default_preprocessor()'),
+}
+
+def time_step(source: str, repeat: int) -> dict:
+    """
+    Run ``source`` in ``repeat`` fresh interpreters.
+
+    Returns:
+        dict: Median and minimum seconds, or the error of the first failing run.
+    """
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'benchmark'))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', source], env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}
+        timings.append(elapsed)
+    return {'median_s': round(statistics.median(timings), 4), 'min_s': round(min(timings), 4)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cold-start times in fresh interpreters.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per step (default: %(default)s)')
+    parser.add_argument('--output', help='Write the JSON results to this file as well')
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': platform.python_version(),
+        'assets_dir': os.environ.get('LUTHOR_ASSETS_DIR'),
+        'steps': {name: time_step(source, args.repeat) for name, source in STEPS.items()},
+    }
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+
+if __name__ == '__main__':
+    main()
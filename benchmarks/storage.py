@@ -0,0 +1,127 @@
+"""
+Embedding storage benchmark: dimensions and quantization against recall.
+
+Usage:
+    python -m benchmarks.storage [--vectors 100000] [--queries 200] [--dimensions 1536,512,256]
+                                 [--top-k 10] [--output FILE]
+
+For each embedding size and LocalVectorStore configuration it reports:
+
+- scanned_bytes_per_vector: the matrix an exact query reads for every vector.
+- stored_bytes_per_vector: every matrix the store keeps (in memory, or on disk with a path).
+- resident_bytes_per_vector: what stays in memory. In memory that is everything stored. On
+  disk the float32 matrix kept for rescoring is only paged in for the re-ranked rows.
+- upsert_bytes_per_vector: JSON payload of the vector's values in a Pinecone upsert.
+- query_ms: median latency of an exact top-k query.
+- recall: overlap of the top-k with the float32 top-k at the same size.
+
+The vectors are synthetic: clustered, L2-normalised Gaussians, with queries drawn near
+stored vectors. They show what quantization costs in recall. The recall lost by requesting
+shorter embeddings depends on the model and must be measured on real embeddings.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from src.utils.vector_store import LocalVectorStore
+
+DEFAULT_DIMENSIONS = (1536, 512, 256)
+# Stores compared at every size: (name, quantization, rescore, on disk)
+CONFIGURATIONS = (
+    ('float32', 'float32', False, False),
+    ('float16', 'float16', False, False),
+    ('int8', 'int8', False, False),
+    ('int8_rescored', 'int8', True, False),
+    ('int8_rescored_on_disk', 'int8', True, True),
+)
+CLUSTERS = 256
+
+def synthetic_vectors(count: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, loosely shaped like text embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(CLUSTERS, dimension)).astype(np.float32)
+    values = centres[rng.integers(0, CLUSTERS, count)] + rng.normal(scale=0.8, size=(count, dimension)).astype(np.float32)
+    return values / np.linalg.norm(values, axis=1, keepdims=True)
+
+def storage_bytes(store: LocalVectorStore) -> Dict[str, int]:
+    """Bytes per vector scanned by an exact query, stored, and resident in memory."""
+    sizes = {attribute: np.dtype(dtype).itemsize * int(np.prod(columns, dtype=np.int64))
+             for attribute, (_, dtype, columns) in store._layout().items()}
+    scanned = sizes['_vectors'] if '_codes' not in sizes else sizes['_codes'] + sizes.get('_scales', 0)
+    stored = sum(sizes.values())
+    # A memory-mapped float32 matrix that is only read to rescore a shortlist is not resident
+    rescore_only = store.path and '_codes' in sizes and '_vectors' in sizes and store.ann is None
+    return {'scanned': scanned, 'stored': stored,
+            'resident': stored - sizes['_vectors'] if rescore_only else stored}
+
+def run(count: int, n_queries: int, dimensions: List[int], top_k: int) -> Dict[str, dict]:
+    results = {}
+    for dimension in dimensions:
+        values = synthetic_vectors(count, dimension)
+        rng = np.random.default_rng(1)
+        picks = rng.integers(0, count, n_queries)
+        queries = values[picks] + rng.normal(scale=0.5 / np.sqrt(dimension), size=(n_queries, dimension))
+        vectors = [{'id': str(i), 'values': row} for i, row in enumerate(values)]
+        upsert_bytes = statistics.mean(len(json.dumps(row.tolist())) for row in values[:100])
+
+        exact = None
+        for name, quantization, rescore, on_disk in CONFIGURATIONS:
+            directory = tempfile.TemporaryDirectory() if on_disk else None
+            store = LocalVectorStore(path=directory.name if directory else None, dimension=dimension,
+                                     initial_capacity=count, quantization=quantization, rescore=rescore)
+            store.upsert(vectors)
+            timings, found = [], []
+            for query in queries:
+                start = time.perf_counter()
+                matches = store.query(query, top_k=top_k)
+                timings.append(time.perf_counter() - start)
+                found.append({match['id'] for match in matches})
+            if exact is None:
+                exact = found
+            recall = statistics.mean(len(ids & truth) / len(truth) for ids, truth in zip(found, exact))
+            sizes = storage_bytes(store)
+            results.setdefault(str(dimension), {})[name] = {
+                'scanned_bytes_per_vector': sizes['scanned'],
+                'stored_bytes_per_vector': sizes['stored'],
+                'resident_bytes_per_vector': sizes['resident'],
+                'upsert_bytes_per_vector': round(upsert_bytes),
+                'query_ms': round(statistics.median(timings) * 1000, 3),
+                'recall': round(recall, 4),
+            }
+            del store
+            if directory:
+                directory.cleanup()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare embedding sizes and quantized local storage.')
+    parser.add_argument('--vectors', type=int, default=100_000, help='Stored vectors (default: %(default)s)')
+    parser.add_argument('--queries', type=int, default=200, help='Timed queries (default: %(default)s)')
+    parser.add_argument('--dimensions', default=','.join(map(str, DEFAULT_DIMENSIONS)),
+                        help='Comma-separated embedding sizes (default: %(default)s)')
+    parser.add_argument('--top-k', type=int, default=10, help='Matches per query (default: %(default)s)')
+    parser.add_argument('--output', help='Write the JSON results to this file as well')
+    args = parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'vectors': args.vectors, 'queries': args.queries, 'top_k': args.top_k},
+        'results': run(args.vectors, args.queries, [int(size) for size in args.dimensions.split(',')], args.top_k),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+Benchmarks of the ingest and query hot paths.
+
+Usage:
+    python -m benchmarks.suite [--sizes 10,100] [--repeat 3] [--latency SECONDS]
+                               [--output FILE] [--baseline FILE] [--tolerance 0.2]
+
+Runs over a synthetic corpus of legal memos at each size (number of documents), with
+the OpenAI and Pinecone clients replaced by deterministic offline fakes:
+
+- read_file.<ext>: text extraction of the corpus as .txt, .docx and .pdf files.
+- preprocess.<stage>: each stage of FileTextPreprocessor.process, summed over the corpus.
+- chunking: the chunks of every document, as ingestion computes them.
+- embedding: get_embeddings over all chunks, with an empty cache.
+- upsert: upsert_chunks of all vectors through the Pinecone backend.
+- process_query: the steps of app.process_query (exact lookup, embedding, hybrid search,
+  context building and the streamed answer) per query, without Streamlit or the answer cache.
+- batch_query: BatchQuery answering BATCH_QUESTIONS questions at once on the async clients.
+  With --latency, compare its median to process_query's: a batch should cost about as
+  much as a few single queries.
+
+Results are printed and written as JSON. With --baseline, medians are compared against a
+previous run and the exit status is 1 if any is slower by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import traceback
+from io import BytesIO
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.corpus import memos, queries, render
+from benchmarks.fakes import offline_services
+from src.batch_query import BatchQuery
+from src.context import CONTEXT_CANDIDATES, ContextBuilder, cached_embedding_lookup
+from src.data_loader import SUPPORTED_EXTENSIONS, read_file
+from src.ingestion import build_vectors, reindex_document, with_terms
+from src.preprocessor import PIPELINE_STAGES, FileTextPreprocessor, load_tokenizer, setup_nltk
+from src.retrieval import HybridRetriever
+from src.utils.bm25_index import BM25Index
+from src.utils.hash_index import DocumentHashIndex
+from src.utils.openai_utils import embedding_cache, get_embedding, get_embeddings, stream_answer
+from src.utils.pinecone_utils import delete_vectors, query_pinecone, upsert_chunks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (10, 100)
+# Queries timed per repetition of process_query
+QUERIES_PER_RUN = 20
+# Questions per batch of batch_query
+BATCH_QUESTIONS = 100
+
+def measure(fn: Callable[[], object], repeat: int, setup: Optional[Callable[[], object]] = None) -> Dict[str, float]:
+    """
+    Time ``fn`` over ``repeat`` runs, calling ``setup`` untimed before each.
+
+    Returns:
+        Dict[str, float]: Median and minimum seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {'median_s': round(statistics.median(timings), 6), 'min_s': round(min(timings), 6)}
+
+def answer_query(query: str, retriever: HybridRetriever, context_builder: ContextBuilder) -> str:
+    """The steps of app.process_query, without Streamlit and the answer cache."""
+    candidates = retriever.exact_lookup(query, top_k=CONTEXT_CANDIDATES)
+    if candidates is None:
+        candidates = retriever.search(query, get_embedding(query), top_k=CONTEXT_CANDIDATES)
+    context, _ = context_builder.build(query, candidates)
+    return ''.join(stream_answer(query, context))
+
+class Suite:
+    def __init__(self, repeat: int = 3, latency: float = 0.0, preprocessor_factory: Optional[Callable] = None):
+        """
+        Runs the benchmarks and collects their results.
+
+        Args:
+            repeat (int): Runs per measurement; the median is reported.
+            latency (float): Simulated network latency of each fake request, in seconds.
+            preprocessor_factory (Callable, optional): Builds the preprocessor. Defaults to the
+                production one (baked tokenizer and NLTK data).
+        """
+        self.repeat = repeat
+        self.latency = latency
+        self.preprocessor_factory = preprocessor_factory or self._default_preprocessor
+        self.results: Dict[str, Dict[str, dict]] = {}
+        self.errors: Dict[str, str] = {}
+
+    @staticmethod
+    def _default_preprocessor() -> FileTextPreprocessor:
+        setup_nltk()
+        return FileTextPreprocessor(load_tokenizer(), chunking='structure')
+
+    def record(self, name: str, size: int, result: dict):
+        self.results.setdefault(name, {})[str(size)] = result
+
+    def attempt(self, name: str, size: int, benchmark: Callable[[], None]) -> bool:
+        """Run one benchmark; a failure is recorded under ``errors`` and the rest still run."""
+        try:
+            benchmark()
+            return True
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            self.errors[f"{name}[{size}]"] = f"{type(e).__name__}: {e}"
+            return False
+
+    def run(self, sizes: List[int]):
+        preprocessor = None
+        try:
+            preprocessor = self.preprocessor_factory()
+        except Exception as e:
+            self.errors['preprocessor'] = f"{type(e).__name__}: {e}"
+
+        for size in sizes:
+            documents = memos(size)
+            for extension in SUPPORTED_EXTENSIONS:
+                self.attempt(f"read_file{extension}", size, lambda: self.bench_read_file(documents, extension, size))
+            if preprocessor is None:
+                continue
+            self.attempt('preprocess', size, lambda: self.bench_preprocess(documents, preprocessor, size))
+            chunks = {}
+            if self.attempt('chunking', size, lambda: chunks.update(self.bench_chunking(documents, preprocessor, size))):
+                self.attempt('embedding_upsert', size, lambda: self.bench_embedding_upsert(chunks, size))
+                self.attempt('process_query', size, lambda: self.bench_process_query(chunks, preprocessor, size))
+                self.attempt('batch_query', size, lambda: self.bench_batch_query(chunks, preprocessor, size))
+
+    def bench_read_file(self, documents, extension: str, size: int):
+        files = [(name.replace('.txt', extension), render(text, extension)) for name, text in documents]
+        total_bytes = sum(len(content) for _, content in files)
+
+        def read_all():
+            for name, content in files:
+                read_file(BytesIO(content), name)
+
+        result = measure(read_all, self.repeat)
+        result['docs_per_s'] = round(len(files) / result['median_s'], 2)
+        result['mb_per_s'] = round(total_bytes / 1e6 / result['median_s'], 2)
+        self.record(f"read_file{extension}", size, result)
+
+    def bench_preprocess(self, documents, preprocessor: FileTextPreprocessor, size: int):
+        runs = {stage: [] for stage in PIPELINE_STAGES}
+        for _ in range(self.repeat):
+            totals = dict.fromkeys(PIPELINE_STAGES, 0.0)
+            for _, text in documents:
+                document = preprocessor.process(text)
+                for stage in PIPELINE_STAGES:
+                    document.get(stage)
+                for stage, seconds in document.timings.items():
+                    totals[stage] += seconds
+            for stage, seconds in totals.items():
+                runs[stage].append(seconds)
+        for stage, timings in runs.items():
+            self.record(f"preprocess.{stage}", size, {'median_s': round(statistics.median(timings), 6),
+                                                      'min_s': round(min(timings), 6)})
+
+    def bench_chunking(self, documents, preprocessor: FileTextPreprocessor, size: int) -> dict:
+        chunks = {}
+
+        def chunk_all():
+            for name, text in documents:
+                chunks[name] = preprocessor.process(text, outputs=('chunks',)).chunks
+
+        result = measure(chunk_all, self.repeat)
+        n_chunks = sum(len(document_chunks) for document_chunks in chunks.values())
+        result['chunks'] = n_chunks
+        result['chunks_per_s'] = round(n_chunks / result['median_s'], 2)
+        self.record('chunking', size, result)
+        return chunks
+
+    def bench_embedding_upsert(self, chunks: dict, size: int):
+        texts = [chunk.text for document_chunks in chunks.values() for chunk in document_chunks]
+        with offline_services(latency=self.latency) as fakes:
+            result = measure(lambda: get_embeddings(texts), self.repeat,
+                             setup=embedding_cache.clear)
+            result['requests_per_run'] = fakes.openai.requests // self.repeat
+            result['chunks_per_s'] = round(len(texts) / result['median_s'], 2)
+            self.record('embedding', size, result)
+
+            embeddings = iter(get_embeddings(texts))
+            vectors = []
+            for name, document_chunks in chunks.items():
+                vectors.extend(build_vectors(document_chunks, [next(embeddings) for _ in document_chunks], name, name))
+            fakes.index.requests = 0
+            result = measure(lambda: upsert_chunks(vectors), self.repeat)
+            result['requests_per_run'] = fakes.index.requests // self.repeat
+            result['vectors_per_s'] = round(len(vectors) / result['median_s'], 2)
+            self.record('upsert', size, result)
+
+    def bench_process_query(self, chunks: dict, preprocessor: FileTextPreprocessor, size: int):
+        with offline_services(latency=self.latency):
+            term_index, hash_index = BM25Index(), DocumentHashIndex()
+            for name, document_chunks in chunks.items():
+                reindex_document(name, name, with_terms(document_chunks, preprocessor.tokenize_texts), hash_index,
+                                 get_embeddings, upsert_chunks, delete_vectors, None, term_index)
+            retriever = HybridRetriever(term_index, preprocessor.tokenize_text, query_pinecone)
+            context_builder = ContextBuilder(embedding_lookup=cached_embedding_lookup())
+
+            # Fresh questions in every run, so query embeddings are never cached
+            questions = queries(QUERIES_PER_RUN * self.repeat)
+            latencies = []
+            for run in range(self.repeat):
+                for question in questions[run * QUERIES_PER_RUN:(run + 1) * QUERIES_PER_RUN]:
+                    start = time.perf_counter()
+                    answer_query(question, retriever, context_builder)
+                    latencies.append(time.perf_counter() - start)
+            hash_index.close()
+
+        latencies.sort()
+        self.record('process_query', size, {
+            'median_s': round(statistics.median(latencies), 6),
+            'min_s': round(latencies[0], 6),
+            'p95_s': round(latencies[int(0.95 * (len(latencies) - 1))], 6),
+            'queries_per_s': round(len(latencies) / sum(latencies), 2),
+        })
+
+    def bench_batch_query(self, chunks: dict, preprocessor: FileTextPreprocessor, size: int):
+        with offline_services(latency=self.latency) as fakes:
+            term_index, hash_index = BM25Index(), DocumentHashIndex()
+            for name, document_chunks in chunks.items():
+                reindex_document(name, name, with_terms(document_chunks, preprocessor.tokenize_texts), hash_index,
+                                 get_embeddings, upsert_chunks, delete_vectors, None, term_index)
+            retriever = HybridRetriever(term_index, preprocessor.tokenize_text, query_pinecone)
+            context_builder = ContextBuilder(embedding_lookup=cached_embedding_lookup())
+
+            async def answer_all(questions: List[str]):
+                return [result async for result in BatchQuery(retriever, context_builder).answers(questions)]
+
+            # Fresh questions in every run, so query embeddings are never cached
+            batches = iter([queries(BATCH_QUESTIONS, seed=run) for run in range(self.repeat)])
+            fakes.async_openai.requests = 0
+            result = measure(lambda: asyncio.run(answer_all(next(batches))), self.repeat)
+            result['questions'] = BATCH_QUESTIONS
+            result['openai_requests_per_run'] = fakes.async_openai.requests // self.repeat
+            result['questions_per_s'] = round(BATCH_QUESTIONS / result['median_s'], 2)
+            hash_index.close()
+        self.record('batch_query', size, result)
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Compare median times with a baseline run.
+
+    Args:
+        results (dict): 'results' of this run.
+        baseline (dict): 'results' of the baseline run.
+        tolerance (float): Allowed slowdown, as a fraction of the baseline median.
+
+    Returns:
+        List[str]: One line per regression, e.g. "chunking[100]: 0.120s -> 0.180s (+50%)".
+    """
+    regressions = []
+    for name, by_size in results.items():
+        for size, result in by_size.items():
+            before = baseline.get(name, {}).get(size, {}).get('median_s')
+            after = result.get('median_s')
+            if before and after and after > before * (1 + tolerance):
+                regressions.append(f"{name}[{size}]: {before:.3f}s -> {after:.3f}s (+{after / before - 1:.0%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ingest and query hot paths with offline fakes.')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma-separated corpus sizes, in documents (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Simulated seconds per OpenAI/Pinecone request (default: %(default)s)')
+    parser.add_argument('--output', help='Write the JSON results to this file as well')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown against the baseline reported as a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    suite = Suite(repeat=args.repeat, latency=args.latency)
+    suite.run([int(size) for size in args.sizes.split(',')])
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'sizes': args.sizes, 'repeat': args.repeat, 'latency': args.latency},
+        'results': suite.results,
+        'errors': suite.errors,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(suite.results, json.load(file)['results'], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
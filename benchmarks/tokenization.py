@@ -0,0 +1,141 @@
+"""
+Benchmark of FileTextPreprocessor.tokenize_text against the NLTK pipeline it replaced.
+
+Usage:
+    python -m benchmarks.tokenization [--megabytes 1] [--repeat 3] [--output FILE]
+
+Both pipelines tokenize the same synthetic document of the given size, built from the
+benchmark corpus:
+
+- nltk: word_tokenize, lowercasing, stopword removal and WordNet lemmatization in three
+  passes, with the stopword set and the lemmatizer built on every call, as before.
+- regex_lru: tokenize_text, a compiled word pattern and a per-preprocessor lru_cache of
+  each distinct token's lemma. Every run starts from a new preprocessor, so the cache is cold.
+
+When the NLTK corpora (punkt, stopwords, wordnet) are not installed, both pipelines use
+the same stand-ins, and the report says so under 'corpora': the Treebank word tokenizer
+without punkt's sentence splitting, STAND_IN_STOPWORDS, and the Porter stemmer instead of
+WordNet. The corpus repeats a small vocabulary, so the cache hits more often than it
+would on real documents.
+"""
+import argparse
+import json
+import platform
+from contextlib import ExitStack
+from typing import Callable, List
+from unittest import mock
+
+import nltk
+from nltk.stem import PorterStemmer
+from nltk.tokenize import NLTKWordTokenizer
+
+from benchmarks.corpus import memo
+from benchmarks.suite import git_commit, measure
+from src import preprocessor as preprocessor_module
+from src.preprocessor import FileTextPreprocessor
+
+# Frequent English function words, used when NLTK's stopword list is not installed
+STAND_IN_STOPWORDS = (
+    'a', 'about', 'after', 'all', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'been', 'before', 'but', 'by',
+    'can', 'do', 'does', 'each', 'for', 'from', 'had', 'has', 'have', 'he', 'her', 'his', 'if', 'in', 'into',
+    'is', 'it', 'its', 'may', 'more', 'no', 'not', 'of', 'on', 'or', 'other', 'our', 'out', 'over', 'same',
+    'she', 'should', 'so', 'some', 'such', 'than', 'that', 'the', 'their', 'them', 'then', 'there', 'these',
+    'they', 'this', 'those', 'to', 'under', 'until', 'up', 'upon', 'was', 'we', 'were', 'what', 'when',
+    'which', 'while', 'who', 'will', 'with', 'would', 'you',
+)
+
+def corpora_installed() -> bool:
+    """Return True if the NLTK data both pipelines need is installed."""
+    for resource in ('tokenizers/punkt_tab', 'corpora/stopwords', 'corpora/wordnet'):
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            return False
+    return True
+
+class _StandInStopwords:
+    @staticmethod
+    def words(language: str) -> List[str]:
+        return list(STAND_IN_STOPWORDS)
+
+class _StandInLemmatizer:
+    def __init__(self):
+        self._stemmer = PorterStemmer()
+
+    def lemmatize(self, token: str) -> str:
+        return self._stemmer.stem(token)
+
+def _stand_in_word_tokenize(text: str) -> List[str]:
+    return NLTKWordTokenizer().tokenize(text)
+
+def document(megabytes: float) -> str:
+    """A synthetic document of about ``megabytes`` MB, made of consecutive corpus memos."""
+    size = int(megabytes * 1_000_000)
+    memos, length, index = [], 0, 0
+    while length < size:
+        memos.append(memo(index))
+        length += len(memos[-1]) + 2
+        index += 1
+    return '\n\n'.join(memos)[:size]
+
+def nltk_pipeline(word_tokenize: Callable[[str], List[str]], stopwords, lemmatizer_class) -> Callable[[str], List[str]]:
+    """The tokenize_text of before the single-pass rewrite, on the given NLTK pieces."""
+    def tokenize_text(text: str) -> List[str]:
+        tokens = word_tokenize(text)
+        tokens = [token.lower() for token in tokens]
+        stop_words = set(stopwords.words('english'))
+        tokens = [token for token in tokens if token not in stop_words]
+        lemmatizer = lemmatizer_class()
+        return [lemmatizer.lemmatize(token) for token in tokens]
+    return tokenize_text
+
+def run(megabytes: float = 1.0, repeat: int = 3) -> dict:
+    """
+    Time both pipelines on one document.
+
+    Returns:
+        dict: Per pipeline, median and minimum seconds and tokens per second, plus the
+            speedup of regex_lru over nltk (ratio of the medians).
+    """
+    text = document(megabytes)
+    installed = corpora_installed()
+    with ExitStack() as stack:
+        if installed:
+            old = nltk_pipeline(nltk.word_tokenize, nltk.corpus.stopwords, nltk.stem.WordNetLemmatizer)
+        else:
+            stack.enter_context(mock.patch.object(preprocessor_module, 'stopwords', _StandInStopwords()))
+            stack.enter_context(mock.patch.object(preprocessor_module, 'WordNetLemmatizer', _StandInLemmatizer))
+            old = nltk_pipeline(_stand_in_word_tokenize, _StandInStopwords(), _StandInLemmatizer)
+        preprocessors = []
+        tokens = {'nltk': len(old(text)), 'regex_lru': len(FileTextPreprocessor(None).tokenize_text(text))}
+        results = {
+            'nltk': measure(lambda: old(text), repeat),
+            'regex_lru': measure(lambda: preprocessors[-1].tokenize_text(text), repeat,
+                                 setup=lambda: preprocessors.append(FileTextPreprocessor(None))),
+        }
+    for name, result in results.items():
+        result['tokens'] = tokens[name]
+        result['tokens_per_s'] = round(tokens[name] / result['median_s'])
+    return {
+        'corpora': 'nltk' if installed else 'stand-ins',
+        'bytes': len(text.encode()),
+        'results': results,
+        'speedup': round(results['nltk']['median_s'] / results['regex_lru']['median_s'], 2),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare tokenize_text with the NLTK pipeline it replaced.')
+    parser.add_argument('--megabytes', type=float, default=1.0, help='Document size (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per pipeline (default: %(default)s)')
+    parser.add_argument('--output', help='Write the JSON results to this file as well')
+    args = parser.parse_args(argv)
+
+    report = {'commit': git_commit(), 'python': platform.python_version(), **run(args.megabytes, args.repeat)}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,42 @@
-from fastapi import FastAPI, File, HTTPException, UploadFile
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from transformers import LongformerTokenizer
 
-from src.data_loader import read_file
-from src.preprocessor import FileTextPreprocessor, setup_nltk
-from src.utils.openai_utils import generate_answer, get_embedding
-from src.utils.pinecone_utils import query_pinecone, upsert_chunks
+from src.context import CONTEXT_CANDIDATES, build_context
+from src.ingestion import IngestionWorker
+from src.preprocessor import setup_nltk
+from src.utils.hash_index import DocumentHashIndex
+from src.utils.job_queue import JobQueue
+from src.utils.openai_utils import generate_answer, get_embedding, get_embeddings, stream_answer
+from src.utils.pinecone_utils import delete_vectors, query_pinecone, upsert_chunks
 
 # Setup NLTK
 setup_nltk()
 
-# Initialise tokenizer
-tokenizer = LongformerTokenizer.from_pretrained("allenai/longformer-base-4096")
-
-# Initialise preprocessor
-preprocessor = FileTextPreprocessor(tokenizer)
+# Uploads are queued and ingested in the background. The queue file is shared with the
+# Streamlit app, but this API's jobs are kept apart and only run by its own worker,
+# which has no BM25 index; the app's jobs are only run by the app.
+hash_index = DocumentHashIndex(os.environ.get('LUTHOR_INDEX_PATH', 'luthor_index.sqlite'))
+job_queue = JobQueue(os.environ.get('LUTHOR_JOB_QUEUE_PATH', 'luthor_jobs.sqlite'), consumer='legacy_api',
+                     is_stored=hash_index.has_document)
+ingestion_worker = IngestionWorker(job_queue, get_embeddings, upsert_chunks, hash_index, delete_vectors)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ingestion_worker.start()
+    try:
+        yield
+    finally:
+        ingestion_worker.stop()
 
 # Initialise FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware if needed
 app.add_middleware(
@@ -32,31 +49,38 @@ app.add_middleware(
 
 class QueryRequest(BaseModel):
     question: str
+    stream: bool = False
+
+def server_sent_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to the FastAPI app!"}
 
+# The endpoints below are plain functions so FastAPI runs their blocking calls in its
+# thread pool; see src/api.py for the asynchronous service.
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+def upload_file(file: UploadFile = File(...), document_key: Optional[str] = Form(None)):
     try:
-        # Load the document
-        text = read_file(file)
-
-        # Preprocess the document
-        # original_text, segments, cleaned_text, tokens, structured_text, chunks = preprocessor.preprocess_doc(text)
-        chunks = preprocessor.preprocess_doc(text)
-
-        # Generate embeddings and upsert into Pinecone
-        upsert_chunks(chunks, get_embedding)
-
-        return JSONResponse(content={"message": "File processed and stored successfully"}, status_code=200)
+        # Queue the document and return at once; poll /jobs/{job_id} for its progress.
+        # Uploading the same content again returns its existing job. document_key names
+        # the document this file is a new version of; without it the file is a new document.
+        job = job_queue.enqueue(file.filename, file.file.read(), document_key)
+        return JSONResponse(content={"job_id": job.id, "status": job.status}, status_code=202)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return {field: value for field, value in job._asdict().items() if field != 'owner'}
+
 @app.post("/query")
-async def query_database(query_request: QueryRequest):
+def query_database(query_request: QueryRequest, request: Request):
     try:
         question = query_request.question
 
@@ -64,10 +88,27 @@ async def query_database(query_request: QueryRequest):
         query_embedding = get_embedding(question)
 
         # Query Pinecone
-        matches = query_pinecone(query_embedding)
-
-        # Extract context from matches
-        context = " ".join(match['metadata']['text'] for match in matches)
+        candidates = query_pinecone(query_embedding, top_k=CONTEXT_CANDIDATES)
+
+        # Keep the most relevant, non-redundant matches that fit the context budget
+        context, matches = build_context(question, candidates)
+
+        if query_request.stream or "text/event-stream" in request.headers.get("accept", ""):
+            sources = sorted(set(match['metadata'].get('file_name', 'Unknown File') for match in matches))
+
+            def events():
+                # Sources are known before generation starts, so send them first
+                yield server_sent_event("sources", sources)
+                try:
+                    for token in stream_answer(question, context):
+                        yield server_sent_event("token", token)
+                except Exception as e:
+                    yield server_sent_event("error", str(e))
+                    return
+                yield server_sent_event("done", None)
+
+            return StreamingResponse(events(), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
         # Generate answer
         answer = generate_answer(question, context)
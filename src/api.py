@@ -0,0 +1,299 @@
+"""
+Production HTTP API.
+
+Usage:
+    uvicorn src.api:app --host 0.0.0.0 --port 8000
+
+Queries run on the asyncio OpenAI and Pinecone clients, whose pooled connections are
+shared by every request, so one process serves many queries concurrently. Parsing and
+chunking of uploads run in a process pool, and embedding/upserting in worker threads,
+so the event loop never blocks. Concurrency is bounded by API_MAX_CONCURRENT_QUERIES
+and API_MAX_CONCURRENT_UPLOADS; requests that wait longer than API_QUEUE_TIMEOUT
+seconds for a slot are rejected with 503 and a Retry-After header. A /query/batch request
+holds a single slot and bounds its own concurrency (see src.batch_query).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+
+from src.batch_query import BatchQuery, chunk_record
+from src.context import CONTEXT_CANDIDATES, CONTEXT_TOKEN_BUDGET, ContextBuilder, cached_embedding_lookup
+from src.ingestion import default_preprocessor, parse_document, parse_pool, reindex_document
+from src.retrieval import HybridRetriever, reciprocal_rank_fusion
+from src.utils.bm25_index import BM25Index
+from src.utils.exceptions import DatabaseConnectionError
+from src.utils.hash_index import DocumentHashIndex, document_id
+from src.utils.openai_utils import (agenerate_answer, aget_embedding, astream_answer, close_async_client,
+                                    get_embeddings)
+from src.utils.pinecone_utils import aquery_pinecone, close_async_index, delete_vectors, query_pinecone, upsert_chunks
+from src.utils.telemetry import PROMETHEUS_CONTENT_TYPE, metrics, record_duration
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_QUERIES = int(os.environ.get('API_MAX_CONCURRENT_QUERIES', 64))
+MAX_CONCURRENT_UPLOADS = int(os.environ.get('API_MAX_CONCURRENT_UPLOADS', 4))
+QUEUE_TIMEOUT = float(os.environ.get('API_QUEUE_TIMEOUT', 10))
+MAX_BATCH_QUESTIONS = int(os.environ.get('API_MAX_BATCH_QUESTIONS', 1000))
+TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', CONTEXT_TOKEN_BUDGET))
+
+class QueryRequest(BaseModel):
+    question: str
+    filters: Optional[dict] = None
+    top_k: int = CONTEXT_CANDIDATES
+    stream: bool = False
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    filters: Optional[dict] = None
+    top_k: int = CONTEXT_CANDIDATES
+    stream: bool = True
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int, queue_timeout: float = QUEUE_TIMEOUT):
+        """
+        Bounds the number of requests doing work at once.
+
+        Args:
+            limit (int): Maximum number of concurrent holders.
+            queue_timeout (float): Seconds a request may wait for a slot before it is rejected.
+        """
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self):
+        """
+        Wait for a slot.
+
+        Raises:
+            HTTPException: 503 with a Retry-After header if no slot frees up in time.
+        """
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail='Server busy, please retry.', headers={'Retry-After': '1'})
+
+    def release(self):
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+def list_sources(matches: List[dict]) -> List[str]:
+    """File names of the matches, without duplicates, best match first."""
+    return list(dict.fromkeys(match['metadata'].get('file_name', 'Unknown File') for match in matches))
+
+def server_sent_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def create_app(embed_fn: Callable[[List[str]], List[List[float]]] = get_embeddings,
+               upsert_fn: Callable[[List[dict]], object] = upsert_chunks,
+               delete_fn: Optional[Callable[[List[str]], object]] = delete_vectors,
+               preprocessor_factory: Callable = default_preprocessor,
+               hash_index: Optional[DocumentHashIndex] = None,
+               term_index: Optional[BM25Index] = None,
+               parse_workers: Optional[int] = None,
+               max_concurrent_queries: int = MAX_CONCURRENT_QUERIES,
+               max_concurrent_uploads: int = MAX_CONCURRENT_UPLOADS) -> FastAPI:
+    """
+    Build the API application.
+
+    Args:
+        embed_fn (Callable): Embeds a list of texts for uploads.
+        upsert_fn (Callable): Stores a list of vectors.
+        delete_fn (Callable, optional): Deletes stale vectors when a document changes.
+        preprocessor_factory (Callable): Builds the preprocessor in each parsing process.
+        hash_index (DocumentHashIndex, optional): Index of ingested documents. Defaults to
+            the file named by LUTHOR_INDEX_PATH, as in the Streamlit app.
+        term_index (BM25Index, optional): BM25 index fused with vector search. Defaults to
+            the directory named by LUTHOR_TERM_INDEX_PATH.
+        parse_workers (int, optional): Parsing processes; defaults to the CPU count.
+        max_concurrent_queries (int): Queries answered at once.
+        max_concurrent_uploads (int): Uploads processed at once.
+
+    Returns:
+        FastAPI: The application.
+    """
+    context_builder = ContextBuilder(TOKEN_BUDGET, embedding_lookup=cached_embedding_lookup())
+    query_limiter = ConcurrencyLimiter(max_concurrent_queries)
+    upload_limiter = ConcurrencyLimiter(max_concurrent_uploads)
+    state = {}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        state['pool'] = parse_pool(preprocessor_factory, parse_workers, terms=True)
+        state['hash_index'] = (hash_index if hash_index is not None
+                              else DocumentHashIndex(os.environ.get('LUTHOR_INDEX_PATH', 'luthor_index.sqlite')))
+        state['term_index'] = (term_index if term_index is not None
+                              else BM25Index(os.environ.get('LUTHOR_TERM_INDEX_PATH', 'luthor_terms')))
+        # Queries are split into terms by the same pipeline as the indexed chunks
+        preprocessor = await asyncio.to_thread(preprocessor_factory)
+        state['retriever'] = HybridRetriever(state['term_index'], preprocessor.tokenize_text, query_pinecone)
+        try:
+            yield
+        finally:
+            state['pool'].shutdown()
+            if hash_index is None:
+                state['hash_index'].close()
+            await close_async_client()
+            await close_async_index()
+
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    async def retrieve(question: str, filters: Optional[dict], top_k: int) -> List[dict]:
+        retriever = state['retriever']
+        # Quoted phrases and citations are answered locally, without an embedding call
+        matches = await asyncio.to_thread(retriever.exact_lookup, question, filters, top_k)
+        if matches is not None:
+            return matches
+        query_embedding, lexical_matches = await asyncio.gather(
+            aget_embedding(question), asyncio.to_thread(retriever.lexical_search, question, filters, top_k))
+        vector_matches = await aquery_pinecone(query_embedding, filters=filters, top_k=top_k)
+        return reciprocal_rank_fusion([vector_matches, lexical_matches], retriever.rrf_k)[:top_k]
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/metrics")
+    async def prometheus_metrics():
+        return Response(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.post("/upload")
+    async def upload_file(file: UploadFile = File(...), document_key: Optional[str] = Form(None)):
+        # document_key names the document this file is a new version of; without it the file is a new document
+        content = await file.read()
+        file_hash = hashlib.md5(content).hexdigest()
+        index = state['hash_index']
+        if await asyncio.to_thread(index.has_document, file_hash):
+            raise HTTPException(status_code=409, detail=f"Document '{file.filename}' has already been processed.")
+
+        async with upload_limiter.slot():
+            loop = asyncio.get_running_loop()
+            try:
+                chunks, fingerprint, elapsed = await loop.run_in_executor(state['pool'], parse_document,
+                                                                          file.filename, content)
+            except ValueError as e:
+                raise HTTPException(status_code=415, detail=str(e))
+            record_duration('parse', elapsed)
+            try:
+                stats = await asyncio.to_thread(reindex_document, file_hash, file.filename, chunks, index,
+                                                embed_fn, upsert_fn, delete_fn, fingerprint, state['term_index'],
+                                                document_id(document_key) if document_key else None)
+                await asyncio.to_thread(state['term_index'].save)
+            except DatabaseConnectionError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+
+        logger.info(f"Processed {file.filename}: {len(chunks)} chunks, {stats.embedded} embedded")
+        return {"message": "File processed and stored successfully", "chunks": len(chunks),
+                "embedded": stats.embedded, "unchanged": stats.unchanged, "deleted": stats.deleted}
+
+    @app.post("/query")
+    async def query_database(query_request: QueryRequest, request: Request):
+        question = query_request.question.strip()
+        if not question:
+            raise HTTPException(status_code=400, detail="Please enter a valid query.")
+
+        await query_limiter.acquire()
+        try:
+            candidates = await retrieve(question, query_request.filters, query_request.top_k)
+            context, matches = context_builder.build(question, candidates)
+        except DatabaseConnectionError as e:
+            query_limiter.release()
+            raise HTTPException(status_code=503, detail=str(e))
+        except BaseException:
+            query_limiter.release()
+            raise
+
+        sources = list_sources(matches)
+
+        if query_request.stream or "text/event-stream" in request.headers.get("accept", ""):
+            async def events():
+                # The slot is held until the last token has been sent
+                try:
+                    yield server_sent_event("sources", sources)
+                    async for token in astream_answer(question, context):
+                        yield server_sent_event("token", token)
+                    yield server_sent_event("done", None)
+                except Exception as e:
+                    logger.error(f"Error streaming answer: {str(e)}")
+                    yield server_sent_event("error", str(e))
+                finally:
+                    query_limiter.release()
+
+            return StreamingResponse(events(), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        try:
+            answer = await agenerate_answer(question, context)
+        finally:
+            query_limiter.release()
+        return {"answer": answer, "sources": sources}
+
+    @app.post("/query/batch")
+    async def query_batch(batch_request: BatchQueryRequest):
+        questions = [question.strip() for question in batch_request.questions]
+        if not questions or not all(questions):
+            raise HTTPException(status_code=400, detail="Please enter a valid query for every question.")
+        if len(questions) > MAX_BATCH_QUESTIONS:
+            raise HTTPException(status_code=400,
+                                detail=f"A batch may hold at most {MAX_BATCH_QUESTIONS} questions.")
+
+        # A batch holds one query slot; its own concurrency is bounded by BatchQuery
+        await query_limiter.acquire()
+        batch = BatchQuery(state['retriever'], context_builder)
+        results = batch.answers(questions, batch_request.filters, batch_request.top_k)
+
+        if batch_request.stream:
+            async def events():
+                sent = set()
+                try:
+                    async for result in results:
+                        # Chunks are sent once, before the first result citing them
+                        for chunk_id in result.chunk_ids:
+                            if chunk_id not in sent:
+                                sent.add(chunk_id)
+                                yield server_sent_event("chunk", chunk_record(chunk_id, batch.chunks[chunk_id]))
+                        yield server_sent_event("result", result._asdict())
+                    yield server_sent_event("done", None)
+                except Exception as e:
+                    logger.error(f"Error streaming batch answers: {str(e)}")
+                    yield server_sent_event("error", str(e))
+                finally:
+                    await results.aclose()
+                    query_limiter.release()
+
+            return StreamingResponse(events(), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        try:
+            answers = [result async for result in results]
+        finally:
+            query_limiter.release()
+        return {"results": [result._asdict() for result in sorted(answers, key=lambda result: result.index)],
+                "chunks": {chunk_id: chunk_record(chunk_id, metadata) for chunk_id, metadata in batch.chunks.items()}}
+
+    return app
+
+app = create_app()
@@ -0,0 +1,61 @@
+"""
+Bake the runtime assets into a directory at build time.
+
+Usage:
+    python -m src.assets [DIR]
+
+Writes the chunking tokenizer as a single tokenizer.json, the NLTK stopwords and
+WordNet corpora, and the tiktoken encoding used to count context tokens. Point
+LUTHOR_ASSETS_DIR at DIR, NLTK_DATA at DIR/nltk_data and TIKTOKEN_CACHE_DIR at
+DIR/tiktoken, and the app starts without downloading anything.
+"""
+import argparse
+import logging
+import os
+
+import nltk
+
+from src.context import CONTEXT_ENCODING
+from src.preprocessor import ASSETS_DIR, NLTK_RESOURCES, TOKENIZER_FILE, TOKENIZER_NAME
+
+logger = logging.getLogger(__name__)
+
+def bake_tokenizer(assets_dir: str, name: str = TOKENIZER_NAME) -> str:
+    """Save the fast Hugging Face tokenizer as tokenizer.json, loadable without transformers."""
+    from transformers import AutoTokenizer
+
+    path = os.path.join(assets_dir, TOKENIZER_FILE)
+    AutoTokenizer.from_pretrained(name, use_fast=True).backend_tokenizer.save(path)
+    return path
+
+def bake_nltk(assets_dir: str) -> str:
+    """Download the preprocessor's NLTK resources into assets_dir/nltk_data."""
+    path = os.path.join(assets_dir, 'nltk_data')
+    for resource in NLTK_RESOURCES:
+        if not nltk.download(resource, download_dir=path, quiet=True):
+            raise RuntimeError(f"Could not download the NLTK resource {resource}")
+    return path
+
+def bake_tiktoken(assets_dir: str, encoding: str = CONTEXT_ENCODING) -> str:
+    """Fetch the tiktoken encoding into assets_dir/tiktoken, tiktoken's on-disk cache."""
+    import tiktoken
+
+    path = os.path.join(assets_dir, 'tiktoken')
+    os.makedirs(path, exist_ok=True)
+    # tiktoken reads the cache location when an encoding is first loaded
+    os.environ['TIKTOKEN_CACHE_DIR'] = path
+    tiktoken.get_encoding(encoding)
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bake tokenizers and NLTK data for an offline, fast start.')
+    parser.add_argument('path', nargs='?', default=ASSETS_DIR, help='Assets directory (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    os.makedirs(args.path, exist_ok=True)
+    for bake in (bake_tokenizer, bake_nltk, bake_tiktoken):
+        logger.info(f"{bake.__name__}: wrote {bake(args.path)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Batch question answering.
+
+Usage:
+    python -m src.batch_query QUESTIONS [--output FILE] [--top-k N] [--concurrency N] [--term-index DIR]
+
+QUESTIONS is a text file with one question per line. Results are written as JSON lines
+in the order they finish: a 'chunk' record the first time a context chunk is used, and
+an 'answer' record per question that refers to its chunks by ID.
+
+A batch costs far less than its questions answered one by one. All questions are
+embedded in one request and retrieved concurrently, identical questions are answered
+once, and answers are generated concurrently, at most BATCH_CONCURRENCY at a time.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+
+from src.context import CONTEXT_CANDIDATES, CONTEXT_TOKEN_BUDGET, ContextBuilder, cached_embedding_lookup
+from src.retrieval import HybridRetriever, reciprocal_rank_fusion
+from src.utils.embedding_cache import normalize_text
+from src.utils.openai_utils import agenerate_answer, aget_embeddings, close_async_client
+from src.utils.pinecone_utils import aquery_pinecone, close_async_index, query_pinecone
+from src.utils.telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Answers generated at once by one batch
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 16))
+# Vector and BM25 searches in flight at once by one batch
+BATCH_RETRIEVAL_CONCURRENCY = int(os.environ.get('BATCH_RETRIEVAL_CONCURRENCY', 32))
+# Metadata of a context chunk reported with batch results
+CHUNK_FIELDS = ('file_name', 'section', 'text')
+
+class BatchAnswer(NamedTuple):
+    index: int
+    question: str
+    answer: Optional[str]
+    # IDs of the context chunks, best first; their metadata is in BatchQuery.chunks
+    chunk_ids: List[str]
+    sources: List[str]
+    error: Optional[str] = None
+
+def chunk_record(chunk_id: str, metadata: dict) -> dict:
+    """The reported fields of a context chunk."""
+    return {'id': chunk_id, **{field: metadata[field] for field in CHUNK_FIELDS if field in metadata}}
+
+class BatchQuery:
+    def __init__(self, retriever: HybridRetriever, context_builder: ContextBuilder,
+                 concurrency: int = BATCH_CONCURRENCY, retrieval_concurrency: int = BATCH_RETRIEVAL_CONCURRENCY):
+        """
+        Answers a batch of questions with shared embedding, retrieval and context.
+
+        Args:
+            retriever (HybridRetriever): Supplies exact lookups, BM25 search and the RRF constant.
+            context_builder (ContextBuilder): Packs each question's context.
+            concurrency (int): Answers generated at once.
+            retrieval_concurrency (int): Questions retrieved at once.
+        """
+        self.retriever = retriever
+        self.context_builder = context_builder
+        self.concurrency = concurrency
+        self.retrieval_concurrency = retrieval_concurrency
+        # Every context chunk used by the batch, stored once however many answers cite it
+        self.chunks: Dict[str, dict] = {}
+
+    async def answers(self, questions: List[str], filters: Optional[dict] = None,
+                      top_k: int = CONTEXT_CANDIDATES) -> AsyncIterator[BatchAnswer]:
+        """
+        Answer the questions, yielding each answer as soon as it is ready.
+
+        A question that fails yields a BatchAnswer with its error; the others carry on.
+
+        Args:
+            questions (List[str]): The questions.
+            filters (dict, optional): Pinecone-style metadata filter applied to every question.
+            top_k (int): Candidates retrieved per question.
+
+        Yields:
+            BatchAnswer: One per question, in completion order.
+        """
+        # Questions differing only in whitespace are answered once
+        positions: Dict[str, List[int]] = {}
+        for i, question in enumerate(questions):
+            positions.setdefault(normalize_text(question), []).append(i)
+        unique = list(positions)
+
+        with span('batch', activate=False, questions=len(questions), unique=len(unique)):
+            # Quoted phrases and citations are answered locally, without an embedding
+            exact = await asyncio.to_thread(
+                lambda: [self.retriever.exact_lookup(question, filters, top_k) for question in unique])
+            to_embed = [question for question, matches in zip(unique, exact) if matches is None]
+            embeddings = asyncio.ensure_future(aget_embeddings(to_embed)) if to_embed else None
+            embedding_index = {question: i for i, question in enumerate(to_embed)}
+            retrieval = asyncio.Semaphore(self.retrieval_concurrency)
+            generation = asyncio.Semaphore(self.concurrency)
+
+            async def answer(question: str, matches: Optional[List[dict]]):
+                try:
+                    if matches is None:
+                        async with retrieval:
+                            matches = await self._retrieve(question, embeddings, embedding_index[question],
+                                                           filters, top_k)
+                    context, selected = await asyncio.to_thread(self.context_builder.build, question, matches)
+                    async with generation:
+                        text = await agenerate_answer(question, context)
+                except Exception as e:
+                    logger.error(f"Error answering batch question {question!r}: {str(e)}")
+                    return question, None, [], str(e)
+                for match in selected:
+                    self.chunks.setdefault(match['id'], match['metadata'])
+                return question, text, selected, None
+
+            tasks = [asyncio.ensure_future(answer(question, matches)) for question, matches in zip(unique, exact)]
+            pending = tasks + ([embeddings] if embeddings is not None else [])
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    question, text, selected, error = await finished
+                    chunk_ids = [match['id'] for match in selected]
+                    sources = list(dict.fromkeys(match['metadata'].get('file_name', 'Unknown File')
+                                                 for match in selected))
+                    for i in positions[question]:
+                        yield BatchAnswer(i, questions[i], text, chunk_ids, sources, error)
+            finally:
+                # The consumer may stop early; do not leave requests running
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _retrieve(self, question: str, embeddings: asyncio.Future, position: int,
+                        filters: Optional[dict], top_k: int) -> List[dict]:
+        # BM25 runs while the batch's shared embedding request is in flight
+        query_embeddings, lexical_matches = await asyncio.gather(
+            asyncio.shield(embeddings),
+            asyncio.to_thread(self.retriever.lexical_search, question, filters, top_k))
+        vector_matches = await aquery_pinecone(query_embeddings[position], filters=filters, top_k=top_k)
+        return reciprocal_rank_fusion([vector_matches, lexical_matches], self.retriever.rrf_k)[:top_k]
+
+async def run(questions: List[str], output, retriever: HybridRetriever, context_builder: ContextBuilder,
+              top_k: int = CONTEXT_CANDIDATES, concurrency: int = BATCH_CONCURRENCY) -> int:
+    """
+    Answer the questions and write the results to ``output`` as JSON lines.
+
+    Returns:
+        int: Number of questions that failed.
+    """
+    batch = BatchQuery(retriever, context_builder, concurrency)
+    written, failed = set(), 0
+    try:
+        async for result in batch.answers(questions, top_k=top_k):
+            for chunk_id in result.chunk_ids:
+                if chunk_id not in written:
+                    written.add(chunk_id)
+                    output.write(json.dumps({'type': 'chunk', **chunk_record(chunk_id, batch.chunks[chunk_id])}) + '\n')
+            output.write(json.dumps({'type': 'answer', **result._asdict()}) + '\n')
+            output.flush()
+            failed += result.error is not None
+    finally:
+        await close_async_client()
+        await close_async_index()
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Answer a file of questions, one per line.')
+    parser.add_argument('questions', help='Text file with one question per line')
+    parser.add_argument('--output', help='JSON lines file for the results (default: standard output)')
+    parser.add_argument('--top-k', type=int, default=CONTEXT_CANDIDATES,
+                        help='Candidates retrieved per question (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY,
+                        help='Answers generated at once (default: %(default)s)')
+    parser.add_argument('--term-index', default=os.environ.get('LUTHOR_TERM_INDEX_PATH', 'luthor_terms'),
+                        help='Directory of the BM25 index (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Imported here: loading the tokenizer is only needed to run a batch
+    from src.ingestion import default_preprocessor
+    from src.preprocessor import setup_nltk
+    from src.utils.bm25_index import BM25Index
+
+    with open(args.questions, encoding='utf-8') as file:
+        questions = [line.strip() for line in file if line.strip()]
+    setup_nltk()
+    retriever = HybridRetriever(BM25Index(args.term_index), default_preprocessor().tokenize_text, query_pinecone)
+    context_builder = ContextBuilder(int(os.environ.get('CONTEXT_TOKEN_BUDGET', CONTEXT_TOKEN_BUDGET)),
+                                     embedding_lookup=cached_embedding_lookup())
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        failed = asyncio.run(run(questions, output, retriever, context_builder, args.top_k, args.concurrency))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info(f"Answered {len(questions) - failed} of {len(questions)} questions")
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+"""
+Bulk ingestion from the command line.
+
+Usage:
+    python -m src.bulk_ingest PATH [--checkpoint FILE] [--batch-size N] [--workers N] [--term-index DIR]
+
+PATH may be a directory, a .zip archive or a .tar/.tar.gz/.tgz archive. Documents
+already recorded in the checkpoint file are skipped, so an interrupted load can be
+re-run with the same arguments and continues where it stopped.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from src.data_loader import SUPPORTED_EXTENSIONS
+from src.ingestion import IngestionEngine, IngestionResult
+from src.preprocessor import setup_nltk
+from src.utils.bm25_index import BM25Index
+from src.utils.hash_index import DocumentHashIndex
+from src.utils.openai_utils import get_embeddings
+from src.utils.pinecone_utils import delete_vectors, upsert_chunks
+
+logger = logging.getLogger(__name__)
+
+def iter_documents(path: str) -> Iterator[Tuple[str, bytes]]:
+    """
+    Lazily yield supported documents from a directory or an archive.
+
+    Args:
+        path (str): A directory, zip archive or tar archive.
+
+    Yields:
+        Tuple[str, bytes]: The document's path relative to ``path`` and its content.
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if _is_supported(name):
+                    full_path = os.path.join(root, name)
+                    with open(full_path, 'rb') as file:
+                        yield os.path.relpath(full_path, path), file.read()
+
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_supported(info.filename):
+                    yield info.filename, archive.read(info)
+
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            for member in archive:
+                if member.isfile() and _is_supported(member.name):
+                    yield member.name, archive.extractfile(member).read()
+
+    else:
+        raise ValueError(f"Not a directory or a supported archive: {path}")
+
+def _is_supported(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+
+class Checkpoint:
+    def __init__(self, path: str):
+        """
+        Append-only record of ingested documents, keyed by content hash.
+
+        Args:
+            path (str): JSON-lines checkpoint file. Created on first write.
+        """
+        self.path = path
+        self.completed: Set[str] = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        self.completed.add(json.loads(line)['file_hash'])
+
+    def __contains__(self, file_hash: str) -> bool:
+        return file_hash in self.completed
+
+    def record(self, entries: List[dict]):
+        """Mark documents as fully ingested."""
+        with self._lock, open(self.path, 'a') as file:
+            for entry in entries:
+                file.write(json.dumps(entry) + '\n')
+                self.completed.add(entry['file_hash'])
+            file.flush()
+            os.fsync(file.fileno())
+
+class VectorBatcher:
+    def __init__(self, upsert_fn: Callable[[List[dict]], object], checkpoint: Checkpoint, batch_size: int = 1000,
+                 delete_fn: Optional[Callable[[List[str]], object]] = None):
+        """
+        Collect vectors across documents and upsert them in large batches.
+
+        A document is checkpointed, and its result released for reporting, only once all
+        of its vectors have been upserted. Documents without vectors are checkpointed as
+        soon as their result arrives, so they are not parsed again on resume. Work that
+        must wait for a document's vectors to be stored, such as deleting its stale
+        vectors, is deferred with after_flush.
+
+        Args:
+            upsert_fn (Callable): Stores a list of vectors.
+            checkpoint (Checkpoint): Where completed documents are recorded.
+            batch_size (int): Number of vectors sent per upsert.
+            delete_fn (Callable, optional): Deletes vectors by ID, for delete().
+        """
+        self.upsert_fn = upsert_fn
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.delete_fn = delete_fn
+        self._vectors: List[dict] = []
+        self._documents: Dict[str, dict] = {}
+        # File hash of each buffered document, by document ID
+        self._document_ids: Dict[str, str] = {}
+        # Deferred work of buffered documents, run in order once their batch is stored
+        self._after: Dict[str, List[Callable[[], object]]] = {}
+        # Outcome (error or None) of flushed documents whose result has not arrived yet
+        self._flushed: Dict[str, Optional[str]] = {}
+        # Results of documents whose vectors are still buffered
+        self._waiting: Dict[str, IngestionResult] = {}
+        self._settled: List[IngestionResult] = []
+        self._lock = threading.Lock()
+
+    def add(self, vectors: List[dict]):
+        """Buffer the vectors of one document, flushing when the batch is full."""
+        if not vectors:
+            return
+        metadata = vectors[0]['metadata']
+        with self._lock:
+            self._vectors.extend(vectors)
+            self._documents[metadata['file_hash']] = {'file_hash': metadata['file_hash'],
+                                                      'file_name': metadata['file_name'],
+                                                      'chunks': len(vectors)}
+            if metadata.get('document_id'):
+                self._document_ids[metadata['document_id']] = metadata['file_hash']
+            if len(self._vectors) >= self.batch_size:
+                self._flush()
+
+    def after_flush(self, file_hash: str, action: Callable[[], object]):
+        """
+        Run ``action`` once the document's buffered vectors are stored.
+
+        It runs at once if the document has no buffered vectors, and never if its batch fails.
+        """
+        with self._lock:
+            if file_hash in self._documents:
+                self._after.setdefault(file_hash, []).append(action)
+                return
+            if self._flushed.get(file_hash):
+                # Its batch was flushed, and failed, since the document was added
+                return
+        action()
+
+    def delete(self, ids: List[str]):
+        """Delete vectors, after the new vectors of their document are stored."""
+        by_document: Dict[str, List[str]] = {}
+        for vector_id in ids:
+            by_document.setdefault(vector_id.rsplit('_', 1)[0], []).append(vector_id)
+        for doc_id, document_ids in by_document.items():
+            with self._lock:
+                file_hash = self._document_ids.get(doc_id)
+            self.after_flush(file_hash, lambda document_ids=document_ids: self.delete_fn(document_ids))
+
+    def complete(self, result: IngestionResult) -> List[IngestionResult]:
+        """
+        Hand over a document's ingestion result once it has finished.
+
+        Args:
+            result (IngestionResult): The result reported by the ingestion engine.
+
+        Returns:
+            List[IngestionResult]: Results that are now final: this one if its vectors
+            are already upserted, plus those of documents stored by batches flushed since.
+            A document whose batch failed is returned with the upsert error.
+        """
+        with self._lock:
+            settled, self._settled = self._settled, []
+            file_hash = result.file_hash
+            if file_hash in self._flushed:
+                error = self._flushed.pop(file_hash)
+                settled.append(result._replace(error=result.error or error))
+            elif not result.ok or result.duplicate:
+                # Buffered vectors of a failed document are still sent, but it is not checkpointed
+                self._documents.pop(file_hash, None)
+                self._after.pop(file_hash, None)
+                settled.append(result)
+            elif file_hash in self._documents:
+                self._waiting[file_hash] = result
+            else:
+                self.checkpoint.record([{'file_hash': file_hash, 'file_name': result.file_name, 'chunks': 0}])
+                settled.append(result)
+            return settled
+
+    def flush(self) -> List[IngestionResult]:
+        """
+        Upsert whatever is buffered.
+
+        Returns:
+            List[IngestionResult]: Results settled since the last call to complete or flush.
+        """
+        with self._lock:
+            self._flush()
+            settled, self._settled = self._settled, []
+            return settled
+
+    def _flush(self):
+        if not self._vectors:
+            return
+        vectors, documents, after = self._vectors, list(self._documents.values()), self._after
+        self._vectors, self._documents, self._document_ids, self._after = [], {}, {}, {}
+        errors: Dict[str, Optional[str]] = {}
+        try:
+            self.upsert_fn(vectors)
+        except Exception as e:
+            logger.error(f"Failed to upsert a batch of {len(vectors)} vectors: {e}")
+            errors = {document['file_hash']: str(e) for document in documents}
+        else:
+            for document in documents:
+                try:
+                    for action in after.get(document['file_hash'], []):
+                        action()
+                except Exception as e:
+                    logger.error(f"Failed to finish storing {document['file_name']}: {e}")
+                    errors[document['file_hash']] = str(e)
+            self.checkpoint.record([document for document in documents if document['file_hash'] not in errors])
+        for document in documents:
+            error = errors.get(document['file_hash'])
+            result = self._waiting.pop(document['file_hash'], None)
+            if result is None:
+                self._flushed[document['file_hash']] = error
+            else:
+                self._settled.append(result._replace(error=error))
+
+class DeferredHashIndex:
+    def __init__(self, hash_index: DocumentHashIndex, batcher: VectorBatcher):
+        """
+        A DocumentHashIndex whose new records wait for the document's vectors to be stored.
+
+        Otherwise a run interrupted before a batch is flushed would leave documents recorded
+        as ingested without their vectors, and the next run would skip them.
+
+        Args:
+            hash_index (DocumentHashIndex): The index read from and eventually written to.
+            batcher (VectorBatcher): The batcher holding the documents' vectors.
+        """
+        self.hash_index = hash_index
+        self.batcher = batcher
+
+    def has_document(self, file_hash: str) -> bool:
+        return self.hash_index.has_document(file_hash)
+
+    def document_chunks(self, doc_id: str) -> List[str]:
+        return self.hash_index.document_chunks(doc_id)
+
+    def add_document(self, file_hash: str, *args, **kwargs):
+        self.batcher.after_flush(file_hash, lambda: self.hash_index.add_document(file_hash, *args, **kwargs))
+
+class ThroughputStats:
+    def __init__(self):
+        """Running totals for the ingestion throughput report."""
+        self.start_time = time.perf_counter()
+        self.documents = 0
+        self.failed = 0
+        self.skipped = 0
+        self.chunks = 0
+        self.tokens = 0
+
+    def add(self, result: IngestionResult):
+        if result.duplicate:
+            self.skipped += 1
+        elif result.ok:
+            self.documents += 1
+            self.chunks += result.chunks
+            self.tokens += result.tokens
+        else:
+            self.failed += 1
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        return (f"{self.documents} docs ({self.failed} failed, {self.skipped} skipped), "
+                f"{self.chunks} chunks, {self.tokens} tokens in {elapsed:.1f}s | "
+                f"{self.documents / elapsed:.2f} docs/s, {self.chunks / elapsed:.1f} chunks/s, "
+                f"{self.tokens / elapsed:.0f} tokens/s")
+
+def run(path: str, checkpoint_path: str, batch_size: int, workers: int = None,
+        term_index_path: str = None, index_path: str = ':memory:') -> ThroughputStats:
+    """
+    Ingest every supported document under ``path``, skipping checkpointed ones.
+
+    Args:
+        path (str): A directory, zip archive or tar archive.
+        checkpoint_path (str): JSON-lines checkpoint file.
+        batch_size (int): Number of vectors sent per upsert.
+        workers (int, optional): Parsing processes; defaults to the CPU count.
+        term_index_path (str, optional): Directory of the BM25 index the chunks are added to.
+            The index is saved when the run ends, including when it is interrupted.
+        index_path (str): SQLite file of the DocumentHashIndex shared with the app. Files
+            already recorded there are skipped, and a changed file replaces the stored
+            version at the same path, deleting its stale vectors.
+
+    Returns:
+        ThroughputStats: Totals and rates for the run.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    batcher = VectorBatcher(upsert_chunks, checkpoint, batch_size, delete_vectors)
+    hash_index = DocumentHashIndex(index_path)
+    stats = ThroughputStats()
+
+    def pending_documents():
+        seen = set()
+        for name, content in iter_documents(path):
+            file_hash = hashlib.md5(content).hexdigest()
+            if file_hash in checkpoint or file_hash in seen:
+                stats.skipped += 1
+                continue
+            seen.add(file_hash)
+            yield name, content
+
+    def report(result: IngestionResult):
+        stats.add(result)
+        if result.duplicate:
+            status = "already ingested"
+        elif result.ok:
+            status = f"{result.chunks} chunks"
+        else:
+            status = f"FAILED: {result.error}"
+        print(f"[{stats.documents + stats.failed + stats.skipped}] {result.file_name}: {status} | {stats.summary()}")
+
+    def on_progress(result: IngestionResult):
+        # Documents are only reported once their vectors have been upserted
+        for settled in batcher.complete(result):
+            report(settled)
+
+    term_index = None
+    if term_index_path:
+        # The worker processes extract terms with the NLTK pipeline
+        setup_nltk()
+        term_index = BM25Index(term_index_path)
+    try:
+        # Paths within the source identify documents, so a changed file keeps its document ID
+        with IngestionEngine(get_embeddings, batcher.add, max_workers=workers,
+                             hash_index=DeferredHashIndex(hash_index, batcher), delete_fn=batcher.delete,
+                             term_index=term_index, versions_by_name=True) as engine:
+            engine.ingest(pending_documents(), on_progress=on_progress)
+        for settled in batcher.flush():
+            report(settled)
+    finally:
+        hash_index.close()
+        if term_index is not None:
+            term_index.save()
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk-ingest documents from a directory or archive into the index.')
+    parser.add_argument('path', help='Directory, .zip or .tar(.gz) archive to ingest')
+    parser.add_argument('--checkpoint', default='ingest_checkpoint.jsonl',
+                        help='File recording ingested documents, used to resume (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Vectors per upsert (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, help='Parsing processes (default: CPU count)')
+    parser.add_argument('--index', default=os.environ.get('LUTHOR_INDEX_PATH', 'luthor_index.sqlite'),
+                        help='Document hash index shared with the app (default: %(default)s)')
+    parser.add_argument('--term-index', default=os.environ.get('LUTHOR_TERM_INDEX_PATH', 'luthor_terms'),
+                        help='Directory of the BM25 index to add chunks to; empty to skip (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    stats = run(args.path, args.checkpoint, args.batch_size, args.workers, args.term_index or None, args.index)
+    print(f"Done: {stats.summary()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+import re
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+# Section breaks in legal memos: blank lines, numbered items, bullets, "Section N" / "Article N"
+SECTION_BREAK_PATTERN = re.compile(
+    r'(?<=\n)(?=\n)|(?<=\n)(?=\s*[\d-]+\s)|(?<=\n)(?=Section \d+|Article \d+)|(?<=\n)(?=\s*-\s)|(?<=\n)(?=\s*\*\s)'
+)
+
+# Characters that end every lookahead of SECTION_BREAK_PATTERN: once one is seen at
+# least BREAK_LOOKAHEAD characters after a position, whether it is a break is decided
+BREAK_LOOKAHEAD_STOP = re.compile(r'[^\s\d*-]')
+BREAK_LOOKAHEAD = len('Section 0')
+
+# Segment that opens a new section, optionally already marked by preserve_structure
+HEADING_PATTERN = re.compile(r'^(?:##\s*)?((?:Section|Article)\s+\d+[^\n]*)')
+MAX_HEADING_LENGTH = 200
+
+# A word together with the whitespace in front of it, so that byte-level BPE
+# tokenizers see each word the way they would in running text
+WORD_PATTERN = re.compile(r'\s*\S+')
+
+class TextChunk(NamedTuple):
+    text: str
+    start: int
+    end: int
+    section: Optional[str] = None
+    tokens: int = 0
+    # Search terms from FileTextPreprocessor.tokenize_text, when the chunk is indexed for BM25
+    terms: Optional[Tuple[str, ...]] = None
+
+def iter_segments(text: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Lazily split text at section breaks, keeping character offsets.
+
+    Args:
+        text (str): The text to be segmented.
+
+    Yields:
+        Tuple[str, int, int]: Each non-empty, stripped segment with its start and end offsets.
+    """
+    previous = 0
+    for boundary in SECTION_BREAK_PATTERN.finditer(text):
+        yield from _stripped_segment(text, previous, boundary.start())
+        previous = boundary.start()
+    yield from _stripped_segment(text, previous, len(text))
+
+def iter_stream_segments(blocks: Iterable[str]) -> Iterator[Tuple[str, int, int, str]]:
+    """
+    Split a stream of text blocks at section breaks, as iter_segments splits them joined.
+
+    Blocks, e.g. the texts of data_loader.iter_blocks, are joined by newlines. Only
+    the text from the end of the last segment onwards is kept, so a document is
+    segmented without ever being held in full. Each block is scanned for breaks
+    once, together with the few characters before it whose breaks it decides, so
+    the work is linear in the text even when no break occurs for a long time.
+
+    Args:
+        blocks (Iterable[str]): The text blocks, in document order.
+
+    Yields:
+        Tuple[str, int, int, str]: Each non-empty, stripped segment with its start and end
+            offsets in the joined text, and the text between the previous segment and it.
+    """
+    # The joined text from the end of the last segment yielded, as (offset, text) pieces
+    pieces = deque()
+    length = 0
+    # End of the last segment yielded, start of the segment being read, and the
+    # offset before which every break has been found
+    base = previous = decided = 0
+
+    def span(start: int, end: int) -> str:
+        # The joined text from start to end, built from the pieces covering it
+        parts = []
+        for offset, piece in reversed(pieces):
+            if offset >= end:
+                continue
+            if offset + len(piece) <= start:
+                break
+            parts.append(piece[max(start - offset, 0):end - offset])
+        return ''.join(reversed(parts))
+
+    def segment(end: int) -> Iterator[Tuple[str, int, int, str]]:
+        # Yield the segment from previous to end, if it is not blank
+        nonlocal base, previous
+        for text, start, stop in _stripped_segment(span(previous, end), 0, end - previous):
+            yield text, start + previous, stop + previous, span(base, start + previous)
+            base = stop + previous
+        previous = end
+
+    def cut(limit: int) -> Iterator[Tuple[str, int, int, str]]:
+        # Yield the segments that end at breaks before limit. Only the text from the
+        # last decided offset is scanned, with one character before it for the lookbehind.
+        nonlocal decided
+        window_start = max(decided - 1, 0)
+        window = span(window_start, length)
+        for boundary in SECTION_BREAK_PATTERN.finditer(window, decided - window_start):
+            if boundary.start() + window_start >= limit:
+                break
+            yield from segment(boundary.start() + window_start)
+        decided = limit
+        while pieces and pieces[0][0] + len(pieces[0][1]) <= base:
+            pieces.popleft()
+
+    for i, block in enumerate(blocks):
+        piece = '\n' + block if i else block
+        pieces.append((length, piece))
+        length += len(piece)
+        # A break is only decided once the text after it rules out every lookahead
+        for stop in reversed(range(len(piece))):
+            if BREAK_LOOKAHEAD_STOP.match(piece, stop):
+                limit = length - len(piece) + stop - BREAK_LOOKAHEAD
+                if limit > decided:
+                    yield from cut(limit)
+                break
+
+    yield from cut(length)
+    yield from segment(length)
+
+def _with_gaps(text: str) -> Iterator[Tuple[str, int, int, str]]:
+    # iter_segments, with the text between each segment and the previous one
+    previous_end = 0
+    for segment, start, end in iter_segments(text):
+        yield segment, start, end, text[previous_end:start]
+        previous_end = end
+
+def _stripped_segment(text: str, start: int, end: int) -> Iterator[Tuple[str, int, int]]:
+    segment = text[start:end]
+    stripped = segment.strip()
+    if stripped:
+        start += len(segment) - len(segment.lstrip())
+        yield stripped, start, start + len(stripped)
+
+def count_special_tokens(tokenizer) -> int:
+    """Number of special tokens the tokenizer adds around a single sequence."""
+    if hasattr(tokenizer, 'num_special_tokens_to_add'):
+        return tokenizer.num_special_tokens_to_add(pair=False)
+    return 0
+
+def iter_token_windows(text: str, tokenizer, chunk_size: int, overlap: int = 0,
+                       batch_size: int = 256) -> Iterator[TextChunk]:
+    """
+    Lazily split the whole text into windows of at most ``chunk_size`` tokens.
+
+    Words are tokenized in small batches as the text is walked, so memory stays
+    bounded by the current window. Windows end on word boundaries and consecutive
+    windows share roughly ``overlap`` tokens. A single word longer than the
+    budget is emitted as its own chunk.
+
+    Args:
+        text (str): The text to be chunked.
+        tokenizer (object): A Hugging Face style tokenizer (callable on a list of strings).
+        chunk_size (int): Maximum tokens per chunk, including special tokens.
+        overlap (int): Number of tokens to repeat at the start of the next chunk.
+        batch_size (int): Number of words tokenized per tokenizer call.
+
+    Yields:
+        TextChunk: The chunk text with its start and end character offsets in ``text``
+            and its token count.
+    """
+    budget = chunk_size - count_special_tokens(tokenizer)
+    if budget <= 0:
+        raise ValueError(f"chunk_size {chunk_size} leaves no room for text tokens")
+    if not 0 <= overlap < budget:
+        raise ValueError(f"overlap must be between 0 and {budget - 1}, got {overlap}")
+
+    # Each window entry is (word start, word end, token count)
+    window = deque()
+    window_tokens = 0
+
+    def emit():
+        start, end = window[0][0], window[-1][1]
+        return TextChunk(text[start:end], start, end, tokens=window_tokens)
+
+    words = WORD_PATTERN.finditer(text)
+    while True:
+        batch = list(islice(words, batch_size))
+        if not batch:
+            break
+        token_ids = tokenizer([match.group() for match in batch], add_special_tokens=False)['input_ids']
+
+        for match, ids in zip(batch, token_ids):
+            n_tokens = len(ids)
+            if window and window_tokens + n_tokens > budget:
+                yield emit()
+                # Keep trailing words as overlap, always dropping at least one word
+                kept, kept_tokens = deque(), 0
+                for entry in reversed(window):
+                    if len(kept) + 1 >= len(window) or kept_tokens + entry[2] > overlap:
+                        break
+                    kept.appendleft(entry)
+                    kept_tokens += entry[2]
+                window, window_tokens = kept, kept_tokens
+                # The overlap alone may leave no room for the incoming word
+                while window and window_tokens + n_tokens > budget:
+                    window_tokens -= window.popleft()[2]
+
+            word_start = match.end() - len(match.group().lstrip())
+            window.append((word_start, match.end(), n_tokens))
+            window_tokens += n_tokens
+
+    if window:
+        yield emit()
+
+def iter_section_chunks(text: str, tokenizer, chunk_size: int, batch_size: int = 64) -> Iterator[TextChunk]:
+    """
+    Lazily pack whole segments into chunks of at most ``chunk_size`` tokens.
+
+    Segments from ``iter_segments`` are added greedily to the current chunk. A
+    "Section N" / "Article N" heading always starts a new chunk, and every chunk
+    carries the heading of the section it belongs to. Only segments that exceed
+    the budget on their own are split, using ``iter_token_windows``.
+
+    Each segment is counted together with the whitespace joining it to the chunk.
+    For tokenizers that never merge a word with the whitespace after it, such as
+    WordPiece and byte-level BPE, the chunk's count is then that of its text.
+
+    Args:
+        text (str): The text to be chunked.
+        tokenizer (object): A Hugging Face style tokenizer (callable on a list of strings).
+        chunk_size (int): Maximum tokens per chunk, including special tokens.
+        batch_size (int): Number of segments tokenized per tokenizer call.
+
+    Yields:
+        TextChunk: The chunk text, its character offsets in ``text`` and its section heading.
+    """
+    return _pack_segments(_with_gaps(text), tokenizer, chunk_size, batch_size)
+
+def iter_stream_section_chunks(blocks: Iterable[str], tokenizer, chunk_size: int,
+                               batch_size: int = 64) -> Iterator[TextChunk]:
+    """
+    iter_section_chunks over a stream of text blocks, e.g. the pages of a PDF.
+
+    The chunks are those of the blocks joined by newlines, but only the current
+    chunk and the text after it are held in memory.
+
+    Args:
+        blocks (Iterable[str]): The text blocks, in document order.
+        tokenizer (object): A Hugging Face style tokenizer (callable on a list of strings).
+        chunk_size (int): Maximum tokens per chunk, including special tokens.
+        batch_size (int): Number of segments tokenized per tokenizer call.
+
+    Yields:
+        TextChunk: The chunk text, its character offsets in the joined text and its section heading.
+    """
+    return _pack_segments(iter_stream_segments(blocks), tokenizer, chunk_size, batch_size)
+
+def _pack_segments(segments: Iterator[Tuple[str, int, int, str]], tokenizer, chunk_size: int,
+                   batch_size: int) -> Iterator[TextChunk]:
+    budget = chunk_size - count_special_tokens(tokenizer)
+    if budget <= 0:
+        raise ValueError(f"chunk_size {chunk_size} leaves no room for text tokens")
+
+    section = None
+    start = end = None
+    chunk_tokens = 0
+    # The chunk's segments and the text between them
+    parts = []
+
+    while True:
+        batch = list(islice(segments, batch_size))
+        if not batch:
+            break
+        # Segments are counted with the text in front of them, as they appear in the joined chunk
+        token_ids = tokenizer([gap + segment for segment, _, _, gap in batch], add_special_tokens=False)['input_ids']
+
+        for (segment, seg_start, seg_end, gap), ids in zip(batch, token_ids):
+            n_tokens = len(ids)
+            heading = HEADING_PATTERN.match(segment)
+
+            if start is not None and (heading or chunk_tokens + n_tokens > budget):
+                yield TextChunk(''.join(parts), start, end, section, chunk_tokens)
+                start = None
+                parts = []
+                chunk_tokens = 0
+
+            if heading:
+                section = heading.group(1).strip()[:MAX_HEADING_LENGTH]
+
+            if start is None:
+                # The chunk starts with the segment itself, without the gap before it
+                if gap:
+                    n_tokens = len(tokenizer([segment], add_special_tokens=False)['input_ids'][0])
+                if n_tokens > budget:
+                    for piece in iter_token_windows(segment, tokenizer, chunk_size):
+                        yield TextChunk(piece.text, seg_start + piece.start, seg_start + piece.end, section,
+                                        piece.tokens)
+                    continue
+                start = seg_start
+            else:
+                parts.append(gap)
+            parts.append(segment)
+            end = seg_end
+            chunk_tokens += n_tokens
+
+    if start is not None:
+        yield TextChunk(''.join(parts), start, end, section, chunk_tokens)
@@ -0,0 +1,257 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.utils.hash_index import NEAR_DUPLICATE_DISTANCE, content_hash, simhash
+from src.utils.openai_utils import EMBEDDING_DIMENSIONS, embedding_cache, estimate_tokens
+from src.utils.telemetry import span
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer of the answer model (gpt-4o-mini)
+CONTEXT_ENCODING = 'o200k_base'
+CONTEXT_TOKEN_BUDGET = 3000
+# A match that does not fit whole is cut to the remaining budget if this many tokens of it fit
+MIN_TRUNCATED_TOKENS = 200
+# Matches fetched from the vector store before reranking and packing
+CONTEXT_CANDIDATES = 20
+# Chunks of the same document overlapping by more than this fraction count as duplicates
+MAX_SPAN_OVERLAP = 0.5
+# Chunks whose fingerprints and terms are kept, so chunks retrieved again, e.g. by other
+# questions of a batch, are not analysed again
+CHUNK_FEATURE_CACHE_SIZE = 4096
+
+_TERM_PATTERN = re.compile(r'\w+')
+_WORD_END_PATTERN = re.compile(r'\S(?=\s|$)')
+
+@lru_cache(maxsize=None)
+def load_token_counter(encoding: str = CONTEXT_ENCODING) -> Callable[[str], int]:
+    """
+    Return a function counting tokens the way the answer model does.
+
+    Uses tiktoken when it is installed and its encoding can be loaded; otherwise falls
+    back to the four-characters-per-token estimate used for embedding batches.
+
+    Args:
+        encoding (str): The tiktoken encoding name.
+
+    Returns:
+        Callable[[str], int]: Token counter.
+    """
+    if tiktoken is not None:
+        try:
+            tokenizer = tiktoken.get_encoding(encoding)
+            return lambda text: len(tokenizer.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.warning(f"Could not load the {encoding} encoding, estimating context tokens: {str(e)}")
+    return estimate_tokens
+
+def format_match(match: dict) -> str:
+    """A matched chunk's text followed by a citation of its file."""
+    text = match['metadata'].get('text', '')
+    file_name = match['metadata'].get('file_name', 'Unknown File')
+    return f"{text} [Source: {file_name}]"
+
+def _terms(text: str) -> set:
+    return set(_TERM_PATTERN.findall(text.lower()))
+
+@lru_cache(maxsize=CHUNK_FEATURE_CACHE_SIZE)
+def _chunk_terms(text: str) -> frozenset:
+    return frozenset(_terms(text))
+
+@lru_cache(maxsize=CHUNK_FEATURE_CACHE_SIZE)
+def _chunk_fingerprints(text: str) -> Tuple[str, int]:
+    return content_hash(text), simhash(text)
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def _span_overlap(a: dict, b: dict) -> float:
+    if a.get('document_id') is None or a.get('document_id') != b.get('document_id'):
+        return 0.0
+    try:
+        start, end = max(a['start'], b['start']), min(a['end'], b['end'])
+        shortest = min(a['end'] - a['start'], b['end'] - b['start'])
+    except KeyError:
+        return 0.0
+    return max(0, end - start) / shortest if shortest > 0 else 0.0
+
+class ContextBuilder:
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, count_tokens: Optional[Callable[[str], int]] = None,
+                 diversity: float = 0.3, embedding_lookup: Optional[Callable[[str], Optional[List[float]]]] = None):
+        """
+        Assemble the prompt context from retrieved matches.
+
+        Near-duplicate matches are dropped (identical text, SimHash within a few bits, or
+        mostly overlapping spans of the same document). The rest are reranked with Maximal
+        Marginal Relevance: relevance is the retrieval score plus the share of query terms
+        the chunk contains, and redundancy is the cosine similarity of cached chunk
+        embeddings, or the term overlap when no embedding is cached. Chunks are then packed
+        in that order until the token budget is spent.
+
+        Args:
+            token_budget (int): Maximum tokens of context.
+            count_tokens (Callable, optional): Token counter; defaults to the answer model's tokenizer.
+            diversity (float): Weight of redundancy against relevance, between 0 and 1.
+            embedding_lookup (Callable, optional): Returns a chunk text's cached embedding, or None.
+                Never triggers an embedding request.
+        """
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens or load_token_counter()
+        self.diversity = diversity
+        self.embedding_lookup = embedding_lookup
+
+    def deduplicate(self, matches: Sequence[dict]) -> List[dict]:
+        """
+        Drop matches that repeat a better-scored match.
+
+        Args:
+            matches (Sequence[dict]): Matches with 'metadata' (and 'score'), best first.
+
+        Returns:
+            List[dict]: The remaining matches, in input order.
+        """
+        kept, hashes, fingerprints = [], set(), []
+        for match in matches:
+            text = match['metadata'].get('text', '')
+            if not text.strip():
+                continue
+            text_hash, fingerprint = _chunk_fingerprints(text)
+            if (text_hash in hashes
+                    or any(bin(fingerprint ^ other).count('1') <= NEAR_DUPLICATE_DISTANCE for other in fingerprints)
+                    or any(_span_overlap(match['metadata'], other['metadata']) > MAX_SPAN_OVERLAP for other in kept)):
+                continue
+            kept.append(match)
+            hashes.add(text_hash)
+            fingerprints.append(fingerprint)
+        return kept
+
+    def rerank(self, query: str, matches: Sequence[dict]) -> List[dict]:
+        """
+        Order matches by Maximal Marginal Relevance.
+
+        Args:
+            query (str): The user's question.
+            matches (Sequence[dict]): Candidate matches.
+
+        Returns:
+            List[dict]: The matches, most useful first.
+        """
+        if len(matches) <= 1:
+            return list(matches)
+
+        texts = [match['metadata'].get('text', '') for match in matches]
+        terms = [_chunk_terms(text) for text in texts]
+        query_terms = _terms(query)
+        relevance = np.array([
+            match.get('score', 0.0) + (len(query_terms & chunk_terms) / len(query_terms) if query_terms else 0.0)
+            for match, chunk_terms in zip(matches, terms)
+        ])
+        similarity = self._similarity(texts, terms)
+
+        order, remaining = [], list(range(len(matches)))
+        redundancy = np.zeros(len(matches))
+        while remaining:
+            scores = (1 - self.diversity) * relevance[remaining] - self.diversity * redundancy[remaining]
+            best = remaining.pop(int(np.argmax(scores)))
+            order.append(best)
+            redundancy = np.maximum(redundancy, similarity[best])
+        return [matches[i] for i in order]
+
+    def _similarity(self, texts: List[str], terms: List[frozenset]) -> np.ndarray:
+        n = len(texts)
+        embeddings = [self.embedding_lookup(text) for text in texts] if self.embedding_lookup else [None] * n
+        cached = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        if len(cached) < 2:
+            cached = []
+        embedded = set(cached)
+
+        # Term overlap is only needed for pairs without both embeddings
+        similarity = np.array([[0.0 if i in embedded and j in embedded else _jaccard(terms[i], terms[j])
+                                for j in range(n)] for i in range(n)])
+        if cached:
+            vectors = np.asarray([embeddings[i] for i in cached], dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            similarity[np.ix_(cached, cached)] = vectors @ vectors.T
+        return similarity
+
+    def pack(self, matches: Sequence[dict]) -> Tuple[List[dict], int]:
+        """
+        Take matches in order while they fit the token budget.
+
+        A match that does not fit whole is cut at a word boundary to fill the rest of the
+        budget, as long as at least MIN_TRUNCATED_TOKENS of it fit; chunks can be larger
+        than the whole budget. Otherwise it is skipped and smaller matches may follow.
+
+        Returns:
+            Tuple[List[dict], int]: The selected matches and the tokens they use.
+        """
+        selected, used = [], 0
+        separator = self.count_tokens(' ')
+        for match in matches:
+            tokens = self.count_tokens(format_match(match)) + (separator if selected else 0)
+            if used + tokens <= self.token_budget:
+                selected.append(match)
+                used += tokens
+                continue
+            remaining = self.token_budget - used - (separator if selected else 0)
+            truncated = self._truncate(match, remaining)
+            if truncated is not None:
+                selected.append(truncated)
+                used += self.count_tokens(format_match(truncated)) + (separator if len(selected) > 1 else 0)
+                break
+        return selected, used
+
+    def _truncate(self, match: dict, max_tokens: int) -> Optional[dict]:
+        # The longest prefix of the match, ending on a word, whose formatted text fits max_tokens
+        text = match['metadata'].get('text', '')
+        citation = self.count_tokens(format_match({'metadata': {**match['metadata'], 'text': ''}}))
+        if max_tokens - citation < MIN_TRUNCATED_TOKENS:
+            return None
+        ends = [word.end() for word in _WORD_END_PATTERN.finditer(text)]
+        with_text = lambda end: {**match, 'metadata': {**match['metadata'], 'text': text[:end]}}
+        low, high = 0, len(ends)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(format_match(with_text(ends[middle - 1]))) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        if low == 0 or self.count_tokens(text[:ends[low - 1]]) < MIN_TRUNCATED_TOKENS:
+            return None
+        return with_text(ends[low - 1])
+
+    def build(self, query: str, matches: Sequence[dict]) -> Tuple[str, List[dict]]:
+        """
+        Deduplicate, rerank and pack matches into the context for ``query``.
+
+        Args:
+            query (str): The user's question.
+            matches (Sequence[dict]): Retrieved matches, best first.
+
+        Returns:
+            Tuple[str, List[dict]]: The context string and the matches it contains.
+        """
+        with span('rerank', candidates=len(matches)) as rerank_span:
+            selected, used = self.pack(self.rerank(query, self.deduplicate(matches)))
+            rerank_span.set(selected=len(selected), context_tokens=used)
+        logger.info(f"Context: {len(selected)} of {len(matches)} matches, {used} tokens")
+        return " ".join(format_match(match) for match in selected), selected
+
+def cached_embedding_lookup(model: str = "text-embedding-3-small",
+                            dimensions: int = EMBEDDING_DIMENSIONS) -> Callable[[str], Optional[List[float]]]:
+    """Embedding lookup reading the shared embedding cache of openai_utils, without counting hits or misses."""
+    return lambda text: embedding_cache.peek(text, model, dimensions)
+
+def build_context(query: str, matches: Sequence[dict], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                  **kwargs) -> Tuple[str, List[dict]]:
+    """Shortcut for ContextBuilder(token_budget, **kwargs).build(query, matches)."""
+    return ContextBuilder(token_budget, **kwargs).build(query, matches)
@@ -1,16 +1,45 @@
+import mmap
+import multiprocessing
 import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from io import BytesIO
-from typing import BinaryIO
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Union
 from docx import Document
 import fitz  # PyMuPDF
 
-def read_file(file: BytesIO, filename: str) -> str:
+from src.utils.telemetry import span
+
+SUPPORTED_EXTENSIONS = ('.txt', '.docx', '.pdf')
+
+# PDFs with fewer pages are extracted in-process even when workers are allowed
+PARALLEL_PDF_MIN_PAGES = 64
+# Pages extracted per worker task
+PDF_PAGES_PER_TASK = 16
+
+NEWLINE_PATTERN = re.compile(b'\n')
+
+# A path to a file on disk, its content, or a binary file object
+Source = Union[str, os.PathLike, bytes, memoryview, BinaryIO]
+
+class TextBlock(NamedTuple):
+    text: str
+    # Character offset of the block in the text read_file returns (blocks joined by newlines)
+    start: int
+    # Zero-based page number, for PDFs
+    page: Optional[int] = None
+
+def read_file(file: BytesIO, filename: str, workers: int = 1) -> str:
     """
     Read content from a file stream based on its extension.
 
     Args:
-        file (BytesIO): The uploaded file object.
+        file (BytesIO): The uploaded file object, the file's bytes or a path on disk.
         filename (str): The name of the uploaded file.
+        workers (int): Processes to extract large PDFs with.
 
     Returns:
         str: The text content of the file.
@@ -21,34 +50,188 @@ def read_file(file: BytesIO, filename: str) -> str:
     # Get the file extension from the filename
     _, file_extension = os.path.splitext(filename)
 
-    if file_extension.lower() == '.txt':
-        return read_txt(file)
+    with span('read', format=file_extension.lower()):
+        return '\n'.join(block.text for block in iter_blocks(file, filename, workers))
+
+def iter_blocks(source: Source, filename: str, workers: int = 1) -> Iterator[TextBlock]:
+    """
+    Lazily extract a document as a stream of text blocks with their offsets.
+
+    Blocks are lines of text files, paragraphs of .docx files and pages of PDFs.
+    Joined by newlines they give exactly the text read_file returns, so only one
+    block at a time needs to be held. Files on disk are memory-mapped rather than
+    read into memory.
 
-    elif file_extension.lower() == '.docx':
-        return read_docx(file)
+    Args:
+        source (Source): A path on disk, the file's bytes or a binary file object.
+        filename (str): The file name, whose extension selects the reader.
+        workers (int): Processes to extract large PDFs with; 1 extracts in-process.
 
-    elif file_extension.lower() == '.pdf':
-        return read_pdf(file)
+    Yields:
+        TextBlock: Each block with its character offset in the joined text.
 
+    Raises:
+        ValueError: If the file type is unsupported.
+    """
+    _, file_extension = os.path.splitext(filename)
+    extension = file_extension.lower()
+    if extension == '.txt':
+        texts = iter_txt(source)
+    elif extension == '.docx':
+        texts = iter_docx(source)
+    elif extension == '.pdf':
+        texts = iter_pdf(source, workers)
     else:
         raise ValueError(f"Unsupported file extension: {file_extension}")
 
+    offset = 0
+    for i, text in enumerate(texts):
+        yield TextBlock(text, offset, i if extension == '.pdf' else None)
+        offset += len(text) + 1
+
+def _is_path(source: Source) -> bool:
+    return isinstance(source, (str, os.PathLike))
+
+@contextmanager
+def _mapped(source: Source):
+    """The source's content as a zero-copy buffer: a memory map for paths, the buffer of in-memory files."""
+    if isinstance(source, (bytes, memoryview)):
+        yield memoryview(source)
+    elif _is_path(source):
+        with open(source, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                yield memoryview(b'')
+                return
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapping)
+            try:
+                yield view
+            finally:
+                # Readers must have dropped their references; otherwise the map is closed on collection
+                try:
+                    view.release()
+                    mapping.close()
+                except BufferError:
+                    pass
+    elif hasattr(source, 'getbuffer'):
+        view = source.getbuffer()
+        try:
+            yield view
+        finally:
+            # An exported buffer stops the file from being resized or closed
+            try:
+                view.release()
+            except BufferError:
+                pass
+    else:
+        source.seek(0)
+        yield memoryview(source.read())
+
+def iter_txt(source: Source) -> Iterator[str]:
+    """Lines of a UTF-8 text file, without their newline."""
+    with _mapped(source) as buffer:
+        start = 0
+        # re scans the buffer in place, without copying it
+        for newline in NEWLINE_PATTERN.finditer(buffer):
+            yield str(buffer[start:newline.start()], 'utf-8')
+            start = newline.end()
+        yield str(buffer[start:], 'utf-8')
+
 def read_txt(file: BinaryIO) -> str:
-    file.seek(0)
-    return file.read().decode('utf-8')
+    return '\n'.join(iter_txt(file))
+
+def iter_docx(source: Source) -> Iterator[str]:
+    """Paragraph texts of a .docx file."""
+    if isinstance(source, (bytes, memoryview)):
+        source = BytesIO(source)
+    elif not _is_path(source):
+        source.seek(0)
+    document = Document(os.fspath(source) if _is_path(source) else source)
+    for paragraph in document.paragraphs:
+        yield paragraph.text
 
 def read_docx(file: BinaryIO) -> str:
-    file.seek(0)
-    document = Document(file)
-    full_text = [paragraph.text for paragraph in document.paragraphs]
-    return '\n'.join(full_text)
+    return '\n'.join(iter_docx(file))
+
+def iter_pdf(source: Source, workers: int = 1) -> Iterator[str]:
+    """
+    Page texts of a PDF, in page order.
+
+    With more than one worker and at least PARALLEL_PDF_MIN_PAGES pages, pages are
+    extracted in a process pool, PDF_PAGES_PER_TASK at a time, with a bounded number
+    of tasks in flight. Workers open the file from disk; an in-memory PDF is spilled
+    to a temporary file first.
+
+    Args:
+        source (Source): A path on disk, the file's bytes or a binary file object.
+        workers (int): Extraction processes.
+
+    Yields:
+        str: The text of each page.
+    """
+    with _mapped(source) as buffer:
+        document = fitz.open(stream=buffer, filetype='pdf')
+        try:
+            page_count = document.page_count
+            if workers <= 1 or page_count < PARALLEL_PDF_MIN_PAGES:
+                for i in range(page_count):
+                    yield document[i].get_text()
+                return
+        finally:
+            document.close()
+            del document
+
+        if _is_path(source):
+            yield from _iter_pdf_parallel(os.fspath(source), page_count, workers)
+            return
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as spill:
+            spill.write(buffer)
+            spill.flush()
+            yield from _iter_pdf_parallel(spill.name, page_count, workers)
 
 def read_pdf(file: BinaryIO) -> str:
-    file.seek(0)
-    document = fitz.open(stream=file.read(), filetype='pdf')
-    all_text = [page.get_text() for page in document]
-    document.close()
-    return '\n'.join(all_text)
+    return '\n'.join(iter_pdf(file))
+
+def _extract_pages(path: str, start: int, stop: int) -> List[str]:
+    with _mapped(path) as buffer:
+        document = fitz.open(stream=buffer, filetype='pdf')
+        try:
+            return [document[i].get_text() for i in range(start, stop)]
+        finally:
+            document.close()
+            del document
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_workers = 0
+# Documents are loaded from several threads at once (ingestion workers, API requests)
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    global _pdf_pool, _pdf_pool_workers
+    with _pdf_pool_lock:
+        if _pdf_pool is None or _pdf_pool_workers != workers:
+            if _pdf_pool is not None:
+                _pdf_pool.shutdown()
+            # Spawn rather than fork: the callers (Streamlit, the API server) are multi-threaded
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pdf_pool_workers = workers
+        return _pdf_pool
+
+def _iter_pdf_parallel(path: str, page_count: int, workers: int) -> Iterator[str]:
+    pool = _get_pdf_pool(workers)
+    ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    pending = []
+    # Keep a couple of tasks per worker in flight, so at most that many pages wait in memory
+    for start in ranges:
+        pending.append(pool.submit(_extract_pages, path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+        if len(pending) >= 2 * workers:
+            break
+    while pending:
+        pages = pending.pop(0).result()
+        start = next(ranges, None)
+        if start is not None:
+            pending.append(pool.submit(_extract_pages, path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+        yield from pages
 
 
 
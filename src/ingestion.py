@@ -0,0 +1,562 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from src.chunking import TextChunk
+from src.data_loader import iter_blocks
+from src.preprocessor import FileTextPreprocessor, load_tokenizer
+from src.utils.bm25_index import BM25Index
+from src.utils.hash_index import DocumentHashIndex, SimHasher, content_hash, document_id, vector_id
+from src.utils.job_queue import DONE, DUPLICATE, Job, JobQueue, LeaseLost
+from src.utils.telemetry import metrics, record_duration
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the parsed-document stream for the embedding threads
+_DONE = object()
+
+# Ingestion jobs an IngestionWorker runs at once
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Seconds an idle IngestionWorker waits before looking for queued jobs again
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+
+# Chunk text stored with each vector, in UTF-8 bytes; Pinecone caps metadata at 40 KB per vector
+MAX_METADATA_TEXT_BYTES = 32_000
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """Cut text to at most ``max_bytes`` UTF-8 bytes without splitting a character."""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode('utf-8', errors='ignore')
+
+class IngestionResult(NamedTuple):
+    file_name: str
+    file_hash: Optional[str]
+    chunks: int
+    seconds: float
+    error: Optional[str] = None
+    tokens: int = 0
+    duplicate: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+class ReindexStats(NamedTuple):
+    embedded: int
+    unchanged: int
+    deleted: int
+
+def build_vectors(chunks: List[TextChunk], embeddings: List[List[float]], file_hash: str, file_name: str,
+                  positions: Optional[List[int]] = None, doc_id: Optional[str] = None) -> List[dict]:
+    """
+    Build Pinecone vectors for the chunks of a document.
+
+    Vector IDs combine the stable document ID with the chunk's content hash, so a
+    chunk keeps its ID across versions of the document as long as its text is unchanged.
+
+    Args:
+        chunks (List[TextChunk]): The document chunks.
+        embeddings (List[List[float]]): One embedding per chunk, in chunk order.
+        file_hash (str): Hash of the file the chunks come from.
+        file_name (str): Name of the file the chunks come from.
+        positions (List[int], optional): Position of each chunk in the document, when
+            ``chunks`` is a subset of it. Defaults to 0..n-1.
+        doc_id (str, optional): Stable document ID (see document_id). Defaults to the
+            ID derived from ``file_hash``.
+
+    Returns:
+        List[dict]: Vectors with 'id', 'values' and 'metadata'.
+    """
+    doc_id = doc_id or document_id(file_hash)
+    vectors = []
+    for i, chunk, chunk_embedding in zip(positions or range(len(chunks)), chunks, embeddings):
+        vector = {
+            "id": vector_id(doc_id, content_hash(chunk.text)),
+            "values": chunk_embedding,
+            "metadata": {
+                "document_id": doc_id,
+                "file_hash": file_hash,
+                "file_name": file_name,
+                "chunk_id": str(i),
+                "start": chunk.start,
+                "end": chunk.end,
+                "text": truncate_utf8(chunk.text, MAX_METADATA_TEXT_BYTES)
+            }
+        }
+        if chunk.section:
+            vector["metadata"]["section"] = chunk.section
+        vectors.append(vector)
+    return vectors
+
+def with_terms(chunks: List[TextChunk], tokenize_texts: Callable[[List[str]], List[List[str]]]) -> List[TextChunk]:
+    """Attach each chunk's search terms, e.g. from FileTextPreprocessor.tokenize_texts."""
+    terms = tokenize_texts([chunk.text for chunk in chunks])
+    return [chunk._replace(terms=tuple(chunk_terms)) for chunk, chunk_terms in zip(chunks, terms)]
+
+def index_terms(term_index: BM25Index, chunks: List[TextChunk], vectors: List[dict]):
+    """Add the chunks that carry terms to the BM25 index, under their vectors' IDs and metadata."""
+    term_index.add((vector['id'], chunk.terms, vector['metadata'])
+                   for chunk, vector in zip(chunks, vectors) if chunk.terms is not None)
+
+def reindex_document(file_hash: str, file_name: str, chunks: List[TextChunk], hash_index: DocumentHashIndex,
+                     embed_fn: Callable[[List[str]], List[List[float]]], upsert_fn: Callable[[List[dict]], object],
+                     delete_fn: Optional[Callable[[List[str]], object]] = None,
+                     fingerprint: Optional[int] = None, term_index: Optional[BM25Index] = None,
+                     doc_id: Optional[str] = None) -> ReindexStats:
+    """
+    Store a (possibly new) version of a document, embedding only chunks that changed.
+
+    The chunk set is diffed against the stored version of the same document by content
+    hash. New chunks are embedded and upserted, chunks that disappeared are deleted,
+    and unchanged chunks are left in place under their existing IDs.
+
+    Args:
+        file_hash (str): Hash of the new file content.
+        file_name (str): Name of the file; determines the stable document ID.
+        chunks (List[TextChunk]): Chunks of the new version.
+        hash_index (DocumentHashIndex): Where the stored chunk sets are tracked.
+        embed_fn (Callable): Embeds a list of texts.
+        upsert_fn (Callable): Stores a list of vectors.
+        delete_fn (Callable, optional): Deletes vectors by ID. Stale vectors are kept if None.
+        fingerprint (int, optional): simhash of the document text.
+        term_index (BM25Index, optional): Kept in step with the vectors; chunks are indexed
+            with the terms attached by with_terms.
+        doc_id (str, optional): Stable ID (see document_id) of the document this file is a
+            new version of. Only then are its stored chunks reused and its stale vectors
+            deleted. Without it the file is stored as a document of its own, keyed by its
+            content, and nothing is deleted.
+
+    Returns:
+        ReindexStats: Counts of embedded, unchanged and deleted chunks.
+    """
+    doc_id = doc_id or document_id(file_hash)
+    stored = set(hash_index.document_chunks(doc_id))
+    hashes = [content_hash(chunk.text) for chunk in chunks]
+
+    # Identical chunks share a vector ID, so embed each new text only once
+    new_positions, seen = [], set()
+    for i, chunk_hash in enumerate(hashes):
+        if chunk_hash not in stored and chunk_hash not in seen:
+            new_positions.append(i)
+        seen.add(chunk_hash)
+
+    if new_positions:
+        new_chunks = [chunks[i] for i in new_positions]
+        embeddings = embed_fn([chunk.text for chunk in new_chunks])
+        vectors = build_vectors(new_chunks, embeddings, file_hash, file_name, new_positions, doc_id)
+        upsert_fn(vectors)
+        if term_index is not None:
+            index_terms(term_index, new_chunks, vectors)
+
+    stale = [vector_id(doc_id, chunk_hash) for chunk_hash in stored - seen]
+    if stale:
+        if delete_fn is not None:
+            delete_fn(stale)
+        else:
+            logger.warning(f"Left {len(stale)} stale vectors for {file_name}: no delete function given")
+        if term_index is not None:
+            term_index.delete(stale)
+
+    hash_index.add_document(file_hash, file_name, hashes, fingerprint, doc_id)
+    return ReindexStats(len(new_positions), len(seen & stored), len(stale))
+
+def default_preprocessor() -> FileTextPreprocessor:
+    """Preprocessor used by ingestion workers: Longformer tokenizer with structure chunking."""
+    return FileTextPreprocessor(load_tokenizer(), chunking='structure')
+
+# Per-process preprocessor, created once by the pool initializer
+_worker_preprocessor: Optional[FileTextPreprocessor] = None
+_worker_terms = False
+
+def _init_worker(preprocessor_factory: Callable[[], FileTextPreprocessor], terms: bool = False):
+    global _worker_preprocessor, _worker_terms
+    _worker_preprocessor = preprocessor_factory()
+    _worker_terms = terms
+
+def parse_document(file_name: str, content: bytes) -> Tuple[List[TextChunk], int, float]:
+    """
+    Read and chunk one document inside a worker process.
+
+    The document is streamed block by block from the extractor into the chunker
+    and the fingerprint, without building its full text.
+
+    Args:
+        file_name (str): The file name, used to pick the reader.
+        content (bytes): The raw file content.
+
+    Returns:
+        Tuple[List[TextChunk], int, float]: The chunks (with their terms if the pool was created
+            with terms=True), the SimHash of the text and the parsing time.
+    """
+    start_time = time.perf_counter()
+    hasher = SimHasher()
+
+    def texts():
+        for block in iter_blocks(content, file_name):
+            hasher.update(block.text)
+            yield block.text
+
+    chunks = list(_worker_preprocessor.iter_stream_chunks(texts()))
+    if _worker_terms:
+        chunks = with_terms(chunks, _worker_preprocessor.tokenize_texts)
+    return chunks, hasher.digest(), time.perf_counter() - start_time
+
+def parse_pool(preprocessor_factory: Callable[[], FileTextPreprocessor] = default_preprocessor,
+               max_workers: Optional[int] = None, terms: bool = False) -> ProcessPoolExecutor:
+    """
+    Create a process pool whose workers can run parse_document.
+
+    Args:
+        preprocessor_factory (Callable): Builds the preprocessor in each worker process.
+            Must be picklable (a module-level function).
+        max_workers (int, optional): Worker processes; defaults to the CPU count.
+        terms (bool): Whether parse_document also extracts each chunk's BM25 terms.
+
+    Returns:
+        ProcessPoolExecutor: The pool. The caller shuts it down.
+    """
+    # Spawn rather than fork: the callers (Streamlit, the API server, embedding threads) are multi-threaded
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=(preprocessor_factory, terms))
+
+class IngestionEngine:
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], upsert_fn: Callable[[List[dict]], object],
+                 preprocessor_factory: Callable[[], FileTextPreprocessor] = default_preprocessor,
+                 max_workers: Optional[int] = None, embed_workers: int = 2, queue_size: int = 8,
+                 hash_index: Optional[DocumentHashIndex] = None,
+                 delete_fn: Optional[Callable[[List[str]], object]] = None,
+                 term_index: Optional[BM25Index] = None, versions_by_name: bool = False):
+        """
+        Ingest many documents, parsing in a process pool while embedding and upserting in threads.
+
+        CPU-bound reading and chunking run in worker processes. Parsed documents are
+        handed to I/O-bound embedding/upsert threads through a bounded queue, so the
+        stages overlap and parsing cannot run arbitrarily far ahead.
+
+        Args:
+            embed_fn (Callable): Embeds a list of texts, e.g. openai_utils.get_embeddings.
+            upsert_fn (Callable): Stores a list of vectors, e.g. pinecone_utils.upsert_chunks.
+            preprocessor_factory (Callable): Builds the preprocessor in each worker process.
+                Must be picklable (a module-level function).
+            max_workers (int, optional): Worker processes; defaults to the CPU count.
+            embed_workers (int): Threads running the embedding and upsert stages.
+            queue_size (int): Parsed documents allowed to wait for embedding.
+            hash_index (DocumentHashIndex, optional): When given, files already in the index
+                are skipped before parsing, and new versions of known documents only
+                re-embed their changed chunks (see reindex_document).
+            delete_fn (Callable, optional): Deletes stale vectors by ID when documents change.
+            term_index (BM25Index, optional): When given, workers also extract each chunk's
+                terms and ingested chunks are added to this BM25 index.
+            versions_by_name (bool): Whether document names identify documents, e.g. paths
+                in a bulk source, so that a file replaces the stored document of the same
+                name. Otherwise every file is a document of its own.
+        """
+        self.embed_fn = embed_fn
+        self.upsert_fn = upsert_fn
+        self.preprocessor_factory = preprocessor_factory
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.embed_workers = embed_workers
+        self.queue_size = queue_size
+        self.hash_index = hash_index
+        self.delete_fn = delete_fn
+        self.term_index = term_index
+        self.versions_by_name = versions_by_name
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut down the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def ingest(self, documents: Iterable[Tuple[str, bytes]],
+               on_progress: Optional[Callable[[IngestionResult], None]] = None) -> List[IngestionResult]:
+        """
+        Ingest documents end to end. A failing file is reported and does not stop the batch.
+
+        Args:
+            documents (Iterable[Tuple[str, bytes]]): (file name, content) pairs.
+            on_progress (Callable, optional): Called with each file's IngestionResult as it
+                finishes. It always runs on the calling thread.
+
+        Returns:
+            List[IngestionResult]: One result per document, in completion order.
+        """
+        pool = self._get_pool()
+        parsed = queue.Queue(maxsize=self.queue_size)
+        finished = queue.Queue()
+        results: List[IngestionResult] = []
+
+        def drain():
+            while True:
+                try:
+                    result = finished.get_nowait()
+                except queue.Empty:
+                    return
+                results.append(result)
+                if result.duplicate:
+                    logger.info(f"Skipped {result.file_name}: already ingested")
+                elif result.ok:
+                    logger.info(f"Ingested {result.file_name}: {result.chunks} chunks in {result.seconds:.2f}s")
+                else:
+                    logger.error(f"Failed to ingest {result.file_name}: {result.error}")
+                if on_progress:
+                    on_progress(result)
+
+        def embed_and_upsert():
+            while True:
+                item = parsed.get()
+                if item is _DONE:
+                    return
+                file_name, file_hash, chunks, fingerprint, elapsed = item
+                start_time = time.perf_counter()
+                doc_id = document_id(file_name) if self.versions_by_name else None
+                try:
+                    if self.hash_index is not None:
+                        reindex_document(file_hash, file_name, chunks, self.hash_index, self.embed_fn,
+                                         self.upsert_fn, self.delete_fn, fingerprint, self.term_index, doc_id)
+                    elif chunks:
+                        embeddings = self.embed_fn([chunk.text for chunk in chunks])
+                        vectors = build_vectors(chunks, embeddings, file_hash, file_name, doc_id=doc_id)
+                        self.upsert_fn(vectors)
+                        if self.term_index is not None:
+                            index_terms(self.term_index, chunks, vectors)
+                    error = None
+                except Exception as e:
+                    error = str(e)
+                finished.put(IngestionResult(file_name, file_hash, len(chunks),
+                                             elapsed + time.perf_counter() - start_time, error,
+                                             sum(chunk.tokens for chunk in chunks)))
+
+        threads = [threading.Thread(target=embed_and_upsert, daemon=True) for _ in range(self.embed_workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Keep a bounded number of parse jobs in flight so file contents are not all held at once
+            max_pending = 2 * self.max_workers
+            pending = {}
+            documents = iter(documents)
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < max_pending:
+                    document = next(documents, None)
+                    if document is None:
+                        exhausted = True
+                        break
+                    file_name, content = document
+                    file_hash = hashlib.md5(content).hexdigest()
+                    if self.hash_index is not None and self.hash_index.has_document(file_hash):
+                        finished.put(IngestionResult(file_name, file_hash, 0, 0.0, duplicate=True))
+                        continue
+                    pending[pool.submit(parse_document, file_name, content)] = (file_name, file_hash)
+
+                done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_name, file_hash = pending.pop(future)
+                    try:
+                        chunks, fingerprint, elapsed = future.result()
+                    except Exception as e:
+                        finished.put(IngestionResult(file_name, file_hash, 0, 0.0, str(e)))
+                        continue
+                    record_duration('parse', elapsed)
+                    parsed.put((file_name, file_hash, chunks, fingerprint, elapsed))
+                drain()
+        finally:
+            for _ in threads:
+                parsed.put(_DONE)
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.1)
+                drain()
+            drain()
+
+        return results
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = parse_pool(self.preprocessor_factory, self.max_workers, self.term_index is not None)
+        return self._pool
+
+class IngestionWorker:
+    def __init__(self, job_queue: JobQueue, embed_fn: Callable[[List[str]], List[List[float]]],
+                 upsert_fn: Callable[[List[dict]], object], hash_index: DocumentHashIndex,
+                 delete_fn: Optional[Callable[[List[str]], object]] = None,
+                 term_index: Optional[BM25Index] = None,
+                 preprocessor_factory: Callable[[], FileTextPreprocessor] = default_preprocessor,
+                 workers: int = JOB_WORKERS, parse_workers: Optional[int] = None,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        """
+        Run the ingestion jobs of a JobQueue in the background.
+
+        Each worker thread claims a job, parses it in the process pool, then re-indexes
+        the document (see reindex_document) and records the job's progress in the queue.
+        A lease heartbeat keeps long jobs from being taken over by other workers; jobs
+        left behind by a worker that died are picked up again once their lease expires.
+        Re-running a job is safe: vector IDs are content-addressed and the document is
+        only recorded in the hash index once all its vectors are stored.
+
+        Args:
+            job_queue (JobQueue): Where the jobs come from.
+            embed_fn (Callable): Embeds a list of texts, e.g. openai_utils.get_embeddings.
+            upsert_fn (Callable): Stores a list of vectors, e.g. pinecone_utils.upsert_chunks.
+            hash_index (DocumentHashIndex): Index of ingested documents.
+            delete_fn (Callable, optional): Deletes stale vectors by ID when documents change.
+            term_index (BM25Index, optional): When given, chunk terms are added to it and it is
+                saved after every job.
+            preprocessor_factory (Callable): Builds the preprocessor in each parsing process.
+                Must be picklable (a module-level function).
+            workers (int): Jobs run at once.
+            parse_workers (int, optional): Parsing processes; defaults to ``workers``.
+            poll_interval (float): Seconds an idle worker thread waits between claims.
+        """
+        self.job_queue = job_queue
+        self.embed_fn = embed_fn
+        self.upsert_fn = upsert_fn
+        self.hash_index = hash_index
+        self.delete_fn = delete_fn
+        self.term_index = term_index
+        self.preprocessor_factory = preprocessor_factory
+        self.workers = workers
+        self.parse_workers = parse_workers or workers
+        self.poll_interval = poll_interval
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        # Jobs being run, by ID, whose leases the heartbeat renews
+        self._active = {}
+        self._active_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Start the worker threads and the lease heartbeat."""
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._run, daemon=True, name=f'ingestion-worker-{i}')
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._heartbeat, daemon=True, name='ingestion-heartbeat'))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Let running jobs finish, then stop the threads and the worker processes."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def run_once(self) -> Optional[Job]:
+        """
+        Claim and run one job on the calling thread.
+
+        Returns:
+            Optional[Job]: The job as it stands afterwards, or None if no job was ready.
+        """
+        job = self.job_queue.claim()
+        if job is None:
+            return None
+        with self._active_lock:
+            self._active[job.id] = job
+        try:
+            status, message = self._process(job)
+        except LeaseLost:
+            logger.warning(f"Ingestion job {job.id} for {job.file_name} was taken over by another worker")
+            status = self.job_queue.get(job.id).status
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} for {job.file_name} failed (attempt {job.attempts}): {str(e)}")
+            status = self.job_queue.fail(job, str(e))
+        else:
+            if self.job_queue.complete(job, status, message):
+                logger.info(f"Ingestion job {job.id} for {job.file_name}: {message}")
+            else:
+                logger.warning(f"Ingestion job {job.id} for {job.file_name} was taken over by another worker")
+        finally:
+            with self._active_lock:
+                del self._active[job.id]
+        metrics.inc('luthor_ingestion_jobs_total', status=status)
+        return self.job_queue.get(job.id)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.run_once()
+            except Exception as e:
+                # e.g. the queue database is locked for too long; try again after a pause
+                logger.error(f"Ingestion worker error: {str(e)}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.job_queue.lease_seconds / 3):
+            with self._active_lock:
+                jobs = list(self._active.values())
+            for job in jobs:
+                try:
+                    if not self.job_queue.heartbeat(job):
+                        logger.warning(f"Ingestion job {job.id} for {job.file_name} is no longer held by this worker")
+                except Exception as e:
+                    logger.error(f"Could not renew the lease of ingestion job {job.id}: {str(e)}")
+
+    def _process(self, job: Job) -> Tuple[str, str]:
+        if self.hash_index.has_document(job.file_hash):
+            return DUPLICATE, 'Already ingested'
+        content = self.job_queue.content(job.id)
+        if content is None:
+            raise ValueError(f"The content of job {job.id} is no longer stored")
+
+        self._report(job, 'parsing', 0.1)
+        chunks, fingerprint, elapsed = self._get_pool().submit(parse_document, job.file_name, content).result()
+        record_duration('parse', elapsed)
+        near_duplicate = self.hash_index.find_near_duplicate(fingerprint)
+
+        self._report(job, 'embedding', 0.4)
+        doc_id = document_id(job.document_key) if job.document_key else None
+        stats = reindex_document(job.file_hash, job.file_name, chunks, self.hash_index, self.embed_fn,
+                                 self.upsert_fn, self.delete_fn, fingerprint, self.term_index, doc_id)
+        if self.term_index is not None:
+            self._report(job, 'indexing', 0.9)
+            self.term_index.save()
+
+        message = (f"{len(chunks)} chunks: {stats.embedded} embedded, {stats.unchanged} unchanged, "
+                   f"{stats.deleted} deleted")
+        if near_duplicate:
+            message += f"; very similar to {near_duplicate['file_name']}"
+        return DONE, message
+
+    def _report(self, job: Job, stage: str, progress: float):
+        # Another worker that took the job over is redoing it; stop rather than race it
+        if not self.job_queue.heartbeat(job, stage, progress):
+            raise LeaseLost(f"Job {job.id} is no longer held by this worker")
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = parse_pool(self.preprocessor_factory, self.parse_workers, self.term_index is not None)
+            return self._pool
@@ -1,19 +1,99 @@
+import logging
+import os
 import re
-from typing import List, Tuple
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import nltk
-from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 
-# Ensure nltk resources are downloaded during setup or first run
+from src.chunking import (SECTION_BREAK_PATTERN, TextChunk, iter_section_chunks, iter_stream_section_chunks,
+                          iter_token_windows)
+from src.utils.telemetry import span
+
+logger = logging.getLogger(__name__)
+
+CHUNKING_STRATEGIES = ('window', 'structure')
+
+# Outputs of the preprocessing pipeline, in the order preprocess_doc runs them
+PIPELINE_STAGES = ('segments', 'cleaned_text', 'tokens', 'structured_text', 'chunks')
+
+TOKENIZER_NAME = 'allenai/longformer-base-4096'
+# Directory of assets baked at build time by src.assets (tokenizer.json)
+ASSETS_DIR = os.environ.get('LUTHOR_ASSETS_DIR', 'assets')
+TOKENIZER_FILE = 'tokenizer.json'
+# NLTK resources used by the preprocessor, by download name and data path
+NLTK_RESOURCES = {'stopwords': 'corpora/stopwords', 'wordnet': 'corpora/wordnet'}
+
+# Words, keeping internal periods, hyphens and apostrophes ("4.2", "U.S.C", "non-compete",
+# "buyer's"), and single punctuation marks, in the spirit of NLTK's Treebank tokenizer
+WORD_TOKEN_PATTERN = re.compile(r"\w+(?:[-.'’]\w+)*|[^\w\s]")
+# Characters not usually found in legal texts
+SPECIAL_CHARACTER_PATTERN = re.compile(r'[^\w\s,.!?;:()-]')
+# Lines starting with a capital letter, treated as headings
+HEADING_LINE_PATTERN = re.compile(r'(?m)^(?=[A-Z])(.+)$')
+
+# Distinct tokens whose normalised form is memoised per preprocessor
+TERM_CACHE_SIZE = 100_000
+
+class FastTokenizer:
+    def __init__(self, tokenizer):
+        """
+        Adapter giving a ``tokenizers.Tokenizer`` the part of the transformers tokenizer
+        interface the chunkers use.
+
+        Args:
+            tokenizer (tokenizers.Tokenizer): The Rust tokenizer.
+        """
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def from_file(cls, path: str) -> 'FastTokenizer':
+        from tokenizers import Tokenizer
+        return cls(Tokenizer.from_file(path))
+
+    def __call__(self, texts: List[str], add_special_tokens: bool = True) -> Dict[str, List[List[int]]]:
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=add_special_tokens)
+        return {'input_ids': [encoding.ids for encoding in encodings]}
+
+    def num_special_tokens_to_add(self, pair: bool = False) -> int:
+        post_processor = self.tokenizer.post_processor
+        return post_processor.num_special_tokens_to_add(pair) if post_processor is not None else 0
+
+def load_tokenizer(name: str = TOKENIZER_NAME, assets_dir: str = ASSETS_DIR):
+    """
+    Load the tokenizer used for chunking.
+
+    The tokenizer.json baked into ``assets_dir`` is loaded directly with the Rust
+    tokenizers library, which takes milliseconds and needs neither transformers nor the
+    network. Without it, the fast Hugging Face tokenizer is loaded from the hub cache.
+
+    Args:
+        name (str): The Hugging Face model name.
+        assets_dir (str): Directory written by ``python -m src.assets``.
+
+    Returns:
+        The tokenizer.
+    """
+    path = os.path.join(assets_dir, TOKENIZER_FILE)
+    if os.path.exists(path):
+        return FastTokenizer.from_file(path)
+    logger.info(f"No tokenizer at {path}, loading {name} with transformers")
+    # Imported here so callers that bring their own tokenizer do not pay for transformers
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name, use_fast=True)
+
 def setup_nltk():
-    nltk.download('stopwords', quiet=True)
-    nltk.download('punkt', quiet=True)
-    nltk.download('wordnet', quiet=True)
+    """Download the NLTK resources the preprocessor uses, unless they are already installed."""
+    for resource, path in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(resource, quiet=True)
 
 class FileTextPreprocessor:
-    def __init__(self, tokenizer, chunk_size=4096, overlap=0):
+    def __init__(self, tokenizer, chunk_size=4096, overlap=0, chunking='window'):
         """
         Initialize the FileTextPreprocessor with a tokenizer and configuration for chunking.
 
@@ -21,12 +101,20 @@ class FileTextPreprocessor:
             tokenizer (object): The tokenizer object to encode and decode text.
             chunk_size (int): The desired size of each chunk.
             overlap (int): The number of tokens to overlap between chunks.
+            chunking (str): 'window' for fixed token windows, or 'structure' to pack
+                whole segments from text_segmentation into chunks.
         """
+        if chunking not in CHUNKING_STRATEGIES:
+            raise ValueError(f"Unsupported chunking strategy: {chunking}")
+
         self.tokenizer = tokenizer
         self.chunk_size = chunk_size
         self.overlap = overlap
+        self.chunking = chunking
         self.stop_words = set(stopwords.words('english'))
         self.lemmatizer = WordNetLemmatizer()
+        # Word frequencies are heavily skewed, so most tokens skip the stopword check and WordNet
+        self._term = lru_cache(maxsize=TERM_CACHE_SIZE)(self._normalize_token)
 
     def text_segmentation(self, text: str) -> List[str]:
         """
@@ -38,11 +126,8 @@ class FileTextPreprocessor:
         Returns:
             List[str]: A list of segmented text chunks.
         """
-        # Identify section breaks (e.g. double newlines, headings, and bullet points).
-        pattern = r'(?<=\n)(?=\n)|(?<=\n)(?=\s*[\d-]+\s)|(?<=\n)(?=Section \d+|Article \d+)|(?<=\n)(?=\s*-\s)|(?<=\n)(?=\s*\*\s)'
-
-        # Split the text using the defined pattern
-        segments = re.split(pattern, text.strip())
+        # Split the text at section breaks (e.g. double newlines, headings, and bullet points)
+        segments = SECTION_BREAK_PATTERN.split(text.strip())
 
         # Clean up the segments to remove any leading/trailing whitespace
         segmented_text = [segment.strip() for segment in segments if segment.strip()]
@@ -53,27 +138,35 @@ class FileTextPreprocessor:
         """
         Tokenize the text into words, considering legal-specific tokens and preprocessing.
 
+        Tokens are lowercased, stopwords removed and the rest lemmatized in a single pass.
+
         Args:
             text (str): The text to be tokenized.
 
         Returns:
             List[str]: A list of tokens (words).
         """
-        # Tokenize words using NLTK
-        tokens = word_tokenize(text)
+        term = self._term
+        return [token for token in map(term, WORD_TOKEN_PATTERN.findall(text.lower())) if token is not None]
 
-        # Convert to lowercase
-        tokens = [token.lower() for token in tokens]
+    def tokenize_texts(self, texts: Iterable[str]) -> List[List[str]]:
+        """
+        Tokenize many texts, e.g. the chunks of a document, sharing one term cache.
 
-        # Remove stopwords specific to legal context
-        stop_words = set(stopwords.words('english'))
-        tokens = [token for token in tokens if token not in stop_words]
+        Args:
+            texts (Iterable[str]): The texts to be tokenized.
 
-        # Reduce tokens to their base form
-        lemmatizer = WordNetLemmatizer()
-        tokens = [lemmatizer.lemmatize(token) for token in tokens]
+        Returns:
+            List[List[str]]: The tokens of each text, as tokenize_text returns them.
+        """
+        term, findall = self._term, WORD_TOKEN_PATTERN.findall
+        return [[token for token in map(term, findall(text.lower())) if token is not None] for text in texts]
 
-        return tokens
+    def _normalize_token(self, token: str) -> Optional[str]:
+        # The lemma of a lowercased token, or None for stopwords
+        if token in self.stop_words:
+            return None
+        return self.lemmatizer.lemmatize(token)
 
     def clean_special_characters(self, text: str) -> str:
         """
@@ -86,7 +179,7 @@ class FileTextPreprocessor:
             str: Cleaned text with unnecessary special characters removed.
         """
         # Remove characters not usually found in legal texts
-        cleaned_text = re.sub(r'[^\w\s,.!?;:()-]', '', text)
+        cleaned_text = SPECIAL_CHARACTER_PATTERN.sub('', text)
 
         return cleaned_text
 
@@ -101,10 +194,46 @@ class FileTextPreprocessor:
             str: Text with preserved structure for headings and sections.
         """
         # Keep lines starting with capital words as headings
-        structured_text = re.sub(r'(?m)^(?=[A-Z])(.+)$', r'## \1', text)
+        structured_text = HEADING_LINE_PATTERN.sub(r'## \1', text)
 
         return structured_text
 
+    def iter_chunks(self, text: str) -> Iterator[TextChunk]:
+        """
+        Lazily chunk the full text with the configured strategy.
+
+        Window chunking honours the configured overlap; structure chunking keeps
+        segments whole and tags each chunk with its section heading.
+
+        Args:
+            text (str): The full text to be chunked.
+
+        Yields:
+            TextChunk: Each chunk with its character offsets in ``text``.
+        """
+        if self.chunking == 'structure':
+            return iter_section_chunks(text, self.tokenizer, self.chunk_size)
+        return iter_token_windows(text, self.tokenizer, self.chunk_size, self.overlap)
+
+    def iter_stream_chunks(self, blocks: Iterable[str]) -> Iterator[TextChunk]:
+        """
+        Clean and chunk a document read as a stream of text blocks, e.g. by data_loader.iter_blocks.
+
+        The chunks are those chunk_document gives for the blocks joined by newlines.
+        Structure chunking consumes the blocks as they arrive; window chunking marks
+        headings on the whole text, so the blocks are joined first.
+
+        Args:
+            blocks (Iterable[str]): The text blocks, in document order.
+
+        Yields:
+            TextChunk: Each chunk with its character offsets in the cleaned text.
+        """
+        cleaned = (self.clean_special_characters(block) for block in blocks)
+        if self.chunking == 'structure':
+            return iter_stream_section_chunks(cleaned, self.tokenizer, self.chunk_size)
+        return self.iter_chunks(self.preserve_structure('\n'.join(cleaned)))
+
     def create_chunks(self, text: str) -> List[str]:
         """
         Creates chunks of text for preprocessing, ensuring each chunk is within the specified size.
@@ -113,18 +242,41 @@ class FileTextPreprocessor:
             text (str): The full text to be chunked.
 
         Returns:
-            List[str]: A list of text chunks.
+            List[str]: A list of text chunks covering the whole text.
+        """
+        return [chunk.text for chunk in self.iter_chunks(text)]
+
+    def process(self, text: str, outputs: Optional[Iterable[str]] = None) -> 'PreprocessedDocument':
+        """
+        Start a lazy preprocessing pipeline for a document.
+
+        Stages only run when their output (or an output depending on it) is requested,
+        and each stage runs at most once per document.
+
+        Args:
+            text (str): The full text of the document.
+            outputs (Iterable[str], optional): Stages to compute straight away. Any other
+                stage is computed on first access.
+
+        Returns:
+            PreprocessedDocument: The document with memoized stage outputs and timings.
         """
-        # Tokenize the text using the tokenizer associated with this instance
-        tokens = self.tokenizer.encode(text, add_special_tokens=True, truncation=True, max_length=self.chunk_size)
+        document = PreprocessedDocument(self, text)
+        for stage in outputs or ():
+            document.get(stage)
+        return document
 
-        # Split tokens into chunks of the specified size, considering overlap
-        chunks = [tokens[i:i + self.chunk_size] for i in range(0, len(tokens), self.chunk_size - self.overlap)]
+    def chunk_document(self, text: str) -> List[TextChunk]:
+        """
+        Clean and chunk a document without running the NLP stages.
 
-        # Decode each chunk back into text
-        text_chunks = [self.tokenizer.decode(chunk, skip_special_tokens=True) for chunk in chunks]
+        Args:
+            text (str): The full text of the document.
 
-        return text_chunks
+        Returns:
+            List[TextChunk]: The chunks with offsets and, for structure chunking, section headings.
+        """
+        return self.process(text).chunks
 
     def preprocess_doc(self, text: str) -> Tuple[str, List[str], str, List[str], str, List[str]]:
         """
@@ -142,19 +294,83 @@ class FileTextPreprocessor:
                 - Structured text (str)
                 - Chunks (List[str])
         """
-        # Step 1: Segmentation
-        segments = self.text_segmentation(text)
+        document = self.process(text, outputs=PIPELINE_STAGES)
+        chunks = [chunk.text for chunk in document.chunks]
+
+        return text, document.segments, document.cleaned_text, document.tokens, document.structured_text, chunks
 
-        # Step 2: Clean special characters from the full text
-        cleaned_text = self.clean_special_characters(text)
+class PreprocessedDocument:
+    def __init__(self, preprocessor: FileTextPreprocessor, text: str):
+        """
+        Lazily computed, memoized preprocessing outputs for a single document.
 
-        # Step 3: Tokenize the cleaned text
-        tokens = self.tokenize_text(cleaned_text)
+        Args:
+            preprocessor (FileTextPreprocessor): The preprocessor providing each stage.
+            text (str): The full text of the document.
+        """
+        self.preprocessor = preprocessor
+        self.text = text
+        self.timings: Dict[str, float] = {}
+        self._outputs: Dict[str, object] = {}
 
-        # Step 4: Preserve structure in the cleaned text
-        structured_text = self.preserve_structure(cleaned_text)
+    def get(self, stage: str):
+        """
+        Return the output of a stage, running it (and the stages it depends on) if needed.
 
-        # Step 5: Create chunks from the structured text
-        chunks = self.create_chunks(structured_text)
+        Args:
+            stage (str): One of PIPELINE_STAGES.
 
-        return text, segments, cleaned_text, tokens, structured_text, chunks
+        Returns:
+            The stage output.
+        """
+        if stage not in PIPELINE_STAGES:
+            raise ValueError(f"Unknown preprocessing stage: {stage}")
+
+        if stage not in self._outputs:
+            # Resolve the input first so the timing only covers the stage itself
+            stage_input = self._input(stage)
+            with span(f'preprocess.{stage}') as stage_span:
+                self._outputs[stage] = self._run(stage, stage_input)
+            self.timings[stage] = stage_span.duration
+        return self._outputs[stage]
+
+    @property
+    def segments(self) -> List[str]:
+        return self.get('segments')
+
+    @property
+    def cleaned_text(self) -> str:
+        return self.get('cleaned_text')
+
+    @property
+    def tokens(self) -> List[str]:
+        return self.get('tokens')
+
+    @property
+    def structured_text(self) -> str:
+        return self.get('structured_text')
+
+    @property
+    def chunks(self) -> List[TextChunk]:
+        return self.get('chunks')
+
+    def _input(self, stage: str) -> str:
+        if stage in ('segments', 'cleaned_text'):
+            return self.text
+        if stage == 'chunks' and self.preprocessor.chunking == 'window':
+            # Window chunking works on the text with headings marked;
+            # structure chunking needs the raw segment boundaries
+            return self.structured_text
+        return self.cleaned_text
+
+    def _run(self, stage: str, text: str):
+        preprocessor = self.preprocessor
+        if stage == 'segments':
+            return preprocessor.text_segmentation(text)
+        if stage == 'cleaned_text':
+            return preprocessor.clean_special_characters(text)
+        if stage == 'tokens':
+            return preprocessor.tokenize_text(text)
+        if stage == 'structured_text':
+            return preprocessor.preserve_structure(text)
+        return list(preprocessor.iter_chunks(text))
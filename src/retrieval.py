@@ -0,0 +1,125 @@
+import logging
+import re
+from typing import Callable, Dict, List, Optional, Sequence
+
+from src.utils.bm25_index import BM25Index
+from src.utils.telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Conventional RRF constant: damps the influence of the very top ranks
+RRF_K = 60
+
+# Quoted phrases and citations ("Section 4.2", "Art. 12", "§ 3", "42 U.S.C. 1983", "Smith v. Jones")
+QUOTED_PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+CITATION_PATTERN = re.compile(
+    r'§|\b(?:Section|Sec\.|Article|Art\.|Rule|Clause)\s*\d+(?:\.\d+)*|\b\d+\s+[A-Z][\w.]*\s+\d+|\bv\.\s',
+    re.IGNORECASE
+)
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[dict]], k: int = RRF_K) -> List[dict]:
+    """
+    Merge ranked match lists with Reciprocal Rank Fusion.
+
+    A match scores the sum of 1 / (k + rank) over the lists it appears in. Its 'score' is
+    that sum scaled so the best possible fused score is 1, and the original scores are
+    kept under 'scores'.
+
+    Args:
+        rankings (Sequence[Sequence[dict]]): Match lists ('id', 'score', 'metadata'), best first.
+        k (int): The RRF constant.
+
+    Returns:
+        List[dict]: The fused matches, best first.
+    """
+    fused: Dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            entry = fused.get(match['id'])
+            if entry is None:
+                entry = fused[match['id']] = {'id': match['id'], 'score': 0.0, 'metadata': match.get('metadata') or {},
+                                              'scores': []}
+            entry['score'] += 1.0 / (k + rank)
+            entry['scores'].append(match.get('score'))
+            if not entry['metadata'] and match.get('metadata'):
+                entry['metadata'] = match['metadata']
+
+    best_possible = len(rankings) / (k + 1) if rankings else 1.0
+    for entry in fused.values():
+        entry['score'] /= best_possible
+    return sorted(fused.values(), key=lambda entry: entry['score'], reverse=True)
+
+def is_exact_lookup(query: str) -> bool:
+    """Return True for queries asking for a quoted phrase or a citation rather than a concept."""
+    return bool(QUOTED_PHRASE_PATTERN.search(query) or CITATION_PATTERN.search(query))
+
+class HybridRetriever:
+    def __init__(self, term_index: BM25Index, tokenize: Callable[[str], List[str]],
+                 query_fn: Callable[..., List[dict]], rrf_k: int = RRF_K):
+        """
+        Retrieve chunks by fusing vector search with the local BM25 index.
+
+        Args:
+            term_index (BM25Index): Index of chunk terms, built at ingest time.
+            tokenize (Callable): Turns text into terms, e.g. FileTextPreprocessor.tokenize_text.
+                Must be the pipeline the index was built with.
+            query_fn (Callable): Vector search, e.g. pinecone_utils.query_pinecone.
+            rrf_k (int): The RRF constant.
+        """
+        self.term_index = term_index
+        self.tokenize = tokenize
+        self.query_fn = query_fn
+        self.rrf_k = rrf_k
+
+    def lexical_search(self, query: str, filters: Optional[dict] = None, top_k: int = 20,
+                       require_all: bool = False) -> List[dict]:
+        """BM25 matches for the query's terms."""
+        with span('lexical', top_k=top_k, require_all=require_all) as lexical_span:
+            matches = self.term_index.search(self.tokenize(query), filters=filters, top_k=top_k,
+                                             require_all=require_all)
+            lexical_span.set(matches=len(matches))
+        return matches
+
+    def exact_lookup(self, query: str, filters: Optional[dict] = None, top_k: int = 20) -> Optional[List[dict]]:
+        """
+        Answer quoted-phrase and citation queries from the local index alone.
+
+        Every term of the query must occur in a match, and quoted phrases must occur verbatim
+        (ignoring case) in its text.
+
+        Args:
+            query (str): The user's question.
+            filters (dict, optional): Pinecone-style metadata filter.
+            top_k (int): Number of matches to return.
+
+        Returns:
+            Optional[List[dict]]: The matches, or None if the query is not an exact lookup or
+                nothing matches locally, in which case the caller should fall back to search().
+        """
+        if not is_exact_lookup(query):
+            return None
+        phrases = [phrase.lower() for phrase in QUOTED_PHRASE_PATTERN.findall(query)]
+        candidates = self.lexical_search(query, filters, top_k=top_k * 4 if phrases else top_k, require_all=True)
+        matches = [match for match in candidates
+                   if all(phrase in match['metadata'].get('text', '').lower() for phrase in phrases)][:top_k]
+        if matches:
+            logger.info(f"Answered exact lookup from the local index: {len(matches)} matches")
+        return matches or None
+
+    def search(self, query: str, query_vector: List[float], filters: Optional[dict] = None,
+               top_k: int = 20) -> List[dict]:
+        """
+        Fuse vector and BM25 results with Reciprocal Rank Fusion.
+
+        Args:
+            query (str): The user's question.
+            query_vector (List[float]): Its embedding.
+            filters (dict, optional): Pinecone-style metadata filter.
+            top_k (int): Number of matches to return, and to fetch from each source.
+
+        Returns:
+            List[dict]: The fused matches, best first.
+        """
+        vector_matches = self.query_fn(query_vector, filters=filters, top_k=top_k)
+        lexical_matches = self.lexical_search(query, filters, top_k=top_k)
+        return reciprocal_rank_fusion([vector_matches, lexical_matches], self.rrf_k)[:top_k]
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utils.telemetry import record_cache
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600.0, max_entries: int = 1000):
+        """
+        Cache of generated answers, looked up by query-embedding similarity.
+
+        A question hits the cache when a previous question asked with the same filters
+        has an embedding with cosine similarity of at least ``threshold``. Entries
+        expire after ``ttl`` seconds and are all dropped by invalidate(), e.g. when
+        documents are added to or removed from the index.
+
+        Args:
+            threshold (float): Minimum cosine similarity for a hit.
+            ttl (float): Seconds an answer stays valid.
+            max_entries (int): Maximum number of cached answers; the oldest are evicted first.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Per filter key: matrix of normalised query embeddings and the matching entries
+        self._groups: Dict[str, Tuple[np.ndarray, List[dict]]] = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, embedding: List[float], filters: Optional[dict] = None) -> Optional[Tuple[str, Any]]:
+        """
+        Find a cached answer for a semantically equivalent question.
+
+        Args:
+            embedding (List[float]): Embedding of the question.
+            filters (dict, optional): Metadata filters the question is asked with.
+
+        Returns:
+            Optional[Tuple[str, Any]]: The cached (answer, matches), or None on a miss.
+        """
+        query = _normalise(embedding)
+        now = time.time()
+        with self._lock:
+            group = self._groups.get(_filters_key(filters))
+            if group is not None:
+                matrix, entries = group
+                similarities = matrix @ query
+                # Expired entries can never be returned
+                similarities[[now - entry['created_at'] > self.ttl for entry in entries]] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    record_cache('answer', True)
+                    return entries[best]['answer'], entries[best]['matches']
+            self.misses += 1
+            record_cache('answer', False)
+            return None
+
+    def store(self, embedding: List[float], filters: Optional[dict], answer: str, matches: Any):
+        """
+        Cache the answer to a question.
+
+        Args:
+            embedding (List[float]): Embedding of the question.
+            filters (dict, optional): Metadata filters the question was asked with.
+            answer (str): The generated answer.
+            matches (Any): The retrieved matches the answer is based on.
+        """
+        key = _filters_key(filters)
+        entry = {'answer': answer, 'matches': matches, 'created_at': time.time()}
+        with self._lock:
+            matrix, entries = self._groups.get(key, (np.zeros((0, len(embedding)), dtype=np.float32), []))
+            self._groups[key] = (np.vstack([matrix, _normalise(embedding)]), entries + [entry])
+            self._size += 1
+            while self._size > self.max_entries:
+                self._evict_oldest()
+
+    def invalidate(self):
+        """Drop every cached answer."""
+        with self._lock:
+            self._groups.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the number of cached answers."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'entries': self._size,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def _evict_oldest(self):
+        key = min(self._groups, key=lambda k: self._groups[k][1][0]['created_at'])
+        matrix, entries = self._groups[key]
+        if len(entries) == 1:
+            del self._groups[key]
+        else:
+            self._groups[key] = (matrix[1:], entries[1:])
+        self._size -= 1
+
+def _normalise(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+def _filters_key(filters: Optional[dict]) -> str:
+    return json.dumps(filters or {}, sort_keys=True, default=str)
@@ -0,0 +1,371 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from src.utils.vector_store import matches_filter
+
+logger = logging.getLogger(__name__)
+
+# Compact the postings once this share of the indexed chunks has been deleted
+COMPACTION_THRESHOLD = 0.2
+
+class BM25Index:
+    def __init__(self, path: Optional[str] = None, k1: float = 1.2, b: float = 0.75):
+        """
+        Local BM25 inverted index over the terms of ingested chunks.
+
+        Each term's postings are two growable arrays, chunk numbers and term frequencies
+        (4 bytes each per posting), so the index stays compact and scoring a query term
+        is a vectorised NumPy operation. Chunks are keyed by their vector ID and keep
+        their vector metadata, so lexical matches can be returned without the vector store.
+        Deleted chunks are masked out and dropped from the postings on compaction.
+
+        Saved indexes live in one SQLite file, index.sqlite, under ``path``: the
+        metadata of each chunk in its own row, written once when the chunk is added,
+        and the postings as a single row of arrays. Several processes, e.g. the app and
+        the bulk CLI, may save to the same path: each save merges the changes saved by
+        the others, and searches pick them up.
+
+        Args:
+            path (str, optional): Directory the index is saved to and loaded from. In memory if None.
+            k1 (float): BM25 term-frequency saturation.
+            b (float): BM25 length normalisation.
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        # Chunks added or removed since the last save, whose metadata rows must be written
+        self._added: Set[str] = set()
+        self._removed: Set[str] = set()
+        # Save counter of the state last loaded or saved, stored as the file's user_version
+        self._generation = 0
+        self._reset()
+        if path and os.path.exists(os.path.join(path, 'index.sqlite')):
+            self._load()
+        elif path and os.path.exists(os.path.join(path, 'terms.json')):
+            self._load_json()
+
+    def _reset(self):
+        self._terms: Dict[str, int] = {}
+        self._postings_docs: List[array] = []
+        self._postings_tfs: List[array] = []
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Optional[dict]] = []
+        self._rows: Dict[str, int] = {}
+        self._lengths = array('I')
+        self._alive = bytearray()
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, entries: Iterable[Tuple[str, Sequence[str], dict]]):
+        """
+        Index chunks, replacing any already indexed under the same ID.
+
+        Args:
+            entries (Iterable[Tuple[str, Sequence[str], dict]]): (vector ID, terms, metadata) per chunk.
+        """
+        with self._lock:
+            for vector_id, terms, metadata in entries:
+                if vector_id in self._rows:
+                    self._remove(vector_id)
+                row = len(self._ids)
+                self._added.add(vector_id)
+                self._removed.discard(vector_id)
+                self._ids.append(vector_id)
+                self._metadata.append(metadata)
+                self._rows[vector_id] = row
+                self._lengths.append(len(terms))
+                self._alive.append(1)
+                self._total_length += len(terms)
+                for term, tf in Counter(terms).items():
+                    term_id = self._terms.get(term)
+                    if term_id is None:
+                        term_id = self._terms[term] = len(self._postings_docs)
+                        self._postings_docs.append(array('I'))
+                        self._postings_tfs.append(array('I'))
+                    self._postings_docs[term_id].append(row)
+                    self._postings_tfs[term_id].append(tf)
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """
+        Remove chunks by vector ID. IDs not indexed here are ignored, or for a saved index
+        deleted from the file on the next save, in case another process saved them.
+
+        Returns:
+            int: The number of chunks removed.
+        """
+        with self._lock:
+            removed = 0
+            for vector_id in ids:
+                if vector_id in self._rows:
+                    removed += self._remove(vector_id)
+                elif self.path:
+                    # Another process may have saved it; the deletion is applied when merging on save
+                    self._removed.add(vector_id)
+            if len(self._ids) and (len(self._ids) - len(self._rows)) / len(self._ids) > COMPACTION_THRESHOLD:
+                self.compact()
+        return removed
+
+    def _remove(self, vector_id: str) -> bool:
+        row = self._rows.pop(vector_id)
+        self._added.discard(vector_id)
+        self._removed.add(vector_id)
+        self._alive[row] = 0
+        self._total_length -= self._lengths[row]
+        self._metadata[row] = None
+        return True
+
+    def search(self, terms: Sequence[str], filters: Optional[dict] = None, top_k: int = 20,
+               require_all: bool = False) -> List[dict]:
+        """
+        Rank indexed chunks by BM25 score for the query terms.
+
+        Args:
+            terms (Sequence[str]): Query terms, produced by the same pipeline as the indexed terms.
+            filters (dict, optional): Pinecone-style metadata filter.
+            top_k (int): Number of matches to return.
+            require_all (bool): Only return chunks containing every query term.
+
+        Returns:
+            List[dict]: Matches with 'id', 'score' (the BM25 score) and 'metadata', best first.
+        """
+        with self._lock:
+            self.refresh()
+            n_docs = len(self._rows)
+            if not n_docs or top_k <= 0:
+                return []
+            alive = np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool)
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            average_length = self._total_length / n_docs or 1.0
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            hits = np.zeros(len(self._ids), dtype=np.int32)
+
+            query_terms = list(dict.fromkeys(terms))
+            for term in query_terms:
+                term_id = self._terms.get(term)
+                if term_id is None:
+                    if require_all:
+                        return []
+                    continue
+                docs = np.frombuffer(self._postings_docs[term_id], dtype=np.uint32)
+                tfs = np.frombuffer(self._postings_tfs[term_id], dtype=np.uint32).astype(np.float32)
+                live = alive[docs]
+                docs, tfs = docs[live], tfs[live]
+                if docs.size == 0:
+                    continue
+                idf = np.log(1 + (n_docs - docs.size + 0.5) / (docs.size + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / average_length)
+                # Each chunk appears at most once per term, so plain fancy-index addition is safe
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+                hits[docs] += 1
+
+            candidates = np.flatnonzero(hits >= len(query_terms)) if require_all else np.flatnonzero(scores > 0)
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+            matches = []
+            for row in candidates:
+                metadata = self._metadata[row]
+                if filters and not matches_filter(metadata, filters):
+                    continue
+                matches.append({'id': self._ids[row], 'score': float(scores[row]), 'metadata': dict(metadata)})
+                if len(matches) == top_k:
+                    break
+        return matches
+
+    def compact(self):
+        """Rebuild the postings without deleted chunks."""
+        with self._lock:
+            live_rows = [row for row in range(len(self._ids)) if self._alive[row]]
+            entries = [(self._ids[row], self._metadata[row]) for row in live_rows]
+            renumber = {row: i for i, row in enumerate(live_rows)}
+            postings = []
+            for term, term_id in self._terms.items():
+                pairs = [(renumber[doc], tf) for doc, tf in zip(self._postings_docs[term_id], self._postings_tfs[term_id])
+                         if doc in renumber]
+                if pairs:
+                    postings.append((term, pairs))
+            lengths = [self._lengths[row] for row in live_rows]
+
+            self._reset()
+            for (vector_id, metadata), length in zip(entries, lengths):
+                self._rows[vector_id] = len(self._ids)
+                self._ids.append(vector_id)
+                self._metadata.append(metadata)
+                self._lengths.append(length)
+                self._alive.append(1)
+                self._total_length += length
+            for term, pairs in postings:
+                self._terms[term] = len(self._postings_docs)
+                self._postings_docs.append(array('I', (doc for doc, _ in pairs)))
+                self._postings_tfs.append(array('I', (tf for _, tf in pairs)))
+
+    def refresh(self):
+        """Pick up chunks other processes saved to ``path``, keeping unsaved changes."""
+        if not self.path or not os.path.exists(os.path.join(self.path, 'index.sqlite')):
+            return
+        with self._lock:
+            db = self._connect()
+            if db.execute('PRAGMA user_version').fetchone()[0] != self._generation:
+                # One read transaction, so the save counter and the postings are of the same save
+                db.execute('BEGIN')
+                try:
+                    self._merge_saved(db)
+                finally:
+                    db.commit()
+
+    def save(self):
+        """
+        Write the index to ``path`` in one SQLite transaction.
+
+        A crash leaves either the previous or the new index, never a mix of the two.
+        Only the metadata of chunks added or removed since the last save is written;
+        the postings, a few bytes per term occurrence, are rewritten in full. If another
+        process saved in the meantime, its changes are merged first, within the same
+        transaction, so neither overwrites the other.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            db = self._connect()
+            # Taking the write lock first means no other process saves between the merge and the write
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                generation = db.execute('PRAGMA user_version').fetchone()[0]
+                if generation != self._generation:
+                    self._merge_saved(db)
+                self._write(db)
+                db.execute(f'PRAGMA user_version = {generation + 1}')
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+            self._generation = generation + 1
+            self._added.clear()
+            self._removed.clear()
+
+    def _write(self, db: sqlite3.Connection):
+        if len(self._rows) < len(self._ids):
+            self.compact()
+        terms = list(self._terms)
+        offsets = np.cumsum([0] + [len(self._postings_docs[self._terms[term]]) for term in terms], dtype=np.int64)
+        docs = np.concatenate([np.frombuffer(self._postings_docs[self._terms[term]], dtype=np.uint32)
+                               for term in terms]) if terms else np.zeros(0, dtype=np.uint32)
+        tfs = np.concatenate([np.frombuffer(self._postings_tfs[self._terms[term]], dtype=np.uint32)
+                              for term in terms]) if terms else np.zeros(0, dtype=np.uint32)
+
+        db.executemany('DELETE FROM chunks WHERE id = ?', [(vector_id,) for vector_id in self._removed])
+        db.executemany('INSERT OR REPLACE INTO chunks VALUES (?, ?)',
+                       [(vector_id, json.dumps(self._metadata[self._rows[vector_id]], default=str))
+                        for vector_id in self._added])
+        db.execute('INSERT OR REPLACE INTO postings VALUES (0, ?, ?, ?, ?, ?, ?)',
+                   (json.dumps(terms), json.dumps(self._ids), offsets.tobytes(), docs.tobytes(),
+                    tfs.tobytes(), self._lengths.tobytes()))
+
+    def _merge_saved(self, db: sqlite3.Connection):
+        # Reload the saved index, then replay the changes made here since the last save
+        added = self._chunk_terms(self._added)
+        removed = set(self._removed)
+        self._reset()
+        self._load_saved(db)
+        for vector_id in removed:
+            if vector_id in self._rows:
+                self._remove(vector_id)
+        self.add(added)
+
+    def _chunk_terms(self, ids: Iterable[str]) -> List[Tuple[str, List[str], dict]]:
+        # The terms of indexed chunks, recovered from the postings, as entries for add()
+        rows = {self._rows[vector_id]: vector_id for vector_id in ids}
+        terms = list(self._terms)
+        if not rows or not terms:
+            return [(vector_id, [], self._metadata[row]) for row, vector_id in rows.items()]
+        sizes = [len(self._postings_docs[self._terms[term]]) for term in terms]
+        docs = np.concatenate([np.frombuffer(self._postings_docs[self._terms[term]], dtype=np.uint32) for term in terms])
+        tfs = np.concatenate([np.frombuffer(self._postings_tfs[self._terms[term]], dtype=np.uint32) for term in terms])
+        term_ids = np.repeat(np.arange(len(terms)), sizes)
+        chunk_terms: Dict[int, List[str]] = {row: [] for row in rows}
+        for position in np.flatnonzero(np.isin(docs, np.fromiter(rows, dtype=np.uint32))):
+            chunk_terms[int(docs[position])].extend([terms[term_ids[position]]] * int(tfs[position]))
+        return [(vector_id, chunk_terms[row], self._metadata[row]) for row, vector_id in rows.items()]
+
+    def close(self):
+        """Close the saved index's database, if it was opened."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), check_same_thread=False)
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, metadata TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS postings (
+                    version INTEGER PRIMARY KEY,
+                    terms TEXT NOT NULL,
+                    ids TEXT NOT NULL,
+                    offsets BLOB NOT NULL,
+                    docs BLOB NOT NULL,
+                    tfs BLOB NOT NULL,
+                    lengths BLOB NOT NULL
+                );
+            ''')
+        return self._db
+
+    def _load(self):
+        db = self._connect()
+        db.execute('BEGIN')
+        try:
+            self._load_saved(db)
+        finally:
+            db.commit()
+
+    def _load_saved(self, db: sqlite3.Connection):
+        self._generation = db.execute('PRAGMA user_version').fetchone()[0]
+        row = db.execute('SELECT terms, ids, offsets, docs, tfs, lengths FROM postings').fetchone()
+        if row is None:
+            return
+        metadata = dict(db.execute('SELECT id, metadata FROM chunks'))
+        ids = json.loads(row[1])
+        self._restore(json.loads(row[0]), ids, [json.loads(metadata[vector_id]) for vector_id in ids],
+                      np.frombuffer(row[2], dtype=np.int64), np.frombuffer(row[3], dtype=np.uint32),
+                      np.frombuffer(row[4], dtype=np.uint32), np.frombuffer(row[5], dtype=np.uint32))
+
+    def _load_json(self):
+        # Indexes saved before index.sqlite: terms.json and postings.npz, converted on the next save
+        with open(os.path.join(self.path, 'terms.json')) as file:
+            data = json.load(file)
+        postings = np.load(os.path.join(self.path, 'postings.npz'))
+        self._restore(data['terms'], data['ids'], data['metadata'], postings['offsets'], postings['docs'],
+                      postings['tfs'], postings['lengths'])
+        self._added.update(self._ids)
+
+    def _restore(self, terms: List[str], ids: List[str], metadata: List[dict], offsets: np.ndarray,
+                 docs: np.ndarray, tfs: np.ndarray, lengths: np.ndarray):
+        self._ids = ids
+        self._metadata = metadata
+        self._rows = {vector_id: row for row, vector_id in enumerate(self._ids)}
+        self._lengths = _uint_array(lengths)
+        self._alive = bytearray([1]) * len(self._ids)
+        self._total_length = int(lengths.sum())
+        for term_id, term in enumerate(terms):
+            self._terms[term] = term_id
+            self._postings_docs.append(_uint_array(docs[offsets[term_id]:offsets[term_id + 1]]))
+            self._postings_tfs.append(_uint_array(tfs[offsets[term_id]:offsets[term_id + 1]]))
+        logger.info(f"Loaded BM25 index of {len(self._ids)} chunks and {len(self._terms)} terms from {self.path}")
+
+def _uint_array(values: np.ndarray) -> array:
+    result = array('I')
+    result.frombytes(values.astype(np.uint32).tobytes())
+    return result
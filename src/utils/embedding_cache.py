@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from src.utils.telemetry import record_cache
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different copies share a cache entry."""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+def cache_key(text: str, model: str, dimensions: Optional[int] = None) -> str:
+    """Content address for an embedding: hash of the model, its output size and the normalized text."""
+    variant = model if dimensions is None else f"{model}/{dimensions}"
+    return hashlib.sha256(f"{variant}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None):
+        """
+        Two-tier embedding cache: a bounded in-memory LRU in front of an optional SQLite store.
+
+        Both tiers hold float32 arrays, a fifth of the memory of a list of Python floats.
+
+        Args:
+            max_entries (int): Maximum number of embeddings held in memory.
+            path (str, optional): SQLite file for the persistent tier. Memory only if None.
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)')
+            self._db.commit()
+
+    def get(self, text: str, model: str, dimensions: Optional[int] = None) -> Optional[List[float]]:
+        """
+        Look up the embedding of a text, promoting disk hits into the memory tier.
+
+        Args:
+            text (str): The embedded text.
+            model (str): The embedding model name.
+            dimensions (int, optional): The requested embedding size, for models that can shorten it.
+
+        Returns:
+            Optional[List[float]]: The cached embedding, or None on a miss.
+        """
+        key = cache_key(text, model, dimensions)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                record_cache('embedding', True)
+                return embedding.tolist()
+
+            embedding = self._load(key)
+            if embedding is None:
+                self.misses += 1
+                record_cache('embedding', False)
+                return None
+
+            self.hits += 1
+            record_cache('embedding', True)
+            self.disk_hits += 1
+            self._remember(key, embedding)
+            return embedding.tolist()
+
+    def peek(self, text: str, model: str, dimensions: Optional[int] = None) -> Optional[List[float]]:
+        """
+        Look up the embedding of a text without counting the lookup or changing the cache.
+
+        For opportunistic readers, such as reranking, whose lookups would otherwise
+        distort the hit rate and the eviction order of the embedding requests.
+
+        Args:
+            text (str): The embedded text.
+            model (str): The embedding model name.
+            dimensions (int, optional): The requested embedding size, for models that can shorten it.
+
+        Returns:
+            Optional[List[float]]: The cached embedding, or None if it is not cached.
+        """
+        key = cache_key(text, model, dimensions)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is None:
+                embedding = self._load(key)
+            return embedding.tolist() if embedding is not None else None
+
+    def put(self, text: str, model: str, embedding: List[float], dimensions: Optional[int] = None):
+        """
+        Store the embedding of a text in both tiers.
+
+        Args:
+            text (str): The embedded text.
+            model (str): The embedding model name.
+            embedding (List[float]): The embedding vector.
+            dimensions (int, optional): The requested embedding size, for models that can shorten it.
+        """
+        key = cache_key(text, model, dimensions)
+        vector = array('f', embedding)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                                 (key, vector.tobytes()))
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current memory-tier size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+            }
+
+    def clear(self):
+        """Drop every cached embedding and reset the counters."""
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.misses = self.disk_hits = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM embeddings')
+                self._db.commit()
+
+    def close(self):
+        """Close the persistent tier, if any."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key: str, embedding: array):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[array]:
+        if self._db is None:
+            return None
+        row = self._db.execute('SELECT vector FROM embeddings WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        vector = array('f')
+        vector.frombytes(row[0])
+        return vector
@@ -0,0 +1,218 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from src.utils.embedding_cache import normalize_text
+
+SIMHASH_BITS = 64
+# Four 16-bit bands: two hashes within 3 bits of each other share at least one band
+SIMHASH_BANDS = 4
+NEAR_DUPLICATE_DISTANCE = 3
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+def content_hash(text: str) -> str:
+    """Hash of the normalized text of a chunk."""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def document_id(key: str) -> str:
+    """
+    Stable ID of a document across versions, derived from a key that identifies it.
+
+    The key must name one document for the caller, e.g. its path in a bulk source or
+    an ID the uploader supplies. A bare upload name is not enough: unrelated files are
+    often called e.g. contract.pdf. Documents without a key are keyed by their content hash.
+    """
+    return hashlib.md5(normalize_text(key).lower().encode('utf-8')).hexdigest()
+
+def vector_id(doc_id: str, chunk_hash: str) -> str:
+    """Content-addressed vector ID, so unchanged chunks keep their ID across versions."""
+    return f"{doc_id}_{chunk_hash[:16]}"
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """
+    64-bit SimHash over word shingles; similar texts get hashes a few bits apart.
+
+    Args:
+        text (str): The text to fingerprint.
+        shingle_size (int): Number of consecutive words per feature.
+
+    Returns:
+        int: The unsigned 64-bit fingerprint.
+    """
+    words = _WORD_PATTERN.findall(text.lower())
+    shingles = [' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+
+    # One row of 64 bits per shingle; bit j of the row is bit j of the little-endian hash
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int(sum(1 << int(bit) for bit in np.flatnonzero(majority)))
+
+class SimHasher:
+    def __init__(self, shingle_size: int = 3):
+        """
+        Incremental simhash, for documents read as a stream of blocks.
+
+        Feeding the blocks of a text one by one gives the same fingerprint as
+        simhash on the blocks joined by newlines.
+
+        Args:
+            shingle_size (int): Number of consecutive words per feature.
+        """
+        self.shingle_size = shingle_size
+        # Per-bit counts of set bits over all shingles so far
+        self._counts = np.zeros(SIMHASH_BITS, dtype=np.uint64)
+        self._shingles = 0
+        # The last words, which start shingles completed by the next block
+        self._tail: List[str] = []
+
+    def update(self, text: str):
+        """Add the next block of the text."""
+        words = self._tail + _WORD_PATTERN.findall(text.lower())
+        size = self.shingle_size
+        if len(words) >= size:
+            shingles = [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+            digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+            bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+            self._counts += bits.sum(axis=0)
+            self._shingles += len(shingles)
+        self._tail = words[len(words) - size + 1:] if size > 1 else []
+
+    def digest(self) -> int:
+        """The fingerprint of the text so far."""
+        if not self._shingles:
+            # Fewer words than one shingle, all of them in the tail
+            return simhash(' '.join(self._tail), self.shingle_size)
+        majority = self._counts * 2 > self._shingles
+        return int(sum(1 << int(bit) for bit in np.flatnonzero(majority)))
+
+def _bands(fingerprint: int) -> List[int]:
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    return [fingerprint >> (i * width) & ((1 << width) - 1) for i in range(SIMHASH_BANDS)]
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+class DocumentHashIndex:
+    def __init__(self, path: str = ':memory:'):
+        """
+        Local SQLite index of ingested documents, their chunk hashes and SimHash fingerprints.
+
+        Args:
+            path (str): SQLite database file. Defaults to an in-memory database.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS documents (
+                file_hash TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                simhash INTEGER,
+                band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                file_hash TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                PRIMARY KEY (file_hash, chunk_id)
+            );
+            CREATE TABLE IF NOT EXISTS document_versions (
+                document_id TEXT PRIMARY KEY,
+                file_hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_by_hash ON chunks (chunk_hash);
+            CREATE INDEX IF NOT EXISTS documents_band0 ON documents (band0);
+            CREATE INDEX IF NOT EXISTS documents_band1 ON documents (band1);
+            CREATE INDEX IF NOT EXISTS documents_band2 ON documents (band2);
+            CREATE INDEX IF NOT EXISTS documents_band3 ON documents (band3);
+        ''')
+        self._db.commit()
+
+    def has_document(self, file_hash: str) -> bool:
+        """Return True if a file with this hash has already been ingested."""
+        with self._lock:
+            row = self._db.execute('SELECT 1 FROM documents WHERE file_hash = ?', (file_hash,)).fetchone()
+        return row is not None
+
+    def add_document(self, file_hash: str, file_name: str, chunk_hashes: Iterable[str],
+                     fingerprint: Optional[int] = None, doc_id: Optional[str] = None):
+        """
+        Record an ingested document.
+
+        Args:
+            file_hash (str): Hash of the file content.
+            file_name (str): Name of the file.
+            chunk_hashes (Iterable[str]): content_hash of each chunk, in chunk order.
+            fingerprint (int, optional): simhash of the document text, for near-duplicate lookups.
+            doc_id (str, optional): Stable document ID. When given, this file becomes the
+                document's current version and the previous version is forgotten.
+        """
+        bands = _bands(fingerprint) if fingerprint is not None else [None] * SIMHASH_BANDS
+        signed = _to_signed(fingerprint) if fingerprint is not None else None
+        with self._lock:
+            if doc_id is not None:
+                row = self._db.execute('SELECT file_hash FROM document_versions WHERE document_id = ?',
+                                       (doc_id,)).fetchone()
+                if row is not None and row[0] != file_hash:
+                    self._db.execute('DELETE FROM documents WHERE file_hash = ?', (row[0],))
+                    self._db.execute('DELETE FROM chunks WHERE file_hash = ?', (row[0],))
+                self._db.execute('INSERT OR REPLACE INTO document_versions VALUES (?, ?)', (doc_id, file_hash))
+            self._db.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (file_hash, file_name, signed, *bands))
+            self._db.execute('DELETE FROM chunks WHERE file_hash = ?', (file_hash,))
+            self._db.executemany('INSERT INTO chunks VALUES (?, ?, ?)',
+                                 [(file_hash, i, chunk_hash) for i, chunk_hash in enumerate(chunk_hashes)])
+            self._db.commit()
+
+    def document_chunks(self, doc_id: str) -> List[str]:
+        """
+        Return the chunk hashes of the current version of a document.
+
+        Args:
+            doc_id (str): Stable document ID.
+
+        Returns:
+            List[str]: The chunk hashes in chunk order; empty if the document is unknown.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT chunks.chunk_hash FROM document_versions '
+                'JOIN chunks ON chunks.file_hash = document_versions.file_hash '
+                'WHERE document_versions.document_id = ? ORDER BY chunks.chunk_id', (doc_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def find_near_duplicate(self, fingerprint: int, max_distance: int = NEAR_DUPLICATE_DISTANCE) -> Optional[dict]:
+        """
+        Find a stored document whose SimHash is within ``max_distance`` bits.
+
+        Args:
+            fingerprint (int): simhash of the candidate document.
+            max_distance (int): Maximum Hamming distance (at most 3 with four bands).
+
+        Returns:
+            Optional[dict]: 'file_hash', 'file_name' and 'distance' of the closest match, or None.
+        """
+        bands = _bands(fingerprint)
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT file_hash, file_name, simhash FROM documents '
+                'WHERE band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?', bands).fetchall()
+
+        best = None
+        for file_hash, file_name, signed in rows:
+            distance = bin((signed & ((1 << 64) - 1)) ^ fingerprint).count('1')
+            if distance <= max_distance and (best is None or distance < best['distance']):
+                best = {'file_hash': file_hash, 'file_name': file_name, 'distance': distance}
+        return best
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
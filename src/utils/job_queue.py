@@ -0,0 +1,329 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+FINISHED = (DONE, DUPLICATE, FAILED)
+
+# Seconds a claimed job stays with its worker without a heartbeat before another worker may take it over
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 120))
+# Attempts before a job is marked failed
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# Delay before the first retry of a failed job; doubled on every further attempt
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 5))
+
+_COLUMNS = ('id, consumer, file_name, file_hash, document_key, status, stage, progress, attempts, message, error, owner, '
+            'created_at, updated_at')
+
+class LeaseLost(Exception):
+    """Raised by a worker that finds its job was taken over by another worker."""
+
+
+class Job(NamedTuple):
+    id: int
+    # Name of the queue consumer that runs the job
+    consumer: str
+    file_name: str
+    file_hash: str
+    # Names the document this file is a new version of (see hash_index.document_id)
+    document_key: Optional[str]
+    status: str
+    # What the worker is doing, e.g. 'parsing' or 'embedding'
+    stage: Optional[str]
+    # Fraction of the work done, from 0 to 1
+    progress: float
+    attempts: int
+    message: Optional[str]
+    error: Optional[str]
+    # Token of the worker holding the job while it runs
+    owner: Optional[str]
+    created_at: float
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+class JobQueue:
+    def __init__(self, path: str = ':memory:', consumer: str = 'default', lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_delay: float = JOB_RETRY_DELAY,
+                 is_stored: Optional[Callable[[str], bool]] = None):
+        """
+        Persistent SQLite queue of document ingestion jobs.
+
+        Jobs are keyed by the hash of the file, so enqueueing the same upload twice
+        returns the same job. The file content is stored with the job until it finishes,
+        so queued and interrupted jobs survive a restart. A worker claims a job with a
+        lease that it renews while it works; if the worker dies, the lease expires and
+        another worker takes the job over.
+
+        Several processes may share one database file. Each job belongs to the consumer
+        that queued it and is only claimed by workers of that consumer, so a job is run
+        by the process that owns the indexes it updates (e.g. the Streamlit app's BM25
+        index and answer cache), never by another application sharing the file.
+
+        Args:
+            path (str): SQLite database file. Defaults to an in-memory database.
+            consumer (str): Name under which jobs are queued and claimed.
+            lease_seconds (float): Seconds a claimed job is held without a heartbeat.
+            max_attempts (int): Attempts before a job is marked failed.
+            retry_delay (float): Seconds before the first retry of a failed attempt.
+            is_stored (Callable, optional): Tells whether a file hash is still stored, e.g.
+                DocumentHashIndex.has_document. A finished job whose document has since been
+                replaced or deleted is queued again when the same content is enqueued.
+        """
+        self.path = path
+        self.consumer = consumer
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.is_stored = is_stored
+        self._lock = threading.Lock()
+        # Autocommit, so claims can take the write lock up front with BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        if path != ':memory:':
+            # Readers polling job status do not block the workers writing it
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                consumer TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                document_key TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                message TEXT,
+                error TEXT,
+                owner TEXT,
+                lease_until REAL,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (consumer, file_hash)
+            );
+            CREATE TABLE IF NOT EXISTS job_files (
+                job_id INTEGER PRIMARY KEY,
+                content BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (consumer, status, available_at);
+        ''')
+
+    def enqueue(self, file_name: str, content: bytes, document_key: Optional[str] = None) -> Job:
+        """
+        Queue a document for ingestion.
+
+        Idempotent: if this consumer has a job for the same content, it is returned
+        instead. A failed one is queued again for a fresh set of attempts, and so is a
+        finished one whose document is no longer stored (see is_stored).
+
+        Args:
+            file_name (str): Name of the file.
+            content (bytes): The raw file content.
+            document_key (str, optional): Names the document this file is a new version of;
+                its stored version is replaced. Without it the file is a new document.
+
+        Returns:
+            Job: The new or existing job.
+        """
+        file_hash = hashlib.md5(content).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT id, status FROM jobs WHERE consumer = ? AND file_hash = ?',
+                                       (self.consumer, file_hash)).fetchone()
+                if row is None:
+                    job_id = self._db.execute(
+                        'INSERT INTO jobs (consumer, file_name, file_hash, document_key, status, available_at, '
+                        'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (self.consumer, file_name, file_hash, document_key, QUEUED, now, now, now)).lastrowid
+                    self._db.execute('INSERT INTO job_files VALUES (?, ?)', (job_id, content))
+                elif row[1] == FAILED or (row[1] in (DONE, DUPLICATE) and self.is_stored is not None
+                                          and not self.is_stored(file_hash)):
+                    job_id = row[0]
+                    self._db.execute(
+                        'UPDATE jobs SET file_name = ?, document_key = ?, status = ?, stage = NULL, progress = 0, '
+                        'attempts = 0, message = NULL, error = NULL, owner = NULL, lease_until = NULL, '
+                        'available_at = ?, updated_at = ? WHERE id = ?',
+                        (file_name, document_key, QUEUED, now, now, job_id))
+                    self._db.execute('INSERT OR REPLACE INTO job_files VALUES (?, ?)', (job_id, content))
+                else:
+                    job_id = row[0]
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            return self._get(job_id)
+
+    def claim(self) -> Optional[Job]:
+        """
+        Take this consumer's oldest job that is ready to run, or one whose worker stopped renewing its lease.
+
+        Returns:
+            Optional[Job]: The claimed job, with a new owner token, or None if nothing is ready.
+        """
+        now = time.time()
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                # Jobs whose workers died on their last attempt are not run again
+                self._db.execute(
+                    'UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ? '
+                    'WHERE consumer = ? AND status = ? AND lease_until < ? AND attempts >= ?',
+                    (FAILED, 'The worker stopped before finishing the job', now, self.consumer, RUNNING, now,
+                     self.max_attempts))
+                row = self._db.execute(
+                    'SELECT id, status FROM jobs WHERE consumer = ? AND ((status = ? AND available_at <= ?) '
+                    'OR (status = ? AND lease_until < ?)) ORDER BY id LIMIT 1',
+                    (self.consumer, QUEUED, now, RUNNING, now)).fetchone()
+                if row is not None:
+                    if row[1] == RUNNING:
+                        logger.warning(f"Taking over job {row[0]}: its worker's lease expired")
+                    self._db.execute(
+                        'UPDATE jobs SET status = ?, stage = ?, progress = 0, attempts = attempts + 1, owner = ?, '
+                        'lease_until = ?, updated_at = ? WHERE id = ?',
+                        (RUNNING, 'starting', owner, now + self.lease_seconds, now, row[0]))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            return self._get(row[0]) if row is not None else None
+
+    def heartbeat(self, job: Job, stage: Optional[str] = None, progress: Optional[float] = None) -> bool:
+        """
+        Renew the lease of a running job, optionally recording its progress.
+
+        Args:
+            job (Job): The job, as returned by claim.
+            stage (str, optional): What the worker is doing now.
+            progress (float, optional): Fraction of the work done.
+
+        Returns:
+            bool: False if the job is no longer held by this worker.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                'UPDATE jobs SET stage = COALESCE(?, stage), progress = COALESCE(?, progress), lease_until = ?, '
+                'updated_at = ? WHERE id = ? AND owner = ? AND status = ?',
+                (stage, progress, now + self.lease_seconds, now, job.id, job.owner, RUNNING))
+        return cursor.rowcount == 1
+
+    def complete(self, job: Job, status: str = DONE, message: Optional[str] = None) -> bool:
+        """
+        Finish a running job and drop its stored content.
+
+        Args:
+            job (Job): The job, as returned by claim.
+            status (str): DONE, or DUPLICATE if the document was already stored.
+            message (str, optional): Summary shown with the job.
+
+        Returns:
+            bool: False if the job is no longer held by this worker.
+        """
+        return self._finish(job, status, message=message)
+
+    def fail(self, job: Job, error: str) -> str:
+        """
+        Record a failed attempt. The job is retried later, with exponential backoff,
+        until it has used all its attempts.
+
+        Args:
+            job (Job): The job, as returned by claim.
+            error (str): What went wrong.
+
+        Returns:
+            str: The job's new status: QUEUED, FAILED, or whatever another worker made of it
+                if this one had lost the job.
+        """
+        if job.attempts < self.max_attempts:
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            now = time.time()
+            with self._lock:
+                cursor = self._db.execute(
+                    'UPDATE jobs SET status = ?, stage = NULL, error = ?, owner = NULL, lease_until = NULL, '
+                    'available_at = ?, updated_at = ? WHERE id = ? AND owner = ?',
+                    (QUEUED, error, now + delay, now, job.id, job.owner))
+            owned = cursor.rowcount == 1
+            status = QUEUED
+        else:
+            owned = self._finish(job, FAILED, error=error)
+            status = FAILED
+        return status if owned else self.get(job.id).status
+
+    def _finish(self, job: Job, status: str, message: Optional[str] = None, error: Optional[str] = None) -> bool:
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self._db.execute(
+                    'UPDATE jobs SET status = ?, stage = NULL, progress = ?, message = ?, error = ?, owner = NULL, '
+                    'lease_until = NULL, updated_at = ? WHERE id = ? AND owner = ?',
+                    (status, 1.0 if status != FAILED else job.progress, message, error, now, job.id, job.owner))
+                if cursor.rowcount == 1 and status != FAILED:
+                    # A failed job keeps its content so it can be queued again
+                    self._db.execute('DELETE FROM job_files WHERE job_id = ?', (job.id,))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return cursor.rowcount == 1
+
+    def content(self, job_id: int) -> Optional[bytes]:
+        """Return the stored file content of an unfinished job."""
+        with self._lock:
+            row = self._db.execute('SELECT content FROM job_files WHERE job_id = ?', (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """Return one of this consumer's jobs by ID, or None if it has no such job."""
+        with self._lock:
+            return self._get(job_id)
+
+    def _get(self, job_id: int) -> Optional[Job]:
+        row = self._db.execute(f'SELECT {_COLUMNS} FROM jobs WHERE id = ? AND consumer = ?',
+                               (job_id, self.consumer)).fetchone()
+        return Job(*row) if row is not None else None
+
+    def jobs(self, job_ids: Optional[List[int]] = None, limit: int = 100) -> List[Job]:
+        """
+        Return this consumer's jobs, newest first.
+
+        Args:
+            job_ids (List[int], optional): Only these jobs. All of them if None.
+            limit (int): Maximum number of jobs returned.
+
+        Returns:
+            List[Job]: The jobs.
+        """
+        with self._lock:
+            if job_ids is None:
+                rows = self._db.execute(f'SELECT {_COLUMNS} FROM jobs WHERE consumer = ? ORDER BY id DESC LIMIT ?',
+                                        (self.consumer, limit))
+            else:
+                job_ids = list(job_ids)[:limit]
+                placeholders = ','.join('?' * len(job_ids))
+                rows = self._db.execute(f'SELECT {_COLUMNS} FROM jobs WHERE consumer = ? AND id IN ({placeholders}) '
+                                        'ORDER BY id DESC', [self.consumer, *job_ids])
+            return [Job(*row) for row in rows.fetchall()]
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._db.close()
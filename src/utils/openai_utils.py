@@ -1,37 +1,310 @@
+import asyncio
 import os
+import math
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
 from dotenv import load_dotenv
-import openai
-from openai import OpenAI
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from src.utils.embedding_cache import EmbeddingCache
+from src.utils.rate_limiter import BULK, INTERACTIVE, scheduler, usage_tokens, wait_retry_after
+from src.utils.telemetry import record_api_call, record_retry, record_tokens, span
+
 load_dotenv()
 
-# Initialize logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-try:
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-except Exception as e:
-    logger.error(f"Failed to initialize OpenAI client: {str(e)}")
-    raise
+# Connection pool of the async client, shared by all concurrent requests of a server process
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+_client = None
+_async_client = None
+
+def get_client():
+    """
+    Returns the OpenAI client, creating it on first use.
+
+    The openai package is imported here rather than at module import, which takes most of a
+    second, so starting the app or a worker process does not pay for it up front. Retries
+    are left to the callers, which go through the rate-limit scheduler, so the SDK's own
+    retries are disabled.
+    """
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        try:
+            _client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+        except Exception as e:
+            logger.error(f"Failed to initialize OpenAI client: {str(e)}")
+            raise
+    return _client
+
+def get_async_client():
+    """
+    Returns the AsyncOpenAI client, creating it on first use.
+
+    The client keeps a pool of up to ASYNC_MAX_CONNECTIONS keep-alive connections, so
+    concurrent requests reuse connections instead of opening one each. It belongs to the
+    event loop that first uses it; call close_async_client() when that loop shuts down.
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        _async_client = AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS,
+                                                                    max_keepalive_connections=ASYNC_MAX_CONNECTIONS))
+        )
+    return _async_client
+
+async def close_async_client():
+    """Closes the AsyncOpenAI client and its connection pool."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
-def get_embedding(text: str, model: str="text-embedding-3-small"):
+# Size of the embeddings requested. text-embedding-3 models return shortened embeddings that
+# keep most of their quality (1536 is the native size of text-embedding-3-small); the vector
+# store must be created with the same dimension.
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", 1536))
+
+def dimensions_params(model: str, dimensions: int) -> dict:
+    """The ``dimensions`` request parameter, for the models that accept it."""
+    return {"dimensions": dimensions} if model.startswith("text-embedding-3") else {}
+
+# Embedding cache shared by get_embedding and get_embeddings
+embedding_cache = EmbeddingCache(
+    max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", 10000)),
+    path=os.environ.get("EMBEDDING_CACHE_PATH")
+)
+
+def get_embedding(text: str, model: str="text-embedding-3-small", dimensions: int = EMBEDDING_DIMENSIONS):
+    cached = embedding_cache.get(text, model, dimensions)
+    if cached is not None:
+        return cached
+
+    with span('embed', model=model, texts=1):
+        embedding = _embed_text(text, model, dimensions)
+    embedding_cache.put(text, model, embedding, dimensions)
+    return embedding
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+def _embed_text(text: str, model: str, dimensions: int):
     try:
-        response = openai.embeddings.create(input=text, model=model)
+        with scheduler.request('openai', model, estimate_tokens(text), INTERACTIVE) as reservation:
+            record_api_call('openai', 'embeddings')
+            response = get_client().embeddings.create(input=text, model=model,
+                                                      **dimensions_params(model, dimensions))
+        reservation.settle(usage_tokens(getattr(response, 'usage', None)))
+        record_tokens(model, getattr(response, 'usage', None))
         return response.data[0].embedding
     except Exception as e:
         logger.error(f"Error in get_embedding: {str(e)}")
         raise
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
-def generate_answer(question: str, context: str, model: str='gpt-4o-mini'):
-    if not context.strip():
-        return "I don't have enough information to answer this question."
+async def aget_embedding(text: str, model: str="text-embedding-3-small", dimensions: int = EMBEDDING_DIMENSIONS):
+    """Async counterpart of get_embedding, sharing its cache."""
+    cached = embedding_cache.get(text, model, dimensions)
+    if cached is not None:
+        return cached
+
+    with span('embed', model=model, texts=1):
+        embedding = await _aembed_text(text, model, dimensions)
+    embedding_cache.put(text, model, embedding, dimensions)
+    return embedding
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+async def _aembed_text(text: str, model: str, dimensions: int):
+    try:
+        async with scheduler.arequest('openai', model, estimate_tokens(text), INTERACTIVE) as reservation:
+            record_api_call('openai', 'embeddings')
+            response = await get_async_client().embeddings.create(input=text, model=model,
+                                                                  **dimensions_params(model, dimensions))
+        reservation.settle(usage_tokens(getattr(response, 'usage', None)))
+        record_tokens(model, getattr(response, 'usage', None))
+        return response.data[0].embedding
+    except Exception as e:
+        logger.error(f"Error in aget_embedding: {str(e)}")
+        raise
+
+# Limits for a single embeddings request (the API caps a request at 2048 inputs)
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_BATCH_TOKENS = 100_000
+EMBEDDING_MAX_WORKERS = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, conservative token estimate (roughly four characters per token)."""
+    return max(1, math.ceil(len(text) / 4))
+
+def batch_texts(texts: List[str], max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                max_batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+                count_tokens: Callable[[str], int] = estimate_tokens) -> List[List[int]]:
+    """
+    Group text positions into batches that respect an input count and a token budget.
+
+    Args:
+        texts (List[str]): The texts to be embedded.
+        max_batch_size (int): Maximum number of texts per request.
+        max_batch_tokens (int): Maximum estimated tokens per request.
+        count_tokens (Callable[[str], int]): Function used to size each text.
+
+    Returns:
+        List[List[int]]: Batches of indices into ``texts``, in their original order.
+    """
+    batches, current, current_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        n_tokens = count_tokens(text)
+        if current and (len(current) >= max_batch_size or current_tokens + n_tokens > max_batch_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+def _embed_batch(texts: List[str], model: str, dimensions: int, priority: int = BULK) -> List[List[float]]:
+    try:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        with scheduler.request('openai', model, tokens, priority) as reservation:
+            record_api_call('openai', 'embeddings')
+            response = get_client().embeddings.create(input=texts, model=model,
+                                                      **dimensions_params(model, dimensions))
+        reservation.settle(usage_tokens(getattr(response, 'usage', None)))
+        record_tokens(model, getattr(response, 'usage', None))
+        # The API reports an index per input; do not rely on response ordering
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    except Exception as e:
+        logger.error(f"Error in _embed_batch ({len(texts)} inputs): {str(e)}")
+        raise
 
+def get_embeddings(texts: List[str], model: str = "text-embedding-3-small",
+                   max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                   max_batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+                   max_workers: int = EMBEDDING_MAX_WORKERS,
+                   count_tokens: Optional[Callable[[str], int]] = None,
+                   dimensions: int = EMBEDDING_DIMENSIONS,
+                   priority: int = BULK) -> List[List[float]]:
+    """
+    Embed many texts with as few requests as possible, running batches concurrently.
+
+    Texts already in the embedding cache are served from it; only misses are sent.
+    Each batch is retried independently, so a transient failure only re-sends that batch.
+
+    Args:
+        texts (List[str]): The texts to embed.
+        model (str): The embedding model name.
+        max_batch_size (int): Maximum number of texts per request.
+        max_batch_tokens (int): Maximum estimated tokens per request.
+        max_workers (int): Maximum number of requests in flight.
+        count_tokens (Callable[[str], int], optional): Token counter used for batching.
+        dimensions (int): Size of the embeddings, for models that can shorten them.
+        priority (int): Scheduler lane of the requests; ingestion is BULK by default.
+
+    Returns:
+        List[List[float]]: One embedding per input text, in input order.
+    """
+    if not texts:
+        return []
+
+    embeddings: List[Optional[List[float]]] = [embedding_cache.get(text, model, dimensions) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not missing:
+        return embeddings
+
+    batches = [[missing[j] for j in batch] for batch in
+               batch_texts([texts[i] for i in missing], max_batch_size, max_batch_tokens,
+                           count_tokens or estimate_tokens)]
+
+    def run(batch: List[int]):
+        return batch, _embed_batch([texts[i] for i in batch], model, dimensions, priority)
+
+    with span('embed', model=model, texts=len(missing), cached=len(texts) - len(missing), batches=len(batches)):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+            for batch, batch_embeddings in executor.map(run, batches):
+                for i, embedding in zip(batch, batch_embeddings):
+                    embeddings[i] = embedding
+                    embedding_cache.put(texts[i], model, embedding, dimensions)
+
+    logger.info(f"Embedded {len(missing)} of {len(texts)} texts in {len(batches)} batches.")
+    return embeddings
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+async def _aembed_batch(texts: List[str], model: str, dimensions: int,
+                        priority: int = INTERACTIVE) -> List[List[float]]:
+    try:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        async with scheduler.arequest('openai', model, tokens, priority) as reservation:
+            record_api_call('openai', 'embeddings')
+            response = await get_async_client().embeddings.create(input=texts, model=model,
+                                                                  **dimensions_params(model, dimensions))
+        reservation.settle(usage_tokens(getattr(response, 'usage', None)))
+        record_tokens(model, getattr(response, 'usage', None))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    except Exception as e:
+        logger.error(f"Error in _aembed_batch ({len(texts)} inputs): {str(e)}")
+        raise
+
+async def aget_embeddings(texts: List[str], model: str = "text-embedding-3-small",
+                          max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                          max_batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+                          max_concurrency: int = EMBEDDING_MAX_WORKERS,
+                          dimensions: int = EMBEDDING_DIMENSIONS,
+                          priority: int = INTERACTIVE) -> List[List[float]]:
+    """
+    Async counterpart of get_embeddings, sharing its cache and batching.
+
+    Args:
+        texts (List[str]): The texts to embed.
+        model (str): The embedding model name.
+        max_batch_size (int): Maximum number of texts per request.
+        max_batch_tokens (int): Maximum estimated tokens per request.
+        max_concurrency (int): Maximum number of requests in flight.
+        dimensions (int): Size of the embeddings, for models that can shorten them.
+        priority (int): Scheduler lane of the requests; queries are INTERACTIVE by default.
+
+    Returns:
+        List[List[float]]: One embedding per input text, in input order.
+    """
+    if not texts:
+        return []
+
+    embeddings: List[Optional[List[float]]] = [embedding_cache.get(text, model, dimensions) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not missing:
+        return embeddings
+
+    batches = [[missing[j] for j in batch] for batch in
+               batch_texts([texts[i] for i in missing], max_batch_size, max_batch_tokens)]
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(batch: List[int]):
+        async with semaphore:
+            batch_embeddings = await _aembed_batch([texts[i] for i in batch], model, dimensions, priority)
+        for i, embedding in zip(batch, batch_embeddings):
+            embeddings[i] = embedding
+            embedding_cache.put(texts[i], model, embedding, dimensions)
+
+    with span('embed', model=model, texts=len(missing), cached=len(texts) - len(missing), batches=len(batches)):
+        await asyncio.gather(*(run(batch) for batch in batches))
+
+    logger.info(f"Embedded {len(missing)} of {len(texts)} texts in {len(batches)} batches.")
+    return embeddings
+
+NO_CONTEXT_ANSWER = "I don't have enough information to answer this question."
+MAX_ANSWER_TOKENS = 250
+
+def answer_messages(question: str, context: str) -> List[dict]:
+    """Build the chat messages asking the model to answer ``question`` from ``context``."""
     context_source = "from the database" if "database" in context else "from llm knowledge"
 
     prompt = f"""You are an experienced lawyer specializing in extracting and interpreting information from legal
@@ -49,19 +322,136 @@ def generate_answer(question: str, context: str, model: str='gpt-4o-mini'):
     - If unable to answer, state 'I don't know,' but also indicate why (e.g., insufficient context, unclear question).
     """
 
-    messages = [
+    return [
         {"role": "system", "content": "You are an experienced lawyer specializing in extracting and interpreting information from legal documents to provide accurate advice."},
         {"role": "user", "content": prompt}
     ]
 
+def chat_tokens(messages: List[dict]) -> int:
+    """Tokens a chat request may use: its estimated prompt plus the longest answer."""
+    return sum(estimate_tokens(message["content"]) for message in messages) + MAX_ANSWER_TOKENS
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+def generate_answer(question: str, context: str, model: str='gpt-4o-mini'):
+    if not context.strip():
+        return NO_CONTEXT_ANSWER
+
     try:
-        response = client.chat.completions.create(
+        with span('generate', model=model):
+            messages = answer_messages(question, context)
+            with scheduler.request('openai', model, chat_tokens(messages), INTERACTIVE) as reservation:
+                record_api_call('openai', 'chat')
+                response = get_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=MAX_ANSWER_TOKENS,
+                    temperature=0
+                )
+            reservation.settle(usage_tokens(getattr(response, 'usage', None)))
+            record_tokens(model, getattr(response, 'usage', None))
+            return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.error(f"Error in generate_answer: {str(e)}")
+        raise
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+def _open_answer_stream(messages: List[dict], model: str):
+    # Only opening the stream is retried; tokens already yielded cannot be taken back.
+    # The stream is charged its estimate, which counts the longest possible answer.
+    with scheduler.request('openai', model, chat_tokens(messages), INTERACTIVE):
+        record_api_call('openai', 'chat')
+        return get_client().chat.completions.create(
             model=model,
             messages=messages,
-            max_tokens=250,
-            temperature=0
+            max_tokens=MAX_ANSWER_TOKENS,
+            temperature=0,
+            stream=True,
+            # The last chunk then reports the token usage
+            stream_options={"include_usage": True}
         )
-        return response.choices[0].message.content.strip()
+
+def stream_answer(question: str, context: str, model: str='gpt-4o-mini') -> Iterator[str]:
+    """
+    Generate an answer like generate_answer, yielding text fragments as the model produces them.
+
+    Args:
+        question (str): The user's question.
+        context (str): The retrieved context to answer from.
+        model (str): The chat model to use.
+
+    Yields:
+        str: Consecutive fragments of the answer.
+    """
+    if not context.strip():
+        yield NO_CONTEXT_ANSWER
+        return
+
+    try:
+        # Not activated: the consumer resumes the generator wherever it likes
+        with span('generate', activate=False, model=model, stream=True) as generate_span:
+            stream = _open_answer_stream(answer_messages(question, context), model)
+            for chunk in stream:
+                record_tokens(model, getattr(chunk, 'usage', None), generate_span)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
     except Exception as e:
-        logger.error(f"Error in generate_answer: {str(e)}")
+        logger.error(f"Error in stream_answer: {str(e)}")
+        raise
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+async def agenerate_answer(question: str, context: str, model: str='gpt-4o-mini'):
+    """Async counterpart of generate_answer."""
+    if not context.strip():
+        return NO_CONTEXT_ANSWER
+
+    try:
+        with span('generate', model=model):
+            messages = answer_messages(question, context)
+            async with scheduler.arequest('openai', model, chat_tokens(messages), INTERACTIVE) as reservation:
+                record_api_call('openai', 'chat')
+                response = await get_async_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=MAX_ANSWER_TOKENS,
+                    temperature=0
+                )
+            reservation.settle(usage_tokens(getattr(response, 'usage', None)))
+            record_tokens(model, getattr(response, 'usage', None))
+            return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.error(f"Error in agenerate_answer: {str(e)}")
+        raise
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+async def _aopen_answer_stream(messages: List[dict], model: str):
+    async with scheduler.arequest('openai', model, chat_tokens(messages), INTERACTIVE):
+        record_api_call('openai', 'chat')
+        return await get_async_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=MAX_ANSWER_TOKENS,
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+async def astream_answer(question: str, context: str, model: str='gpt-4o-mini') -> AsyncIterator[str]:
+    """Async counterpart of stream_answer."""
+    if not context.strip():
+        yield NO_CONTEXT_ANSWER
+        return
+
+    try:
+        with span('generate', activate=False, model=model, stream=True) as generate_span:
+            stream = await _aopen_answer_stream(answer_messages(question, context), model)
+            async for chunk in stream:
+                record_tokens(model, getattr(chunk, 'usage', None), generate_span)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    except Exception as e:
+        logger.error(f"Error in astream_answer: {str(e)}")
         raise
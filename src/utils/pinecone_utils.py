@@ -1,57 +1,322 @@
 import os
+import json
+import asyncio
+import time
 import logging
-from typing import List
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
 
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import Retrying, retry, stop_after_attempt, wait_random_exponential
+
+from src.utils.exceptions import ConfigurationError, DatabaseConnectionError
+from src.utils.openai_utils import EMBEDDING_DIMENSIONS
+from src.utils.rate_limiter import BULK, INTERACTIVE, scheduler, wait_retry_after
+from src.utils.telemetry import record_api_call, record_retry, span
+from src.utils.vector_store import LocalVectorStore, VectorStore
 
 load_dotenv()
 
-# Initialize logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Pinecone client
-try:
-    pinecone_api_key = os.getenv('PINECONE_API_KEY')
-    index_name = 'luthor-test-nb-0'
-    client = Pinecone(api_key=pinecone_api_key)
-
-    # Ensure the index is created
-    if index_name not in client.list_indexes().names():
-        client.create_index(
-            name=index_name,
-            dimension=1536,
-            metric='cosine',
-            spec=ServerlessSpec(cloud='aws', region='us-east-1')
-        )
-
-    # Retrieve the index
-    index = client.Index(index_name)
-except Exception as e:
-    logger.error(f"Failed to initialize Pinecone client: {str(e)}")
-    raise
-
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
+index_name = os.getenv('PINECONE_INDEX_NAME', 'luthor-test-nb-0')
+# Dimension of the stored vectors: the size of the embeddings requested from OpenAI
+EMBEDDING_DIMENSION = EMBEDDING_DIMENSIONS
+
+# Upsert limits: Pinecone recommends at most 100 vectors and caps requests at 2 MB
+UPSERT_BATCH_SIZE = 100
+UPSERT_BATCH_BYTES = 2 * 1024 * 1024 - 64 * 1024  # Leave room for the request envelope
+UPSERT_MAX_WORKERS = 8
+# Connection pool of the async index, shared by all concurrent queries of a server process
+ASYNC_MAX_CONNECTIONS = int(os.getenv('PINECONE_MAX_CONNECTIONS', 100))
+
+_index = None
+_async_client = None
+_async_index = None
+# Serialises the first connection of the async index, one lock per event loop
+_async_locks = weakref.WeakKeyDictionary()
+_store: Optional[VectorStore] = None
+_lock = threading.Lock()
+# Called after vectors are upserted or deleted, e.g. to invalidate answer caches
+_change_listeners: List[Callable[[], None]] = []
+
+def add_change_listener(callback: Callable[[], None]):
+    """Registers a callback run whenever vectors are upserted or deleted."""
+    _change_listeners.append(callback)
+
+def _notify_change():
+    for callback in _change_listeners:
+        callback()
+
+def get_index():
+    """
+    Connects to the Pinecone index on first use, creating it if it does not exist.
+
+    Returns:
+        The Pinecone index, with a connection pool large enough for concurrent upserts.
+
+    Raises:
+        ConfigurationError: If the index exists with a dimension other than EMBEDDING_DIMENSION.
+        DatabaseConnectionError: If the client cannot be initialised.
+    """
+    global _index
+    with _lock:
+        if _index is None:
+            try:
+                # Imported here because the client takes a third of a second to import
+                from pinecone import Pinecone, ServerlessSpec
+                client = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+
+                # Ensure the index is created
+                if index_name not in client.list_indexes().names():
+                    client.create_index(
+                        name=index_name,
+                        dimension=EMBEDDING_DIMENSION,
+                        metric='cosine',
+                        spec=ServerlessSpec(cloud='aws', region='us-east-1')
+                    )
+                else:
+                    dimension = client.describe_index(index_name).dimension
+                    if dimension != EMBEDDING_DIMENSION:
+                        raise ConfigurationError(
+                            f"Index {index_name} stores {dimension}-dimensional vectors but EMBEDDING_DIMENSIONS "
+                            f"is {EMBEDDING_DIMENSION}; re-embed into a new index to change it.")
+
+                _index = client.Index(index_name, pool_threads=UPSERT_MAX_WORKERS)
+            except ConfigurationError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to initialize Pinecone client: {str(e)}")
+                raise DatabaseConnectionError(str(e)) from e
+        return _index
+
+async def get_async_index():
+    """
+    Connects the asyncio Pinecone client on first use.
+
+    The index is created by get_index() if needed; this only resolves its host. Like the
+    AsyncOpenAI client, the connection belongs to the event loop that opened it.
+
+    Returns:
+        The asyncio Pinecone index.
+
+    Raises:
+        DatabaseConnectionError: If the client cannot be initialised.
+    """
+    global _async_client, _async_index
+    if _async_index is not None:
+        return _async_index
+    loop = asyncio.get_running_loop()
+    lock = _async_locks.setdefault(loop, asyncio.Lock())
+    # Concurrent first queries wait for one client instead of each opening their own
+    async with lock:
+        if _async_index is None:
+            try:
+                from pinecone import PineconeAsyncio
+                client = PineconeAsyncio(api_key=os.getenv('PINECONE_API_KEY'),
+                                         connection_pool_maxsize=ASYNC_MAX_CONNECTIONS)
+                description = await client.describe_index(index_name)
+                _async_client, _async_index = client, client.IndexAsyncio(host=description.host)
+            except Exception as e:
+                logger.error(f"Failed to initialize the asyncio Pinecone client: {str(e)}")
+                raise DatabaseConnectionError(str(e)) from e
+    return _async_index
+
+async def close_async_index():
+    """Closes the asyncio Pinecone client and its connection pool."""
+    global _async_client, _async_index
+    if _async_index is not None:
+        await _async_index.close()
+        await _async_client.close()
+        _async_client, _async_index = None, None
+
+def get_vector_store() -> VectorStore:
+    """
+    Returns the configured vector store backend.
+
+    The VECTOR_STORE environment variable selects 'pinecone' (default) or 'local'. The local
+    backend is configured with LOCAL_VECTOR_STORE_PATH (persistent directory; in memory if unset),
+    LOCAL_VECTOR_STORE_ANN ('hnsw' for an approximate index), LOCAL_VECTOR_STORE_QUANTIZATION
+    ('float32', 'float16' or 'int8') and LOCAL_VECTOR_STORE_RESCORE ('1' to also keep the
+    float32 vectors and re-rank quantized matches against them).
+
+    Returns:
+        VectorStore: The shared backend instance.
+    """
+    global _store
+    if _store is None:
+        backend = os.getenv('VECTOR_STORE', 'pinecone')
+        if backend == 'pinecone':
+            store = PineconeVectorStore()
+        elif backend == 'local':
+            store = LocalVectorStore(path=os.getenv('LOCAL_VECTOR_STORE_PATH'), dimension=EMBEDDING_DIMENSION,
+                                     ann=os.getenv('LOCAL_VECTOR_STORE_ANN') or None,
+                                     quantization=os.getenv('LOCAL_VECTOR_STORE_QUANTIZATION', 'float32'),
+                                     rescore=os.getenv('LOCAL_VECTOR_STORE_RESCORE', '0') == '1')
+        else:
+            raise ConfigurationError(f"Unsupported vector store backend: {backend}")
+        with _lock:
+            if _store is None:
+                _store = store
+    return _store
+
+def set_vector_store(store: Optional[VectorStore]):
+    """Replaces the vector store backend (None restores the configured default)."""
+    global _store
+    with _lock:
+        _store = store
+
+def batch_vectors(vectors: List[dict], max_batch_size: int = UPSERT_BATCH_SIZE,
+                  max_batch_bytes: int = UPSERT_BATCH_BYTES) -> List[List[dict]]:
+    """
+    Splits vectors into batches bounded by vector count and estimated payload size.
+
+    Args:
+        vectors (List[dict]): The vectors to upsert.
+        max_batch_size (int, optional): Maximum number of vectors per batch.
+        max_batch_bytes (int, optional): Maximum estimated JSON payload size per batch.
+
+    Returns:
+        List[List[dict]]: The batches, in input order.
+    """
+    batches, current, current_bytes = [], [], 0
+    for vector in vectors:
+        size = len(json.dumps(vector))
+        if current and (len(current) >= max_batch_size or current_bytes + size > max_batch_bytes):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(vector)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, max_workers: int = UPSERT_MAX_WORKERS):
+        """
+        Vector store backed by the Pinecone index.
+
+        Args:
+            max_workers (int, optional): Maximum number of upsert batches in flight.
+        """
+        self.max_workers = max_workers
+
+    def upsert(self, vectors: List[dict]) -> List[dict]:
+        """
+        Upserts vectors in concurrent, size-bounded batches.
+
+        Each batch is retried on its own, so a transient failure only re-sends that batch.
+
+        Args:
+            vectors (List[dict]): A list of dictionaries, each containing 'id', 'values', and 'metadata'.
+
+        Returns:
+            List[dict]: Per-batch stats ('batch', 'vectors', 'attempts', 'seconds'), in batch order.
+
+        Raises:
+            Exception: The error of the first batch that still failed after its retries,
+                once every other batch has been attempted.
+        """
+        batches = batch_vectors(vectors)
+        if not batches:
+            return []
+
+        index = get_index()
+        stats, errors = [], []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(batches)))) as executor:
+            futures = [executor.submit(_upsert_batch, index, i, batch) for i, batch in enumerate(batches)]
+            for i, future in enumerate(futures):
+                try:
+                    stats.append(future.result())
+                except Exception as e:
+                    logger.error(f"Error upserting batch {i} ({len(batches[i])} vectors) to Pinecone: {str(e)}")
+                    errors.append(e)
+
+        if errors:
+            logger.error(f"{len(errors)} of {len(batches)} upsert batches failed.")
+            raise errors[0]
+
+        logger.info(f"Successfully upserted {len(vectors)} vectors in {len(batches)} batches to index {index_name}.")
+        return stats
+
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+           before_sleep=record_retry)
+    def query(self, vector: List[float], filters: Optional[dict] = None, top_k: int = 5,
+              include_values: bool = False) -> List[dict]:
+        try:
+            index = get_index()
+            with scheduler.request('pinecone', 'query', priority=INTERACTIVE):
+                record_api_call('pinecone', 'query')
+                response = index.query(vector=vector, filter=filters, top_k=top_k,
+                                       include_values=include_values, include_metadata=True)
+            logger.info(f"Query successful. Found {len(response['matches'])} matches.")
+            return response['matches']
+        except Exception as e:
+            logger.error(f"Error querying Pinecone: {str(e)}")
+            raise
+
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+           before_sleep=record_retry)
+    def delete(self, ids: List[str], batch_size: int = 1000):
+        try:
+            index = get_index()
+            for i in range(0, len(ids), batch_size):
+                with scheduler.request('pinecone', 'write', priority=BULK):
+                    record_api_call('pinecone', 'delete')
+                    index.delete(ids=ids[i:i + batch_size])
+            logger.info(f"Successfully deleted {len(ids)} vectors from index {index_name}.")
+        except Exception as e:
+            logger.error(f"Error deleting vectors from Pinecone: {str(e)}")
+            raise
+
+def _upsert_batch(index, batch_id: int, batch: List[dict]) -> dict:
+    start_time = time.perf_counter()
+    # Retry this batch only; the other batches are unaffected by its failures
+    for attempt in Retrying(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+                            reraise=True,
+                            before_sleep=lambda retry_state: record_retry(retry_state, '_upsert_batch')):
+        with attempt, scheduler.request('pinecone', 'write', priority=BULK):
+            record_api_call('pinecone', 'upsert')
+            index.upsert(vectors=batch)
+    return {
+        "batch": batch_id,
+        "vectors": len(batch),
+        "attempts": attempt.retry_state.attempt_number,
+        "seconds": time.perf_counter() - start_time
+    }
+
 def upsert_chunks(vectors: List[dict]):
     """
-    Upserts vectors into the Pinecone index.
+    Upserts vectors into the configured vector store.
 
     Args:
         vectors (List[dict]): A list of dictionaries, each containing 'id', 'values', and 'metadata'.
+
+    Returns:
+        The backend's upsert result: per-batch stats for Pinecone, the vector count for the local store.
     """
-    try:
-        index.upsert(vectors=vectors)
-        logger.info(f"Successfully upserted {len(vectors)} vectors to index {index_name}.")
-    except Exception as e:
-        logger.error(f"Error upserting chunks to Pinecone: {str(e)}")
-        raise
+    with span('upsert', vectors=len(vectors)):
+        result = get_vector_store().upsert(vectors)
+    _notify_change()
+    return result
+
+def delete_vectors(ids: List[str]):
+    """
+    Deletes vectors from the configured vector store by ID.
+
+    Args:
+        ids (List[str]): The IDs of the vectors to delete.
+    """
+    with span('delete', vectors=len(ids)):
+        result = get_vector_store().delete(ids)
+    _notify_change()
+    return result
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(3))
 def query_pinecone(query_vector: list, filters: dict = None, top_k: int = 5):
     """
-    Retrieves the top-k most similar vectors from the Pinecone index based on the query vector.
+    Retrieves the top-k most similar vectors from the configured vector store based on the query vector.
 
     Args:
         query_vector (list): The vector to query against the index.
@@ -61,10 +326,37 @@ def query_pinecone(query_vector: list, filters: dict = None, top_k: int = 5):
     Returns:
         list: A list of the top-k similar vectors with their metadata.
     """
+    with span('query', top_k=top_k) as query_span:
+        matches = get_vector_store().query(query_vector, filters=filters, top_k=top_k, include_values=False)
+        query_span.set(matches=len(matches))
+    return matches
+
+@retry(wait=wait_retry_after(wait_random_exponential(min=1, max=60)), stop=stop_after_attempt(3),
+       before_sleep=record_retry)
+async def _aquery_index(query_vector: list, filters: Optional[dict], top_k: int):
     try:
-        response = index.query(vector=query_vector, filter=filters, top_k=top_k, include_values=True, include_metadata=True)
-        logger.info(f"Query successful. Found {len(response['matches'])} matches.")
-        return response['matches']
+        index = await get_async_index()
+        async with scheduler.arequest('pinecone', 'query', priority=INTERACTIVE):
+            record_api_call('pinecone', 'query')
+            response = await index.query(vector=query_vector, filter=filters, top_k=top_k, include_metadata=True)
+        logger.info(f"Query successful. Found {len(response.matches)} matches.")
+        return [{'id': match.id, 'score': match.score, 'metadata': match.metadata or {}} for match in response.matches]
     except Exception as e:
         logger.error(f"Error querying Pinecone: {str(e)}")
         raise
+
+async def aquery_pinecone(query_vector: list, filters: dict = None, top_k: int = 5):
+    """
+    Async counterpart of query_pinecone.
+
+    Pinecone is queried through its asyncio client; other backends run in a worker thread
+    so the event loop is never blocked.
+    """
+    store = get_vector_store()
+    with span('query', top_k=top_k) as query_span:
+        if isinstance(store, PineconeVectorStore):
+            matches = await _aquery_index(query_vector, filters, top_k)
+        else:
+            matches = await asyncio.to_thread(store.query, query_vector, filters=filters, top_k=top_k)
+        query_span.set(matches=len(matches))
+    return matches
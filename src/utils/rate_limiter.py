@@ -0,0 +1,470 @@
+"""
+Shared scheduler for OpenAI and Pinecone requests.
+
+Every request first takes capacity from token buckets that track the provider's limits:
+requests per minute and, for OpenAI models, tokens per minute. Each model (or Pinecone
+operation) has its own buckets. Waiting requests are served by priority lane, then in
+arrival order, so interactive queries go ahead of bulk ingestion. Bulk requests also
+leave part of each bucket unused, so an interactive request rarely waits at all.
+
+When a provider still answers 429, its Retry-After header pauses every request to that
+model or operation, not just the one that failed, so the retries do not arrive as a storm.
+
+The limits belong to the account, not to a process. When RATE_LIMIT_STATE_PATH names a
+SQLite file, the bucket levels and pauses are kept in it, and the Streamlit app, the APIs
+and the command line tools on a host that use the same file stay within one quota together.
+"""
+import asyncio
+import email.utils
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.utils.telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes; lower is served first
+INTERACTIVE = 0
+BULK = 1
+
+# Limits per minute, 0 for none. The defaults are OpenAI's tier 2 limits of the default
+# models; set them to your organisation's limits.
+OPENAI_EMBEDDING_RPM = float(os.environ.get('OPENAI_EMBEDDING_RPM', 5000))
+OPENAI_EMBEDDING_TPM = float(os.environ.get('OPENAI_EMBEDDING_TPM', 1_000_000))
+OPENAI_CHAT_RPM = float(os.environ.get('OPENAI_CHAT_RPM', 5000))
+OPENAI_CHAT_TPM = float(os.environ.get('OPENAI_CHAT_TPM', 2_000_000))
+PINECONE_QUERY_RPM = float(os.environ.get('PINECONE_QUERY_RPM', 6000))
+PINECONE_WRITE_RPM = float(os.environ.get('PINECONE_WRITE_RPM', 6000))
+
+# Seconds of a per-minute limit a bucket holds, so a burst cannot spend the whole minute at once
+BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', 10))
+# Share of each bucket bulk requests leave for interactive ones
+BULK_RESERVE = float(os.environ.get('RATE_LIMIT_BULK_RESERVE', 0.2))
+# SQLite file through which processes share the bucket levels; unset to keep them per process
+RATE_LIMIT_STATE_PATH = os.environ.get('RATE_LIMIT_STATE_PATH', '')
+# Seconds to wait for another process's hold on the shared state before trying again later
+STATE_BUSY_TIMEOUT = 0.05
+# Pause after a 429 without a Retry-After header
+DEFAULT_PAUSE = 1.0
+# Longest sleep between checks of a request that is not first in line
+POLL_INTERVAL = 0.05
+
+def default_limits(service: str, name: str) -> Tuple[float, float]:
+    """
+    Requests and tokens per minute allowed for a model or operation.
+
+    Args:
+        service (str): 'openai' or 'pinecone'.
+        name (str): The OpenAI model, or the Pinecone operation ('query' or 'write').
+
+    Returns:
+        Tuple[float, float]: The requests and tokens per minute; 0 means unlimited.
+    """
+    if service == 'openai':
+        if name.startswith('text-embedding'):
+            return OPENAI_EMBEDDING_RPM, OPENAI_EMBEDDING_TPM
+        return OPENAI_CHAT_RPM, OPENAI_CHAT_TPM
+    if service == 'pinecone':
+        return (PINECONE_QUERY_RPM if name == 'query' else PINECONE_WRITE_RPM), 0
+    return 0, 0
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    Seconds the provider asked to wait before retrying, from a Retry-After header.
+
+    Understands the OpenAI SDK's errors (headers on ``error.response``) and the Pinecone
+    client's (headers on ``error.headers``), in seconds, HTTP dates or 'retry-after-ms'.
+
+    Returns:
+        Optional[float]: The delay, or None if the error carries no such header.
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None)
+    if not headers:
+        return None
+    headers = {str(key).lower(): value for key, value in dict(headers).items()}
+    try:
+        if 'retry-after-ms' in headers:
+            return max(0.0, float(headers['retry-after-ms']) / 1000)
+        if 'retry-after' in headers:
+            value = headers['retry-after']
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Return True for a provider's 429 Too Many Requests."""
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    return status == 429 or type(error).__name__ == 'RateLimitError'
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Capacity refilled continuously at a per-minute rate.
+
+        Args:
+            per_minute (float): The limit per minute.
+            burst_seconds (float): Seconds of the rate the bucket holds when full.
+            clock (Callable): The clock refill times are read from.
+        """
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = clock()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float, reserve: float = 0.0) -> float:
+        """
+        Seconds until ``cost`` can be taken while leaving ``reserve`` of the capacity.
+
+        A cost larger than the bucket is allowed once the bucket is full, and leaves
+        it in debt.
+        """
+        reserved = reserve * self.capacity
+        required = min(cost, self.capacity - reserved) + reserved
+        return max(0.0, required - self.level) / self.rate
+
+    def take(self, cost: float):
+        self.level -= cost
+
+class _Limit:
+    # The buckets of one model or operation, and the requests waiting for them
+    def __init__(self, key: Tuple[str, str], requests_per_minute: float, tokens_per_minute: float,
+                 burst_seconds: float, clock: Callable[[], float]):
+        self.key = key
+        self.requests = TokenBucket(requests_per_minute, burst_seconds, clock) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds, clock) if tokens_per_minute > 0 else None
+        self.waiting: List[Tuple[int, int]] = []
+        self.paused_until = 0.0
+        # Token corrections of settled requests, charged with the next request
+        self.unsettled = 0
+
+class SharedLimitState:
+    def __init__(self, path: str):
+        """
+        Bucket levels and pauses kept in SQLite, so that processes share their limits.
+
+        Times are wall-clock seconds, since monotonic clocks are not comparable between
+        processes. The file is opened on first use.
+
+        Args:
+            path (str): Path to the SQLite file.
+        """
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Losing the levels in a crash only refills the buckets
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS limits (
+                    service TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    requests REAL,
+                    tokens REAL,
+                    updated REAL NOT NULL,
+                    paused_until REAL NOT NULL,
+                    PRIMARY KEY (service, name)
+                )
+                """
+            )
+            # Past setup, a busy file is not waited for long: callers hold the scheduler's condition
+            conn.execute(f'PRAGMA busy_timeout = {int(STATE_BUSY_TIMEOUT * 1000)}')
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def sync(self, limit: _Limit):
+        """
+        Load a limit's shared state, and store it back if the block completes.
+
+        The block runs in an immediate transaction, so no other process changes the
+        limit in between. Callers hold the scheduler's condition.
+
+        Yields:
+            bool: False if another process held the file for longer than STATE_BUSY_TIMEOUT.
+                The block then sees only this process's state, and nothing is stored.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            logger.debug(f"Shared rate limit state is busy: {str(e)}")
+            yield False
+            return
+        try:
+            row = conn.execute('SELECT requests, tokens, updated, paused_until FROM limits WHERE service = ? AND name = ?',
+                               limit.key).fetchone()
+            if row is not None:
+                requests, tokens, updated, paused_until = row
+                # A pause recorded here while the file was busy is kept
+                limit.paused_until = max(limit.paused_until, paused_until)
+                for bucket, level in ((limit.requests, requests), (limit.tokens, tokens)):
+                    if bucket is not None and level is not None:
+                        bucket.level, bucket.updated = min(level, bucket.capacity), updated
+            yield True
+            buckets = [bucket for bucket in (limit.requests, limit.tokens) if bucket is not None]
+            conn.execute('INSERT OR REPLACE INTO limits VALUES (?, ?, ?, ?, ?, ?)',
+                         (*limit.key, limit.requests.level if limit.requests else None,
+                          limit.tokens.level if limit.tokens else None,
+                          max(bucket.updated for bucket in buckets) if buckets else 0.0, limit.paused_until))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class Reservation:
+    def __init__(self, limit: _Limit, tokens: int, scheduler: 'RateLimitScheduler'):
+        """Capacity taken by one request; settle() corrects its token estimate."""
+        self._limit = limit
+        self._scheduler = scheduler
+        self.tokens = tokens
+
+    def settle(self, tokens: Optional[int]):
+        """
+        Charge the tokens the request actually used instead of the estimate.
+
+        The correction is made with the next request to the same limit, in the same
+        update of the shared state.
+
+        Args:
+            tokens (int, optional): The reported usage; ignored if None.
+        """
+        if tokens is None or self._limit.tokens is None:
+            return
+        with self._scheduler._condition:
+            self._limit.unsettled += tokens - self.tokens
+        self.tokens = tokens
+
+class RateLimitScheduler:
+    def __init__(self, limits: Callable[[str, str], Tuple[float, float]] = default_limits,
+                 burst_seconds: float = BURST_SECONDS, bulk_reserve: float = BULK_RESERVE,
+                 state_path: Optional[str] = None):
+        """
+        Schedules requests of threads and event loops alike under shared limits.
+
+        Args:
+            limits (Callable): Returns the requests and tokens per minute of a (service, name).
+            burst_seconds (float): Seconds of each limit a bucket holds when full.
+            bulk_reserve (float): Share of each bucket bulk requests leave unused.
+            state_path (str, optional): SQLite file the bucket levels and pauses are shared
+                through with other processes. Without it they are kept in this process.
+                Processes sharing a file should be configured with the same limits.
+        """
+        self.limits = limits
+        self.burst_seconds = burst_seconds
+        self.bulk_reserve = bulk_reserve
+        self._state = SharedLimitState(state_path) if state_path else None
+        self._clock = time.time if self._state else time.monotonic
+        self._condition = threading.Condition()
+        self._limits: Dict[Tuple[str, str], _Limit] = {}
+        self._tickets = itertools.count()
+
+    def _limit(self, service: str, name: str) -> _Limit:
+        key = (service, name)
+        if key not in self._limits:
+            self._limits[key] = _Limit(key, *self.limits(service, name), self.burst_seconds, self._clock)
+        return self._limits[key]
+
+    def _synced(self, limit: _Limit):
+        # Brings the limit up to date with the other processes for the duration of the block
+        return self._state.sync(limit) if self._state else nullcontext(True)
+
+    async def _off_loop(self, function: Callable, *args):
+        # The shared state is a file another process may hold; wait for it on a thread, not on the event loop
+        if self._state is None:
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+
+    def _take(self, limit: _Limit, ticket: Tuple[int, int], tokens: int) -> Optional[float]:
+        with self._condition:
+            return self._try_take(limit, ticket, tokens)
+
+    def _try_take(self, limit: _Limit, ticket: Tuple[int, int], tokens: int) -> Optional[float]:
+        # Called with the condition held: 0 once taken, else seconds to wait (None: not first in line)
+        now = self._clock()
+        if limit.paused_until > now:
+            return limit.paused_until - now
+        if limit.waiting[0] != ticket:
+            return None
+        reserve = self.bulk_reserve if ticket[0] == BULK else 0.0
+        with self._synced(limit) as synced:
+            if not synced:
+                return POLL_INTERVAL
+            # Another process may have paused the limit
+            if limit.paused_until > now:
+                return limit.paused_until - now
+            if limit.tokens is not None and limit.unsettled:
+                limit.tokens.take(limit.unsettled)
+                limit.unsettled = 0
+            delay = 0.0
+            for bucket, cost in ((limit.requests, 1), (limit.tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    delay = max(delay, bucket.delay(cost, reserve))
+            if delay > 0:
+                return delay
+            for bucket, cost in ((limit.requests, 1), (limit.tokens, tokens)):
+                if bucket is not None:
+                    bucket.take(cost)
+        heapq.heappop(limit.waiting)
+        self._condition.notify_all()
+        return 0.0
+
+    def _leave(self, limit: _Limit, ticket: Tuple[int, int]):
+        # A waiting request was cancelled
+        with self._condition:
+            if ticket in limit.waiting:
+                limit.waiting.remove(ticket)
+                heapq.heapify(limit.waiting)
+                self._condition.notify_all()
+
+    def _enqueue(self, service: str, name: str, priority: int) -> Tuple[_Limit, Tuple[int, int]]:
+        with self._condition:
+            limit = self._limit(service, name)
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(limit.waiting, ticket)
+        return limit, ticket
+
+    def acquire(self, service: str, name: str, tokens: int = 0, priority: int = INTERACTIVE) -> Reservation:
+        """
+        Block until a request may be sent.
+
+        Args:
+            service (str): 'openai' or 'pinecone'.
+            name (str): The model or operation whose limits apply.
+            tokens (int): Estimated tokens of the request.
+            priority (int): INTERACTIVE or BULK.
+
+        Returns:
+            Reservation: The capacity taken.
+        """
+        start = time.perf_counter()
+        limit, ticket = self._enqueue(service, name, priority)
+        try:
+            with self._condition:
+                while True:
+                    wait = self._try_take(limit, ticket, tokens)
+                    if wait == 0:
+                        break
+                    self._condition.wait(POLL_INTERVAL if wait is None else wait)
+        except BaseException:
+            self._leave(limit, ticket)
+            raise
+        self._record_wait(service, name, priority, time.perf_counter() - start)
+        return Reservation(limit, tokens, self)
+
+    async def aacquire(self, service: str, name: str, tokens: int = 0, priority: int = INTERACTIVE) -> Reservation:
+        """Async counterpart of acquire; waits without blocking the event loop."""
+        start = time.perf_counter()
+        limit, ticket = self._enqueue(service, name, priority)
+        try:
+            while True:
+                wait = await self._off_loop(self._take, limit, ticket, tokens)
+                if wait == 0:
+                    break
+                await asyncio.sleep(POLL_INTERVAL if wait is None else min(wait, POLL_INTERVAL * 10))
+        except BaseException:
+            self._leave(limit, ticket)
+            raise
+        self._record_wait(service, name, priority, time.perf_counter() - start)
+        return Reservation(limit, tokens, self)
+
+    @staticmethod
+    def _record_wait(service: str, name: str, priority: int, seconds: float):
+        metrics.observe('luthor_rate_limit_wait_seconds', seconds, service=service,
+                        lane='bulk' if priority == BULK else 'interactive')
+
+    def pause(self, service: str, name: str, seconds: float):
+        """Hold every request to a model or operation for ``seconds``."""
+        with self._condition:
+            limit = self._limit(service, name)
+            # If the shared state is busy, the pause is stored with the limit's next request
+            with self._synced(limit):
+                limit.paused_until = max(limit.paused_until, self._clock() + seconds)
+
+    def rejected(self, service: str, name: str, error: BaseException):
+        """Pause a model or operation the provider answered with 429."""
+        if not is_rate_limited(error):
+            return
+        seconds = retry_after(error)
+        seconds = DEFAULT_PAUSE if seconds is None else seconds
+        metrics.inc('luthor_rate_limited_total', service=service, limit=name)
+        logger.warning(f"{service} rate limit reached for {name}; pausing its requests for {seconds:.1f}s")
+        self.pause(service, name, seconds)
+
+    @contextmanager
+    def request(self, service: str, name: str, tokens: int = 0, priority: int = INTERACTIVE):
+        """
+        Context manager around one request: acquires capacity, and pauses on a 429.
+
+        Yields:
+            Reservation: Settle it with the reported token usage.
+        """
+        reservation = self.acquire(service, name, tokens, priority)
+        try:
+            yield reservation
+        except Exception as e:
+            self.rejected(service, name, e)
+            raise
+
+    @asynccontextmanager
+    async def arequest(self, service: str, name: str, tokens: int = 0, priority: int = INTERACTIVE):
+        """Async counterpart of request."""
+        reservation = await self.aacquire(service, name, tokens, priority)
+        try:
+            yield reservation
+        except Exception as e:
+            await self._off_loop(self.rejected, service, name, e)
+            raise
+
+class wait_retry_after:
+    def __init__(self, fallback: Callable):
+        """
+        tenacity wait strategy: no wait of its own for a 429 that named its delay.
+
+        The scheduler already holds the retried request until the Retry-After delay has
+        passed; other errors wait as ``fallback`` says.
+
+        Args:
+            fallback (Callable): The tenacity wait strategy for other errors.
+        """
+        self.fallback = fallback
+
+    def __call__(self, retry_state) -> float:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        if error is not None and is_rate_limited(error) and retry_after(error) is not None:
+            return 0.0
+        return self.fallback(retry_state)
+
+def usage_tokens(usage) -> Optional[int]:
+    """Total tokens of an OpenAI response's ``usage``, or None."""
+    total = getattr(usage, 'total_tokens', None)
+    return int(total) if isinstance(total, (int, float)) else None
+
+# Process-wide scheduler shared by openai_utils and pinecone_utils
+scheduler = RateLimitScheduler(state_path=RATE_LIMIT_STATE_PATH or None)
@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+# Finished spans are logged here as JSON lines, at DEBUG level
+trace_logger = logging.getLogger('luthor.trace')
+
+# Latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Name: (type, help) of every exported metric
+METRICS = {
+    'luthor_stage_duration_seconds': ('histogram', 'Duration of each pipeline stage.'),
+    'luthor_stage_errors_total': ('counter', 'Pipeline stages that raised an exception.'),
+    'luthor_api_calls_total': ('counter', 'Requests made to external APIs.'),
+    'luthor_api_retries_total': ('counter', 'Retries of failed external API requests.'),
+    'luthor_tokens_total': ('counter', 'Tokens sent to and received from OpenAI models.'),
+    'luthor_cache_requests_total': ('counter', 'Cache lookups, by result (hit or miss).'),
+    'luthor_rate_limit_wait_seconds': ('histogram', 'Time requests waited for rate-limit capacity.'),
+    'luthor_rate_limited_total': ('counter', 'Requests rejected by a provider with 429.'),
+    'luthor_ingestion_jobs_total': ('counter', 'Ingestion job attempts, by resulting status.'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        In-process registry of the counters and histograms in METRICS.
+
+        Args:
+            buckets (Tuple[float, ...]): Upper bounds of the histogram buckets.
+        """
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, list]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add ``value`` to a counter."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record one observation of a histogram."""
+        key = _labels(labels)
+        with self._lock:
+            # Per-bucket counts, then the sum and count of all observations
+            state = self._histograms.setdefault(name, {}).setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def value(self, name: str, **labels) -> float:
+        """Current value of a counter, or the observation count of a histogram."""
+        key = _labels(labels)
+        with self._lock:
+            if name in self._histograms:
+                return self._histograms[name].get(key, [0])[-1]
+            return self._counters.get(name, {}).get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS.items():
+                series = self._histograms.get(name) if kind == 'histogram' else self._counters.get(name)
+                if not series:
+                    continue
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append(f'{name}{_format_labels(labels)} {value:g}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, value):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(labels, ("le", f"{bound:g}"))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {value[-1]}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]:.6f}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+# Registry shared by the whole process
+metrics = Metrics()
+
+class Span:
+    def __init__(self, stage: str, attributes: Dict[str, object], parent: Optional['Span']):
+        self.stage = stage
+        self.attributes = attributes
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self._otel_span = None
+
+    def set(self, **attributes):
+        """Attach attributes, e.g. token or match counts, to the span."""
+        self.attributes.update(attributes)
+        if self._otel_span is not None:
+            self._otel_span.set_attributes({key: value for key, value in attributes.items()
+                                            if isinstance(value, (str, bool, int, float))})
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('luthor_span', default=None)
+
+@contextmanager
+def span(stage: str, activate: bool = True, **attributes) -> Iterator[Span]:
+    """
+    Time a pipeline stage.
+
+    The duration is recorded in luthor_stage_duration_seconds and failures in
+    luthor_stage_errors_total. The finished span is logged as JSON to the
+    'luthor.trace' logger, and mirrored as an OpenTelemetry span when the
+    opentelemetry API is installed.
+
+    Args:
+        stage (str): Stage name, e.g. 'read', 'preprocess.chunks', 'embed', 'query', 'rerank', 'generate'.
+        activate (bool): Make the span the parent of spans opened inside it. Pass False in
+            generators, which may be resumed in another context.
+        **attributes: Initial span attributes.
+
+    Yields:
+        Span: The running span.
+    """
+    current = Span(stage, dict(attributes), _current_span.get())
+    token = _current_span.set(current) if activate else None
+    otel_context = None
+    if otel_trace is not None:
+        tracer = otel_trace.get_tracer(__name__)
+        if activate:
+            otel_context = tracer.start_as_current_span(stage)
+            current._otel_span = otel_context.__enter__()
+        else:
+            current._otel_span = tracer.start_span(stage)
+        current.set(**attributes)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        # A consumer that stops reading a stream early is not a failure
+        if not isinstance(e, GeneratorExit):
+            error = e
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        if token is not None:
+            _current_span.reset(token)
+        metrics.observe('luthor_stage_duration_seconds', current.duration, stage=stage)
+        if error is not None:
+            metrics.inc('luthor_stage_errors_total', stage=stage, error=type(error).__name__)
+        if otel_context is not None:
+            otel_context.__exit__(type(error) if error else None, error, error.__traceback__ if error else None)
+        elif current._otel_span is not None:
+            if error is not None:
+                current._otel_span.record_exception(error)
+            current._otel_span.end()
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug(json.dumps({
+                'stage': stage, 'parent': current.parent.stage if current.parent else None,
+                'seconds': round(current.duration, 6), 'error': type(error).__name__ if error else None,
+                **current.attributes}, default=str))
+
+def record_duration(stage: str, seconds: float):
+    """Record a stage timed elsewhere, e.g. in a worker process whose metrics are not exported."""
+    metrics.observe('luthor_stage_duration_seconds', seconds, stage=stage)
+
+def record_api_call(service: str, operation: str):
+    metrics.inc('luthor_api_calls_total', service=service, operation=operation)
+
+def record_retry(retry_state, name: Optional[str] = None):
+    """tenacity ``before_sleep`` hook counting retries per function."""
+    name = name or getattr(retry_state.fn, '__name__', 'unknown')
+    metrics.inc('luthor_api_retries_total', function=name)
+    logger.warning(f"Retrying {name} (attempt {retry_state.attempt_number}): {retry_state.outcome.exception()}")
+
+def record_tokens(model: str, usage, target: Optional[Span] = None):
+    """
+    Count the tokens of an OpenAI response, and add them to a span.
+
+    Args:
+        model (str): The model name.
+        usage: The response's ``usage``, with prompt_tokens and (for chat models)
+            completion_tokens. Ignored if None.
+        target (Span, optional): The span to add them to; defaults to the current one.
+    """
+    if usage is None:
+        return
+    counts = {kind: getattr(usage, f'{kind}_tokens', None) or 0 for kind in ('prompt', 'completion')}
+    for kind, count in counts.items():
+        if count:
+            metrics.inc('luthor_tokens_total', count, model=model, type=kind)
+    active = target or _current_span.get()
+    if active is not None:
+        active.set(**{f'{kind}_tokens': active.attributes.get(f'{kind}_tokens', 0) + count
+                      for kind, count in counts.items()})
+
+def record_cache(cache: str, hit: bool):
+    metrics.inc('luthor_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve the metrics for Prometheus to scrape, from a daemon thread.
+
+    For processes without their own HTTP server, such as the Streamlit app.
+
+    Args:
+        port (int, optional): Port to listen on. Defaults to METRICS_PORT; nothing is
+            started if neither is set.
+
+    Returns:
+        Optional[ThreadingHTTPServer]: The server, or None if no port was configured.
+    """
+    port = port if port is not None else int(os.environ.get('METRICS_PORT', 0))
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
@@ -0,0 +1,450 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utils.exceptions import ConfigurationError
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+# How LocalVectorStore keeps the vectors that exact queries scan
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+# With quantized storage, this many candidates per requested match are re-ranked at full precision
+RESCORE_FACTOR = 4
+# Rows scored per step of a quantized scan, so the float32 copy of a block stays in cache
+SCAN_BLOCK_ROWS = 256
+INT8_MAX = 127
+
+class VectorStore(ABC):
+    """Interface shared by the vector database backends."""
+
+    @abstractmethod
+    def upsert(self, vectors: List[dict]) -> Any:
+        """Insert or overwrite vectors given as dicts with 'id', 'values' and 'metadata'."""
+
+    @abstractmethod
+    def query(self, vector: List[float], filters: Optional[dict] = None, top_k: int = 5,
+              include_values: bool = False) -> List[dict]:
+        """Return the top-k matches ('id', 'score', 'metadata') for a query vector."""
+
+    @abstractmethod
+    def delete(self, ids: List[str]) -> Any:
+        """Delete vectors by ID."""
+
+def _compare(value, operator: str, operand) -> bool:
+    if operator == '$eq':
+        return value == operand
+    if operator == '$ne':
+        return value != operand
+    if operator == '$in':
+        return value in operand
+    if operator == '$nin':
+        return value not in operand
+    if operator == '$exists':
+        return (value is not None) == operand
+    if value is None:
+        return False
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+def matches_filter(metadata: dict, filters: Optional[dict]) -> bool:
+    """
+    Evaluate a Pinecone-style metadata filter (as built by create_filters) against metadata.
+
+    Supports implicit equality, $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists, $and and $or.
+
+    Args:
+        metadata (dict): The metadata of a vector.
+        filters (dict, optional): The filter expression.
+
+    Returns:
+        bool: True if the metadata satisfies the filter.
+    """
+    if not filters:
+        return True
+    for key, condition in filters.items():
+        if key == '$and':
+            if not all(matches_filter(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_filter(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            if not all(_compare(value, operator, operand) for operator, operand in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+def quantize(values: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Compress rows of L2-normalised float32 vectors.
+
+    float16 rounds each component. int8 scales each row so that its largest component
+    maps to 127, and returns the per-row scales needed to undo it.
+
+    Args:
+        values (np.ndarray): The vectors, one per row.
+        quantization (str): 'float16' or 'int8'.
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: The codes, and the int8 scales (None for float16).
+    """
+    if quantization == 'float16':
+        return values.astype(np.float16), None
+    scales = np.abs(values).max(axis=1) / INT8_MAX
+    scales[scales == 0] = 1.0
+    return np.rint(values / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """Approximate float32 vectors from the output of quantize."""
+    values = codes.astype(np.float32)
+    if scales is not None:
+        values *= scales[:, None]
+    return values
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # Positions of the k highest scores, best first
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, path: Optional[str] = None, dimension: int = 1536, ann: Optional[str] = None,
+                 initial_capacity: int = 1024, quantization: str = 'float32', rescore: bool = False):
+        """
+        In-process vector store answering cosine top-k queries with NumPy.
+
+        Vectors are kept L2-normalised in a float32 matrix, memory-mapped from disk when
+        ``path`` is given, so a query is one matrix-vector product. Metadata lives in a
+        SQLite file next to it. With ann='hnsw' (requires hnswlib) an HNSW graph is kept
+        alongside the matrix for larger corpora.
+
+        With quantization='float16' or 'int8', only the half- or quarter-size codes are
+        stored and scanned, unless HNSW needs the float32 matrix. With rescore=True the
+        float32 matrix is stored as well and the best RESCORE_FACTOR * top_k rows are
+        re-ranked against it. That recovers the recall lost to quantization, but storage
+        then grows instead of shrinking (int8 + float32 is 1.25 times plain float32). On
+        disk the float32 rows are only paged in for the re-ranked rows, so the memory in
+        use stays close to the codes; in memory both matrices are resident.
+
+        Args:
+            path (str, optional): Directory for persistent storage. In memory if None.
+            dimension (int): Embedding dimension.
+            ann (str, optional): 'hnsw' to answer queries from an approximate index.
+            initial_capacity (int): Rows allocated before the first resize.
+            quantization (str): One of QUANTIZATIONS.
+            rescore (bool): Also keep the float32 matrix and re-rank quantized matches against it.
+        """
+        if ann not in (None, 'hnsw'):
+            raise ConfigurationError(f"Unsupported ANN index: {ann}")
+        if ann == 'hnsw' and hnswlib is None:
+            raise ConfigurationError("The 'hnsw' index requires the hnswlib package.")
+        if quantization not in QUANTIZATIONS:
+            raise ConfigurationError(f"Unsupported quantization: {quantization}")
+
+        self.path = path
+        self.dimension = dimension
+        self.ann = ann
+        self.quantization = quantization
+        self.rescore = rescore
+        self._lock = threading.RLock()
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[dict] = []
+        self._rows: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        # Full-precision vectors, and the quantized codes with their int8 scales
+        self._vectors = None
+        self._codes = None
+        self._scales = None
+        self._hnsw = None
+        self._db = None
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(path, 'metadata.sqlite'), check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS vectors (row INTEGER PRIMARY KEY, id TEXT, metadata TEXT, alive INTEGER)')
+            self._db.commit()
+            self._load(initial_capacity)
+        else:
+            for attribute, (_, dtype, columns) in self._layout().items():
+                setattr(self, attribute, np.zeros((initial_capacity, *columns), dtype=dtype))
+            self._alive = np.zeros(initial_capacity, dtype=bool)
+
+        if ann == 'hnsw':
+            self._build_hnsw()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def upsert(self, vectors: List[dict]) -> int:
+        """
+        Insert or overwrite vectors.
+
+        Args:
+            vectors (List[dict]): Dicts with 'id', 'values' and optional 'metadata'.
+
+        Returns:
+            int: The number of vectors written.
+        """
+        if not vectors:
+            return 0
+        values = np.asarray([vector['values'] for vector in vectors], dtype=np.float32)
+        if values.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {values.shape[1]}")
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values /= np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            rows = []
+            for vector in vectors:
+                row = self._rows.get(vector['id'])
+                if row is None:
+                    row = len(self._ids)
+                    self._ids.append(vector['id'])
+                    self._metadata.append({})
+                    self._rows[vector['id']] = row
+                self._metadata[row] = dict(vector.get('metadata') or {})
+                rows.append(row)
+
+            self._ensure_capacity(len(self._ids))
+            if self._vectors is not None:
+                self._vectors[rows] = values
+            if self._codes is not None:
+                codes, scales = quantize(values, self.quantization)
+                self._codes[rows] = codes
+                if scales is not None:
+                    self._scales[rows] = scales
+            self._alive[rows] = True
+            if self._hnsw is not None:
+                self._hnsw_reserve(len(self._ids))
+                self._hnsw.add_items(values, rows)
+
+            if self._db is not None:
+                self._db.executemany('INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, 1)',
+                                     [(row, self._ids[row], json.dumps(self._metadata[row], default=str)) for row in rows])
+                self._db.commit()
+                for attribute in self._layout():
+                    getattr(self, attribute).flush()
+        return len(vectors)
+
+    def delete(self, ids: List[str]) -> int:
+        """
+        Delete vectors by ID; unknown IDs are ignored.
+
+        Returns:
+            int: The number of vectors deleted.
+        """
+        with self._lock:
+            rows = [self._rows.pop(vector_id) for vector_id in ids if vector_id in self._rows]
+            self._alive[rows] = False
+            if self._hnsw is not None:
+                for row in rows:
+                    self._hnsw.mark_deleted(row)
+            if self._db is not None and rows:
+                self._db.executemany('UPDATE vectors SET alive = 0 WHERE row = ?', [(row,) for row in rows])
+                self._db.commit()
+        return len(rows)
+
+    def query(self, vector: List[float], filters: Optional[dict] = None, top_k: int = 5,
+              include_values: bool = False) -> List[dict]:
+        """
+        Return the top-k vectors by cosine similarity, optionally restricted by a metadata filter.
+
+        Args:
+            vector (List[float]): The query vector.
+            filters (dict, optional): Pinecone-style metadata filter.
+            top_k (int): Number of matches to return.
+            include_values (bool): Whether to return the stored (normalised) vectors.
+
+        Returns:
+            List[dict]: Matches with 'id', 'score' and 'metadata', best first.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape != (self.dimension,):
+            raise ValueError(f"Expected a {self.dimension}-dimensional query vector")
+        query /= np.linalg.norm(query) or 1.0
+
+        with self._lock:
+            n_rows = len(self._ids)
+            if not self._rows or top_k <= 0:
+                return []
+            if self._hnsw is not None:
+                try:
+                    rows, scores = self._query_hnsw(query, filters, top_k)
+                except RuntimeError:
+                    # Fewer than top_k vectors pass the filter; scan them exactly instead
+                    rows, scores = self._query_exact(query, filters, top_k, n_rows)
+            else:
+                rows, scores = self._query_exact(query, filters, top_k, n_rows)
+
+            matches = []
+            for row, score in zip(rows, scores):
+                match = {'id': self._ids[row], 'score': float(score), 'metadata': dict(self._metadata[row])}
+                if include_values:
+                    match['values'] = self._values(row).tolist()
+                matches.append(match)
+        return matches
+
+    def _query_exact(self, query: np.ndarray, filters: Optional[dict], top_k: int, n_rows: int):
+        mask = self._alive[:n_rows].copy()
+        if filters:
+            mask &= np.fromiter((matches_filter(metadata, filters) for metadata in self._metadata),
+                                dtype=bool, count=n_rows)
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return [], []
+
+        k = min(top_k, candidates.size)
+        if self._codes is None:
+            scores = self._vectors[candidates] @ query if candidates.size < n_rows else self._vectors[:n_rows] @ query
+            top = _top_k(scores, k)
+            return candidates[top].tolist(), scores[top].tolist()
+
+        # Shortlist on the quantized codes, then rank the shortlist at full precision
+        scores = self._scan(candidates, query, candidates.size == n_rows)
+        rescore = self.rescore and self._vectors is not None
+        top = _top_k(scores, min(candidates.size, k * RESCORE_FACTOR) if rescore else k)
+        if not rescore:
+            return candidates[top].tolist(), scores[top].tolist()
+        # Sorted, so a memory-mapped matrix is read in file order
+        shortlist = np.sort(candidates[top])
+        scores = self._vectors[shortlist] @ query
+        top = _top_k(scores, k)
+        return shortlist[top].tolist(), scores[top].tolist()
+
+    def _scan(self, rows: np.ndarray, query: np.ndarray, all_rows: bool) -> np.ndarray:
+        # Approximate scores of the given rows from the quantized codes
+        scores = np.empty(rows.size, dtype=np.float32)
+        for start in range(0, rows.size, SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, rows.size)
+            block = slice(start, stop) if all_rows else rows[start:stop]
+            scores[start:stop] = self._codes[block].astype(np.float32) @ query
+            if self._scales is not None:
+                scores[start:stop] *= self._scales[block]
+        return scores
+
+    def _values(self, row: int) -> np.ndarray:
+        if self._vectors is not None:
+            return self._vectors[row]
+        return dequantize(self._codes[row:row + 1], None if self._scales is None else self._scales[row:row + 1])[0]
+
+    def _query_hnsw(self, query: np.ndarray, filters: Optional[dict], top_k: int):
+        k = min(top_k, len(self._rows))
+        if filters:
+            metadata = self._metadata
+            labels, distances = self._hnsw.knn_query(query, k=k, filter=lambda row: matches_filter(metadata[row], filters))
+        else:
+            labels, distances = self._hnsw.knn_query(query, k=k)
+        # hnswlib reports cosine distance
+        return labels[0].tolist(), (1.0 - distances[0]).tolist()
+
+    def _layout(self) -> Dict[str, Tuple[str, type, Tuple[int, ...]]]:
+        # Attribute: (file name, dtype, row shape) of each stored matrix
+        layout = {}
+        if self.quantization == 'float32' or self.rescore or self.ann == 'hnsw':
+            layout['_vectors'] = ('vectors.f32', np.float32, (self.dimension,))
+        if self.quantization == 'float16':
+            layout['_codes'] = ('vectors.f16', np.float16, (self.dimension,))
+        elif self.quantization == 'int8':
+            layout['_codes'] = ('vectors.i8', np.int8, (self.dimension,))
+            layout['_scales'] = ('scales.f32', np.float32, ())
+        return layout
+
+    def _ensure_capacity(self, n_rows: int):
+        capacity = len(self._alive)
+        if n_rows <= capacity:
+            return
+        new_capacity = max(n_rows, 2 * capacity)
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:capacity] = self._alive
+        self._alive = alive
+        for attribute, (file_name, dtype, columns) in self._layout().items():
+            if self.path:
+                getattr(self, attribute).flush()
+                setattr(self, attribute, None)
+                setattr(self, attribute, self._open_matrix(file_name, dtype, new_capacity, columns))
+            else:
+                matrix = np.zeros((new_capacity, *columns), dtype=dtype)
+                matrix[:capacity] = getattr(self, attribute)
+                setattr(self, attribute, matrix)
+
+    def _open_matrix(self, file_name: str, dtype: type, capacity: int, columns: Tuple[int, ...]) -> np.memmap:
+        matrix_path = os.path.join(self.path, file_name)
+        size = capacity * int(np.prod(columns, dtype=np.int64)) * np.dtype(dtype).itemsize
+        with open(matrix_path, 'ab') as file:
+            if file.tell() < size:
+                file.truncate(size)
+        return np.memmap(matrix_path, dtype=dtype, mode='r+', shape=(capacity, *columns))
+
+    def _load(self, initial_capacity: int):
+        rows = self._db.execute('SELECT row, id, metadata, alive FROM vectors ORDER BY row').fetchall()
+        n_rows = rows[-1][0] + 1 if rows else 0
+        self._ids = [None] * n_rows
+        self._metadata = [{} for _ in range(n_rows)]
+        self._alive = np.zeros(max(initial_capacity, n_rows), dtype=bool)
+        for row, vector_id, metadata, alive in rows:
+            self._ids[row] = vector_id
+            self._metadata[row] = json.loads(metadata)
+            if alive:
+                self._rows[vector_id] = row
+                self._alive[row] = True
+
+        layout = self._layout()
+        missing = [attribute for attribute, (file_name, _, _) in layout.items()
+                   if not os.path.exists(os.path.join(self.path, file_name))]
+        for attribute, (file_name, dtype, columns) in layout.items():
+            setattr(self, attribute, self._open_matrix(file_name, dtype, len(self._alive), columns))
+        if n_rows and missing:
+            self._backfill(missing, n_rows)
+
+    def _backfill(self, missing: List[str], n_rows: int):
+        # The store was created with another quantization: fill the new matrices from the stored ones
+        if '_vectors' not in missing:
+            source = lambda rows: np.asarray(self._vectors[rows])
+        elif '_codes' not in missing:
+            logger.warning("Rebuilding full-precision vectors from quantized ones; rescoring gains nothing")
+            source = lambda rows: dequantize(self._codes[rows], None if self._scales is None else self._scales[rows])
+        else:
+            raise ConfigurationError(f"No stored vectors in {self.path} to build {self.quantization} storage from")
+        for start in range(0, n_rows, SCAN_BLOCK_ROWS):
+            rows = slice(start, min(start + SCAN_BLOCK_ROWS, n_rows))
+            values = source(rows)
+            if '_vectors' in missing:
+                self._vectors[rows] = values
+            if '_codes' in missing:
+                codes, scales = quantize(values, self.quantization)
+                self._codes[rows] = codes
+                if scales is not None:
+                    self._scales[rows] = scales
+        for attribute in missing:
+            getattr(self, attribute).flush()
+
+    def _build_hnsw(self):
+        self._hnsw = hnswlib.Index(space='cosine', dim=self.dimension)
+        self._hnsw.init_index(max_elements=max(1024, len(self._ids)), ef_construction=200, M=16)
+        self._hnsw.set_ef(64)
+        alive_rows = np.flatnonzero(self._alive[:len(self._ids)])
+        if alive_rows.size:
+            self._hnsw.add_items(np.asarray(self._vectors[alive_rows]), alive_rows)
+
+    def _hnsw_reserve(self, n_rows: int):
+        if n_rows > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(max(n_rows, 2 * self._hnsw.get_max_elements()))
@@ -0,0 +1,37 @@
+import unittest
+from unittest import mock
+
+from src.utils.answer_cache import SemanticAnswerCache
+
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticAnswerCache(threshold=0.95, ttl=60)
+        self.cache.store([1.0, 0.0, 0.0], {'doc_type': {'$in': ['memo']}}, 'Six years.', ['match'])
+
+    def test_near_identical_question_hits(self):
+        self.assertEqual(self.cache.lookup([0.99, 0.05, 0.0], {'doc_type': {'$in': ['memo']}}),
+                         ('Six years.', ['match']))
+
+    def test_different_question_or_filters_miss(self):
+        self.assertIsNone(self.cache.lookup([0.6, 0.8, 0.0], {'doc_type': {'$in': ['memo']}}))
+        self.assertIsNone(self.cache.lookup([1.0, 0.0, 0.0], {}))
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_entries_expire(self):
+        with mock.patch('src.utils.answer_cache.time.time', return_value=10 ** 12):
+            self.assertIsNone(self.cache.lookup([1.0, 0.0, 0.0], {'doc_type': {'$in': ['memo']}}))
+
+    def test_invalidate_and_eviction(self):
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.lookup([1.0, 0.0, 0.0], {'doc_type': {'$in': ['memo']}}))
+
+        cache = SemanticAnswerCache(max_entries=2)
+        for i, embedding in enumerate(([1.0, 0.0], [0.0, 1.0], [-1.0, 0.0])):
+            cache.store(embedding, None, f'answer {i}', [])
+        self.assertIsNone(cache.lookup([1.0, 0.0]))
+        self.assertEqual(cache.lookup([-1.0, 0.0]), ('answer 2', []))
+
+
+if __name__ == '__main__':
+    unittest.main()
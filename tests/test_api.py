@@ -0,0 +1,129 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from src import api, batch_query
+from src.utils.bm25_index import BM25Index
+from src.utils.hash_index import DocumentHashIndex
+from tests.test_ingestion import line_chunker
+
+MATCHES = [
+    {'id': 'a', 'score': 0.9, 'metadata': {'text': 'Six years.', 'file_name': 'memo.txt'}},
+    {'id': 'b', 'score': 0.8, 'metadata': {'text': 'From breach.', 'file_name': 'memo.txt'}},
+]
+
+
+async def fake_embedding(text):
+    return [1.0, 0.0]
+
+
+async def fake_embeddings(texts):
+    return [[1.0, 0.0] for _ in texts]
+
+
+async def fake_query(vector, filters=None, top_k=5):
+    return MATCHES
+
+
+async def fake_stream(question, context):
+    for token in ("Six", " years."):
+        yield token
+
+
+class TestApi(unittest.TestCase):
+    def setUp(self):
+        self.upserted = []
+        app = api.create_app(embed_fn=lambda texts: [[1.0] for _ in texts], upsert_fn=self.upserted.extend,
+                             delete_fn=None, preprocessor_factory=line_chunker, hash_index=DocumentHashIndex(),
+                             term_index=BM25Index(), parse_workers=1)
+        patches = [mock.patch.object(api, 'aget_embedding', fake_embedding),
+                   mock.patch.object(api, 'aquery_pinecone', fake_query),
+                   mock.patch.object(api, 'astream_answer', fake_stream),
+                   mock.patch.object(api, 'agenerate_answer', mock.AsyncMock(return_value='Six years.')),
+                   mock.patch.object(batch_query, 'aget_embeddings', fake_embeddings),
+                   mock.patch.object(batch_query, 'aquery_pinecone', fake_query),
+                   mock.patch.object(batch_query, 'agenerate_answer', mock.AsyncMock(return_value='Six years.'))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = TestClient(app)
+        self.client.__enter__()
+        self.addCleanup(self.client.__exit__, None, None, None)
+
+    def test_query_returns_answer_and_sources(self):
+        response = self.client.post('/query', json={'question': 'How long?'})
+        self.assertEqual(response.json(), {'answer': 'Six years.', 'sources': ['memo.txt']})
+
+    def test_query_streams_sources_before_tokens(self):
+        response = self.client.post('/query', json={'question': 'How long?', 'stream': True})
+        events = [line.split(': ', 1)[1] for line in response.text.splitlines() if line.startswith('event: ')]
+        self.assertEqual(events, ['sources', 'token', 'token', 'done'])
+
+    def test_empty_query_is_rejected(self):
+        self.assertEqual(self.client.post('/query', json={'question': '  '}).status_code, 400)
+
+    def test_upload_parses_and_stores_once(self):
+        files = {'file': ('memo.txt', b'first line\nsecond line')}
+        response = self.client.post('/upload', files=files)
+        self.assertEqual(response.json()['chunks'], 2)
+        self.assertEqual(len(self.upserted), 2)
+        self.assertEqual(self.client.post('/upload', files=files).status_code, 409)
+
+    def test_quoted_phrase_is_answered_locally(self):
+        self.client.post('/upload', files={'file': ('memo.txt', b'first line\nsecond line')})
+        with mock.patch.object(api, 'aget_embedding') as embed:
+            response = self.client.post('/query', json={'question': '"second line"'})
+        embed.assert_not_called()
+        self.assertEqual(response.json()['sources'], ['memo.txt'])
+
+    def test_unsupported_upload(self):
+        self.assertEqual(self.client.post('/upload', files={'file': ('image.png', b'\x89PNG')}).status_code, 415)
+
+    def test_batch_streams_each_chunk_once(self):
+        response = self.client.post('/query/batch', json={'questions': ['How long?', 'From when?']})
+        events = [line.split(': ', 1)[1] for line in response.text.splitlines() if line.startswith('event: ')]
+        self.assertEqual(events, ['chunk', 'chunk', 'result', 'result', 'done'])
+
+    def test_batch_returns_results_in_question_order(self):
+        response = self.client.post('/query/batch', json={'questions': ['How long?', 'From when?'], 'stream': False})
+        body = response.json()
+        self.assertEqual([result['question'] for result in body['results']], ['How long?', 'From when?'])
+        self.assertEqual(body['results'][0]['answer'], 'Six years.')
+        self.assertEqual(sorted(body['chunks']), ['a', 'b'])
+
+    def test_batch_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.client.post('/query/batch', json={'questions': ['How long?', ' ']}).status_code, 400)
+        with mock.patch.object(api, 'MAX_BATCH_QUESTIONS', 1):
+            response = self.client.post('/query/batch', json={'questions': ['How long?', 'From when?']})
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics_include_query_stages(self):
+        self.client.post('/query', json={'question': 'How long?'})
+        response = self.client.get('/metrics')
+        self.assertTrue(response.headers['content-type'].startswith('text/plain'))
+        self.assertIn('luthor_stage_duration_seconds_count{stage="rerank"}', response.text)
+        self.assertIn('luthor_stage_duration_seconds_count{stage="lexical"}', response.text)
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_rejects_when_no_slot_frees_up(self):
+        async def scenario():
+            limiter = api.ConcurrencyLimiter(1, queue_timeout=0.01)
+            await limiter.acquire()
+            with self.assertRaises(api.HTTPException) as raised:
+                await limiter.acquire()
+            limiter.release()
+            async with limiter.slot():
+                pass
+            return raised.exception
+
+        self.assertEqual(asyncio.run(scenario()).status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from src import batch_query
+from src.batch_query import BatchQuery
+from src.context import ContextBuilder
+from src.retrieval import HybridRetriever
+from src.utils.bm25_index import BM25Index
+
+
+def match(vector_id, file_name='memo.txt'):
+    return {'id': vector_id, 'score': 0.9, 'metadata': {'text': f'Text of {vector_id}.', 'file_name': file_name}}
+
+
+class TestBatchQuery(unittest.TestCase):
+    def setUp(self):
+        index = BM25Index()
+        index.add([('s4', ['section', '4.2', 'notice'], {'text': 'Section 4.2 requires notice.',
+                                                          'file_name': 'terms.txt'})])
+        self.retriever = HybridRetriever(index, lambda text: text.lower().split(), None)
+        self.context_builder = ContextBuilder(1000, count_tokens=lambda text: len(text.split()))
+        self.embedded = []
+        self.generating = 0
+        self.peak = 0
+
+        async def embed(texts):
+            self.embedded.append(list(texts))
+            return [[float(i)] for i in range(len(texts))]
+
+        async def query(vector, filters=None, top_k=5):
+            # Every question shares chunk 'a'
+            return [match('a'), match(f'q{int(vector[0])}', 'other.txt')]
+
+        async def generate(question, context):
+            self.generating += 1
+            self.peak = max(self.peak, self.generating)
+            await asyncio.sleep(0.01)
+            self.generating -= 1
+            if question == 'Fails?':
+                raise ConnectionError('reset')
+            return f'Answer to {question}'
+
+        patches = [mock.patch.object(batch_query, 'aget_embeddings', embed),
+                   mock.patch.object(batch_query, 'aquery_pinecone', query),
+                   mock.patch.object(batch_query, 'agenerate_answer', generate)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def answer(self, questions, concurrency=2):
+        batch = BatchQuery(self.retriever, self.context_builder, concurrency=concurrency)
+
+        async def collect():
+            return [result async for result in batch.answers(questions)]
+
+        return batch, sorted(asyncio.run(collect()))
+
+    def test_embeds_once_and_answers_duplicates_once(self):
+        questions = ['How long?', 'Who signs?', 'How  long?', 'Can we end it?']
+        batch, results = self.answer(questions)
+        self.assertEqual(self.embedded, [['How long?', 'Who signs?', 'Can we end it?']])
+        self.assertEqual([result.index for result in results], [0, 1, 2, 3])
+        self.assertEqual(results[2].question, 'How  long?')
+        self.assertEqual(results[2].answer, results[0].answer)
+        self.assertEqual(results[0].sources, ['memo.txt', 'other.txt'])
+        # The shared chunk is stored once for the whole batch
+        self.assertEqual(sorted(batch.chunks), ['a', 'q0', 'q1', 'q2'])
+
+    def test_generation_is_bounded_and_failures_are_isolated(self):
+        questions = [f'Question {i}?' for i in range(6)] + ['Fails?']
+        _, results = self.answer(questions, concurrency=2)
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(results[-1].error, 'reset')
+        self.assertIsNone(results[-1].answer)
+        self.assertTrue(all(result.error is None for result in results[:-1]))
+
+    def test_citations_skip_the_embedding(self):
+        _, results = self.answer(['Section 4.2 notice'])
+        self.assertEqual(self.embedded, [])
+        self.assertEqual(results[0].chunk_ids, ['s4'])
+
+    def test_cli_writes_each_chunk_before_the_answers_citing_it(self):
+        output = io.StringIO()
+        with mock.patch.object(batch_query, 'close_async_client', mock.AsyncMock()), \
+                mock.patch.object(batch_query, 'close_async_index', mock.AsyncMock()):
+            failed = asyncio.run(batch_query.run(['How long?', 'Who signs?'], output, self.retriever,
+                                                 self.context_builder))
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(failed, 0)
+        self.assertEqual([record['type'] for record in records].count('answer'), 2)
+        written = set()
+        for record in records:
+            if record['type'] == 'chunk':
+                written.add(record['id'])
+            else:
+                self.assertLessEqual(set(record['chunk_ids']), written)
+        self.assertEqual(len(written), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from benchmarks import corpus, fakes, storage, tokenization
+from benchmarks.suite import Suite, compare
+from src.preprocessor import FileTextPreprocessor
+from src.utils import openai_utils, pinecone_utils
+from tests.test_preprocessor import WordTokenizer
+
+
+def word_preprocessor():
+    # Avoid depending on downloaded NLTK corpora and the Longformer tokenizer
+    stopwords = mock.Mock(**{'words.return_value': ['the', 'to', 'and']})
+    lemmatizer = mock.Mock(**{'return_value.lemmatize.side_effect': lambda token: token})
+    with mock.patch('src.preprocessor.stopwords', new=stopwords), \
+            mock.patch('src.preprocessor.WordNetLemmatizer', new=lemmatizer):
+        return FileTextPreprocessor(WordTokenizer(), chunk_size=200, chunking='structure')
+
+
+class TestCorpus(unittest.TestCase):
+    def test_corpus_is_deterministic(self):
+        self.assertEqual(corpus.memos(3), corpus.memos(3))
+        self.assertEqual(corpus.queries(10), corpus.queries(10))
+        self.assertNotEqual(corpus.memo(0), corpus.memo(1))
+
+    def test_memos_have_sections(self):
+        text = corpus.memo(0)
+        for heading in corpus.HEADINGS:
+            self.assertIn(heading, text)
+
+
+class TestFakes(unittest.TestCase):
+    def test_embeddings_are_deterministic_and_similar_for_shared_terms(self):
+        a = fakes.hashed_embedding('limitation period of six years', 64)
+        b = fakes.hashed_embedding('the limitation period', 64)
+        c = fakes.hashed_embedding('force majeure', 64)
+        self.assertTrue((a == fakes.hashed_embedding('limitation period of six years', 64)).all())
+        self.assertGreater(float(a @ b), float(a @ c))
+
+    def test_offline_services_route_the_real_code_paths(self):
+        saved_client = openai_utils._client
+        with fakes.offline_services(dimension=16) as services:
+            embeddings = openai_utils.get_embeddings(['six years', 'force majeure'])
+            pinecone_utils.upsert_chunks([{'id': 'a', 'values': embeddings[0], 'metadata': {'text': 'six years'}}])
+            matches = pinecone_utils.query_pinecone(embeddings[0], top_k=1)
+            answer = ''.join(openai_utils.stream_answer('How long?', 'six years'))
+        self.assertEqual(matches[0]['id'], 'a')
+        self.assertEqual(answer, services.openai.answer)
+        self.assertIs(openai_utils._client, saved_client)
+
+
+class TestSuite(unittest.TestCase):
+    def test_runs_every_benchmark(self):
+        suite = Suite(repeat=1, preprocessor_factory=word_preprocessor)
+        suite.run([2])
+        self.assertEqual(suite.errors, {})
+        for name in ('read_file.txt', 'read_file.pdf', 'preprocess.chunks', 'chunking', 'embedding', 'upsert',
+                     'process_query', 'batch_query'):
+            self.assertIn('median_s', suite.results[name]['2'])
+
+    def test_storage_benchmark_reports_each_configuration(self):
+        results = storage.run(count=300, n_queries=5, dimensions=[32], top_k=5)['32']
+        self.assertEqual(set(results), {configuration[0] for configuration in storage.CONFIGURATIONS})
+        self.assertEqual(results['float32']['recall'], 1.0)
+        self.assertEqual(results['int8']['stored_bytes_per_vector'], 32 + 4)
+        # Rescoring keeps the float32 vectors too: more stored than float32 alone
+        rescored = results['int8_rescored']
+        self.assertEqual(rescored['scanned_bytes_per_vector'], 32 + 4)
+        self.assertEqual(rescored['stored_bytes_per_vector'], 32 + 4 + 4 * 32)
+        self.assertEqual(rescored['resident_bytes_per_vector'], rescored['stored_bytes_per_vector'])
+        self.assertEqual(results['int8_rescored_on_disk']['resident_bytes_per_vector'], 32 + 4)
+
+    def test_tokenization_benchmark_times_both_pipelines(self):
+        report = tokenization.run(megabytes=0.02, repeat=1)
+        self.assertGreaterEqual(report['bytes'], 20_000)
+        for name in ('nltk', 'regex_lru'):
+            self.assertGreater(report['results'][name]['tokens'], 1000)
+        self.assertGreater(report['speedup'], 0)
+
+    def test_compare_reports_slowdowns_beyond_tolerance(self):
+        baseline = {'chunking': {'10': {'median_s': 1.0}}, 'upsert': {'10': {'median_s': 1.0}}}
+        results = {'chunking': {'10': {'median_s': 1.5}}, 'upsert': {'10': {'median_s': 1.1}}}
+        regressions = compare(results, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('chunking[10]'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+from src.utils.bm25_index import BM25Index
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add([
+            ('a', ['limitation', 'period', 'contract', 'six', 'year'], {'text': 'a', 'doc_type': 'memo'}),
+            ('b', ['tort', 'damage', 'limitation'], {'text': 'b', 'doc_type': 'case law'}),
+            ('c', ['contract', 'contract', 'breach'], {'text': 'c', 'doc_type': 'memo'}),
+        ])
+
+    def test_ranks_by_bm25(self):
+        self.assertEqual([m['id'] for m in self.index.search(['contract'])], ['c', 'a'])
+        self.assertEqual([m['id'] for m in self.index.search(['unknown'])], [])
+
+    def test_require_all_and_filters(self):
+        self.assertEqual([m['id'] for m in self.index.search(['limitation', 'contract'], require_all=True)], ['a'])
+        matches = self.index.search(['limitation'], filters={'doc_type': {'$in': ['case law']}})
+        self.assertEqual([m['id'] for m in matches], ['b'])
+
+    def test_delete_and_replace(self):
+        self.index.delete(['c'])
+        self.index.add([('a', ['breach'], {'text': 'a2'})])
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual([m['metadata']['text'] for m in self.index.search(['breach', 'contract'])], ['a2'])
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as path:
+            index = BM25Index(os.path.join(path, 'terms'))
+            index.add([('a', ['contract', 'breach'], {'text': 'a'}), ('b', ['tort'], {'text': 'b'})])
+            index.delete(['b'])
+            index.save()
+
+            loaded = BM25Index(index.path)
+            self.assertEqual(len(loaded), 1)
+            self.assertEqual(loaded.search(['breach']), index.search(['breach']))
+            self.assertEqual(loaded.search(['tort']), [])
+
+    def test_save_only_writes_changed_metadata(self):
+        with tempfile.TemporaryDirectory() as path:
+            index = BM25Index(path)
+            index.add((f'c{i}', ['clause', f'term{i}'], {'text': 'x' * 1000}) for i in range(100))
+            index.save()
+            before = index._db.total_changes
+            index.add([('new', ['clause', 'notice'], {'text': 'notice'})])
+            index.delete(['c0'])
+            index.save()
+            # One chunk written, one deleted, and the postings row
+            self.assertEqual(index._db.total_changes - before, 3)
+            index.close()
+
+            loaded = BM25Index(path)
+            self.assertEqual(len(loaded), 100)
+            self.assertEqual(loaded.search(['notice'])[0]['metadata'], {'text': 'notice'})
+            self.assertEqual(loaded.search(['term0']), [])
+            loaded.close()
+
+    def test_writers_sharing_a_path_keep_each_others_chunks(self):
+        # E.g. the Streamlit app and the bulk CLI, each with the index loaded at start
+        with tempfile.TemporaryDirectory() as path:
+            BM25Index(path).save()
+            app, bulk = BM25Index(path), BM25Index(path)
+            app.add([('a', ['contract', 'breach'], {'text': 'a'}), ('old', ['tort'], {'text': 'old'})])
+            app.save()
+            bulk.add([('b', ['contract', 'notice'], {'text': 'b'})])
+            bulk.delete(['old'])
+            bulk.save()
+            app.add([('c', ['notice', 'notice'], {'text': 'c'})])
+            app.save()
+
+            # Each sees the other's saved chunks
+            self.assertEqual([m['id'] for m in bulk.search(['notice'])], ['c', 'b'])
+            self.assertEqual([m['id'] for m in app.search(['contract'])], ['a', 'b'])
+            loaded = BM25Index(path)
+            self.assertEqual(sorted(m['id'] for m in loaded.search(['contract', 'notice', 'tort'])), ['a', 'b', 'c'])
+            self.assertEqual(len(loaded), 3)
+            for index in (app, bulk, loaded):
+                index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
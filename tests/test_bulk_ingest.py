@@ -0,0 +1,170 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from src.bulk_ingest import Checkpoint, DeferredHashIndex, VectorBatcher, iter_documents
+from src.ingestion import IngestionEngine, IngestionResult
+from src.utils.hash_index import DocumentHashIndex, content_hash, document_id, vector_id
+from tests.test_ingestion import line_chunker
+
+
+def vectors_for(file_hash, n):
+    return [{'id': f'{file_hash}_{i}', 'values': [0.0], 'metadata': {'file_hash': file_hash, 'file_name': f'{file_hash}.txt'}}
+            for i in range(n)]
+
+
+def result_for(file_hash, n):
+    return IngestionResult(f'{file_hash}.txt', file_hash, n, 0.0)
+
+
+class TestIterDocuments(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.files = {'a.txt': b'first memo', 'nested/b.txt': b'second memo', 'notes.md': b'ignored'}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_directory(self):
+        for name, content in self.files.items():
+            path = os.path.join(self.tmp.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(content)
+        documents = dict(iter_documents(self.tmp.name))
+        self.assertEqual(documents, {'a.txt': b'first memo', os.path.join('nested', 'b.txt'): b'second memo'})
+
+    def test_zip_archive(self):
+        path = os.path.join(self.tmp.name, 'memos.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name, content in self.files.items():
+                archive.writestr(name, content)
+        self.assertEqual(dict(iter_documents(path)), {'a.txt': b'first memo', 'nested/b.txt': b'second memo'})
+
+    def test_tar_archive(self):
+        path = os.path.join(self.tmp.name, 'memos.tar.gz')
+        with tarfile.open(path, 'w:gz') as archive:
+            for name, content in self.files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+        self.assertEqual(dict(iter_documents(path)), {'a.txt': b'first memo', 'nested/b.txt': b'second memo'})
+
+
+class TestVectorBatcher(unittest.TestCase):
+    def test_documents_are_checkpointed_after_their_batch_is_upserted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint_path = os.path.join(tmp, 'checkpoint.jsonl')
+            upserts = []
+            batcher = VectorBatcher(upserts.append, Checkpoint(checkpoint_path), batch_size=5)
+
+            batcher.add(vectors_for('doc1', 3))
+            self.assertEqual(upserts, [])
+            self.assertNotIn('doc1', Checkpoint(checkpoint_path))
+
+            batcher.add(vectors_for('doc2', 3))
+            batcher.add(vectors_for('doc3', 1))
+            batcher.flush()
+
+            self.assertEqual([len(batch) for batch in upserts], [6, 1])
+            resumed = Checkpoint(checkpoint_path)
+            self.assertTrue(all(file_hash in resumed for file_hash in ('doc1', 'doc2', 'doc3')))
+
+    def test_documents_are_reported_after_their_batch_is_upserted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            batcher = VectorBatcher(lambda vectors: None, Checkpoint(os.path.join(tmp, 'checkpoint.jsonl')),
+                                    batch_size=5)
+            batcher.add(vectors_for('doc1', 3))
+            self.assertEqual(batcher.complete(result_for('doc1', 3)), [])
+
+            # doc2 fills the batch before its own result arrives
+            batcher.add(vectors_for('doc2', 3))
+            self.assertEqual([result.file_hash for result in batcher.complete(result_for('doc2', 3))],
+                             ['doc1', 'doc2'])
+
+            batcher.add(vectors_for('doc3', 1))
+            self.assertEqual(batcher.complete(result_for('doc3', 1)), [])
+            self.assertEqual([result.file_hash for result in batcher.flush()], ['doc3'])
+
+    def test_documents_without_vectors_are_checkpointed_directly(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint_path = os.path.join(tmp, 'checkpoint.jsonl')
+            upserts = []
+            batcher = VectorBatcher(upserts.append, Checkpoint(checkpoint_path), batch_size=5)
+            self.assertEqual(batcher.complete(result_for('empty', 0)), [result_for('empty', 0)])
+            self.assertEqual(upserts, [])
+            self.assertIn('empty', Checkpoint(checkpoint_path))
+
+    def test_documents_of_a_failed_batch_are_reported_failed_and_not_checkpointed(self):
+        def upsert(vectors):
+            raise ConnectionError('index unavailable')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint_path = os.path.join(tmp, 'checkpoint.jsonl')
+            batcher = VectorBatcher(upsert, Checkpoint(checkpoint_path), batch_size=5)
+            batcher.add(vectors_for('doc1', 3))
+            self.assertEqual(batcher.complete(result_for('doc1', 3)), [])
+            batcher.add(vectors_for('doc2', 3))
+            settled = batcher.complete(result_for('doc2', 3))
+
+            self.assertEqual([(result.file_hash, result.error) for result in settled],
+                             [('doc1', 'index unavailable'), ('doc2', 'index unavailable')])
+            resumed = Checkpoint(checkpoint_path)
+            self.assertNotIn('doc1', resumed)
+            self.assertNotIn('doc2', resumed)
+
+
+class TestBulkReingestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.embedded, self.upserted, self.deleted = [], [], []
+        self.hash_index = DocumentHashIndex()
+        self.batcher = VectorBatcher(self.upserted.extend, Checkpoint(os.path.join(self.tmp.name, 'checkpoint.jsonl')),
+                                     batch_size=100, delete_fn=self.deleted.extend)
+
+    def tearDown(self):
+        self.hash_index.close()
+        self.tmp.cleanup()
+
+    def ingest(self, documents):
+        def embed(texts):
+            self.embedded.extend(texts)
+            return [[float(len(text))] for text in texts]
+
+        with IngestionEngine(embed, self.batcher.add, preprocessor_factory=line_chunker, max_workers=1,
+                             hash_index=DeferredHashIndex(self.hash_index, self.batcher),
+                             delete_fn=self.batcher.delete, versions_by_name=True) as engine:
+            results = [settled for result in engine.ingest(documents) for settled in self.batcher.complete(result)]
+        return results + self.batcher.flush()
+
+    def test_changed_file_replaces_the_stored_version(self):
+        first, = self.ingest([('contracts/memo.txt', b'intro\nold clause')])
+        self.embedded.clear()
+        second, = self.ingest([('contracts/memo.txt', b'intro\nnew clause')])
+
+        self.assertTrue(second.ok)
+        # Only the changed chunk is embedded, and the replaced one is deleted
+        self.assertEqual(self.embedded, ['new clause'])
+        doc_id = document_id('contracts/memo.txt')
+        self.assertEqual(self.deleted, [vector_id(doc_id, content_hash('old clause'))])
+        self.assertEqual(self.hash_index.document_chunks(doc_id), [content_hash('intro'), content_hash('new clause')])
+        self.assertFalse(self.hash_index.has_document(first.file_hash))
+        self.assertTrue(self.hash_index.has_document(second.file_hash))
+
+    def test_documents_are_recorded_once_their_vectors_are_stored(self):
+        self.batcher.batch_size = 1000
+        with IngestionEngine(lambda texts: [[1.0] for _ in texts], self.batcher.add, preprocessor_factory=line_chunker,
+                             max_workers=1, hash_index=DeferredHashIndex(self.hash_index, self.batcher),
+                             versions_by_name=True) as engine:
+            result, = engine.ingest([('memo.txt', b'intro')])
+        # An interrupted run must not leave it recorded without its vectors
+        self.assertFalse(self.hash_index.has_document(result.file_hash))
+        self.batcher.flush()
+        self.assertTrue(self.hash_index.has_document(result.file_hash))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import re
+import time
+import unittest
+
+from src.chunking import (iter_section_chunks, iter_segments, iter_stream_section_chunks, iter_stream_segments,
+                          iter_token_windows)
+
+
+class WordTokenizer:
+    """Minimal stand-in for a Hugging Face tokenizer: one token per word."""
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {'input_ids': [text.split() for text in texts]}
+
+
+class NewlineTokenizer(WordTokenizer):
+    """Like WordTokenizer, with a token for every newline."""
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {'input_ids': [re.findall(r'\S+|\n', text) for text in texts]}
+
+
+class TestIterTokenWindows(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = WordTokenizer()
+        self.text = ' '.join(f'w{i}' for i in range(25))
+
+    def test_covers_whole_text_without_truncation(self):
+        chunks = list(iter_token_windows(self.text, self.tokenizer, chunk_size=12))
+        self.assertEqual([len(chunk.text.split()) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(' '.join(chunk.text for chunk in chunks), self.text)
+
+    def test_offsets_point_into_source_text(self):
+        text = 'Section 1\n\n  First clause.  Second clause.\n'
+        for chunk in iter_token_windows(text, self.tokenizer, chunk_size=5):
+            self.assertEqual(text[chunk.start:chunk.end], chunk.text)
+
+    def test_overlap_repeats_trailing_tokens(self):
+        chunks = list(iter_token_windows(self.text, self.tokenizer, chunk_size=12, overlap=3))
+        self.assertEqual(chunks[0].text.split()[-3:], chunks[1].text.split()[:3])
+        self.assertEqual(chunks[-1].text.split()[-1], 'w24')
+
+    def test_is_lazy(self):
+        chunks = iter_token_windows(self.text * 1000, self.tokenizer, chunk_size=12)
+        self.assertEqual(len(next(chunks).text.split()), 10)
+
+    def test_rejects_overlap_larger_than_budget(self):
+        with self.assertRaises(ValueError):
+            list(iter_token_windows(self.text, self.tokenizer, chunk_size=12, overlap=10))
+
+
+MEMO = """MEMORANDUM
+
+Section 1 Definitions
+In this memo the Claimant means the buyer.
+
+Section 2 Limitation
+The limitation period is six years from breach.
+- Contract claims run from breach.
+- Tort claims run from damage.
+"""
+
+
+class TestIterSectionChunks(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = WordTokenizer()
+
+    def test_segments_keep_offsets(self):
+        for segment, start, end in iter_segments(MEMO):
+            self.assertEqual(MEMO[start:end], segment)
+
+    def test_each_section_starts_a_new_chunk(self):
+        chunks = list(iter_section_chunks(MEMO, self.tokenizer, chunk_size=100))
+        self.assertEqual([chunk.section for chunk in chunks],
+                         [None, 'Section 1 Definitions', 'Section 2 Limitation'])
+        self.assertTrue(chunks[2].text.startswith('Section 2 Limitation'))
+        self.assertTrue(chunks[2].text.endswith('run from damage.'))
+        for chunk in chunks:
+            self.assertEqual(MEMO[chunk.start:chunk.end], chunk.text)
+
+    def test_segments_are_packed_until_budget_is_reached(self):
+        chunks = list(iter_section_chunks(MEMO, self.tokenizer, chunk_size=14))
+        section_2 = [chunk.text for chunk in chunks if chunk.section == 'Section 2 Limitation']
+        self.assertEqual(section_2, ['Section 2 Limitation\nThe limitation period is six years from breach.',
+                                     '- Contract claims run from breach.\n- Tort claims run from damage.'])
+
+    def test_whitespace_between_segments_counts_towards_the_budget(self):
+        tokenizer = NewlineTokenizer()
+        for chunk_size in (8, 14, 30):
+            for chunk in iter_section_chunks(MEMO, tokenizer, chunk_size):
+                n_tokens = len(tokenizer([chunk.text])['input_ids'][0])
+                self.assertEqual(chunk.tokens, n_tokens)
+                self.assertLessEqual(n_tokens, chunk_size - 2)
+
+    def test_oversized_segment_is_split(self):
+        text = 'Section 1 Scope\n' + ' '.join(f'w{i}' for i in range(30))
+        chunks = list(iter_section_chunks(text, self.tokenizer, chunk_size=12))
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(all(len(chunk.text.split()) <= 10 for chunk in chunks))
+        self.assertTrue(all(chunk.section == 'Section 1 Scope' for chunk in chunks))
+
+    def test_stream_gives_the_same_chunks(self):
+        # Blocks split inside sections, before headings and within a run of breaks
+        blocks = ['MEMORANDUM', '', 'Section 1 Definitions\nIn this memo the Claimant', 'means the buyer.\n',
+                  'Section 2 Limitation\nThe limitation period is six years from breach.', '- Contract claims run',
+                  ' from breach.\n- Tort claims run from damage.', '']
+        text = '\n'.join(blocks)
+        for chunk_size in (8, 14, 100):
+            chunks = list(iter_stream_section_chunks(blocks, self.tokenizer, chunk_size))
+            self.assertEqual(chunks, list(iter_section_chunks(text, self.tokenizer, chunk_size)))
+            for chunk in chunks:
+                self.assertEqual(text[chunk.start:chunk.end], chunk.text)
+
+    def test_stream_is_lazy(self):
+        def blocks():
+            yield from MEMO.split('\n')
+            raise AssertionError('read past the first chunk')
+        chunks = iter_stream_section_chunks(blocks(), self.tokenizer, chunk_size=100, batch_size=1)
+        self.assertEqual(next(chunks).text, 'MEMORANDUM')
+
+    def test_stream_without_breaks_is_segmented_in_linear_time(self):
+        # Lines of running text, e.g. .docx paragraphs, with no section break between them
+        def seconds(lines):
+            blocks = [f'The buyer shall give notice of claim {i} in writing.' for i in range(lines)]
+            start = time.perf_counter()
+            segments = list(iter_stream_segments(blocks))
+            elapsed = time.perf_counter() - start
+            self.assertEqual([segment for segment, _, _, _ in segments], ['\n'.join(blocks)])
+            return elapsed
+
+        seconds(1000)
+        # Quadratic work would take about 16 times as long for 4 times the lines
+        self.assertLess(seconds(20000), 8 * seconds(5000) + 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
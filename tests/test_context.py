@@ -0,0 +1,70 @@
+import unittest
+
+from src.context import MIN_TRUNCATED_TOKENS, ContextBuilder, format_match
+
+
+def match(text, score=0.5, file_name='memo.txt', **metadata):
+    return {'id': text, 'score': score, 'metadata': dict(text=text, file_name=file_name, **metadata)}
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class TestContextBuilder(unittest.TestCase):
+    def setUp(self):
+        self.builder = ContextBuilder(token_budget=100, count_tokens=count_words)
+
+    def test_drops_duplicate_and_overlapping_chunks(self):
+        matches = [
+            match('The limitation period for contract claims is six years', 0.9,
+                  document_id='d1', start=0, end=60),
+            match('The limitation period for contract claims is six years', 0.8, file_name='copy.txt'),
+            match('limitation period for contract claims is six years from breach', 0.7,
+                  document_id='d1', start=4, end=70),
+            match('Tort claims run from the date of damage', 0.6, document_id='d1', start=200, end=240),
+        ]
+        kept = self.builder.deduplicate(matches)
+        self.assertEqual([m['score'] for m in kept], [0.9, 0.6])
+
+    def test_rerank_prefers_diverse_relevant_chunks(self):
+        matches = [
+            match('limitation period for contract claims is six years', 0.90),
+            match('limitation period for contract claims is six years long', 0.89),
+            match('contract claims by minors are suspended until majority', 0.85),
+        ]
+        builder = ContextBuilder(count_tokens=count_words, diversity=0.5)
+        reranked = builder.rerank('limitation period contract claims', matches)
+        self.assertEqual([m['score'] for m in reranked], [0.90, 0.85, 0.89])
+
+    def test_packs_within_token_budget(self):
+        matches = [match('one two three four five', 0.9), match('a ' * 200, 0.8), match('six seven', 0.7)]
+        builder = ContextBuilder(token_budget=12, count_tokens=count_words)
+        context, selected = builder.build('one', matches)
+        self.assertEqual([m['score'] for m in selected], [0.9, 0.7])
+        self.assertEqual(context, ' '.join(format_match(m) for m in selected))
+        self.assertLessEqual(count_words(context), 12)
+
+    def test_match_larger_than_the_budget_is_truncated(self):
+        # A full-size structure chunk is longer than the whole context budget
+        large = ' '.join(f'w{i}' for i in range(2 * MIN_TRUNCATED_TOKENS))
+        matches = [match('one two three', 0.9), match(large, 0.8), match('six seven', 0.7)]
+        builder = ContextBuilder(token_budget=MIN_TRUNCATED_TOKENS + 20, count_tokens=count_words)
+        context, selected = builder.build('one', matches)
+
+        self.assertEqual([m['score'] for m in selected], [0.9, 0.8])
+        self.assertTrue(large.startswith(selected[1]['metadata']['text']))
+        self.assertGreaterEqual(count_words(selected[1]['metadata']['text']), MIN_TRUNCATED_TOKENS)
+        self.assertEqual(count_words(context), builder.token_budget)
+        # The stored match is not modified
+        self.assertEqual(matches[1]['metadata']['text'], large)
+
+    def test_cached_embeddings_measure_redundancy(self):
+        embeddings = {'alpha': [1.0, 0.0], 'beta': [1.0, 0.0], 'gamma': [0.0, 1.0]}
+        builder = ContextBuilder(count_tokens=count_words, diversity=0.5, embedding_lookup=embeddings.get)
+        reranked = builder.rerank('query', [match('alpha', 0.9), match('beta', 0.85), match('gamma', 0.8)])
+        self.assertEqual([m['id'] for m in reranked], ['alpha', 'gamma', 'beta'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,14 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
 from io import BytesIO
-from src.data_loader import read_file
+from unittest import mock
+
+from benchmarks.corpus import memo, render
+from src import data_loader
+from src.data_loader import iter_blocks, read_file
 
 class TestReadFile(unittest.TestCase):
     def test_loading(self):
@@ -9,5 +17,70 @@ class TestReadFile(unittest.TestCase):
         self.assertIsNotNone(result)
         self.assertEqual(result, "Test content")
 
+    def test_sources_agree(self):
+        for extension in ('.txt', '.docx', '.pdf'):
+            content = render(memo(0), extension)
+            with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as file:
+                file.write(content)
+            try:
+                from_path = read_file(file.name, 'memo' + extension)
+            finally:
+                os.unlink(file.name)
+            self.assertEqual(read_file(BytesIO(content), 'memo' + extension), from_path)
+            self.assertEqual(read_file(content, 'memo' + extension), from_path)
+            self.assertIn('Section', from_path)
+
+    def test_unsupported_extension(self):
+        with self.assertRaises(ValueError):
+            read_file(BytesIO(b'\x89PNG'), 'image.png')
+
+class TestIterBlocks(unittest.TestCase):
+    def test_offsets_point_into_joined_text(self):
+        for extension in ('.txt', '.docx', '.pdf'):
+            blocks = list(iter_blocks(render(memo(1), extension), 'memo' + extension))
+            text = '\n'.join(block.text for block in blocks)
+            for block in blocks:
+                self.assertEqual(text[block.start:block.start + len(block.text)], block.text)
+
+    def test_text_lines_keep_empty_lines(self):
+        blocks = list(iter_blocks(b'first\n\nlast\n', 'memo.txt'))
+        self.assertEqual([block.text for block in blocks], ['first', '', 'last', ''])
+        self.assertEqual([block.start for block in blocks], [0, 6, 7, 12])
+
+    def test_empty_file_on_disk(self):
+        with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as file:
+            pass
+        try:
+            self.assertEqual(read_file(file.name, 'empty.txt'), '')
+        finally:
+            os.unlink(file.name)
+
+    def test_pdf_pages_are_extracted_in_parallel(self):
+        content = render(memo(2, paragraphs=40), '.pdf')
+        sequential = list(iter_blocks(content, 'memo.pdf'))
+        self.assertGreater(len(sequential), 2)
+        with mock.patch.object(data_loader, 'PARALLEL_PDF_MIN_PAGES', 2), \
+                mock.patch.object(data_loader, 'PDF_PAGES_PER_TASK', 1):
+            parallel = list(iter_blocks(content, 'memo.pdf', workers=2))
+        self.assertEqual(parallel, sequential)
+        self.assertEqual([block.page for block in parallel], list(range(len(parallel))))
+
+    def test_threads_share_one_pdf_pool(self):
+        def slow_pool(**kwargs):
+            # Widens the window in which another thread could create a second pool
+            time.sleep(0.05)
+            return mock.Mock()
+
+        pools = []
+        with mock.patch.object(data_loader, '_pdf_pool', None), mock.patch.object(data_loader, '_pdf_pool_workers', 0), \
+                mock.patch.object(data_loader, 'ProcessPoolExecutor', side_effect=slow_pool) as executor:
+            threads = [threading.Thread(target=lambda: pools.append(data_loader._get_pdf_pool(2))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(executor.call_count, 1)
+        self.assertEqual(len({id(pool) for pool in pools}), 1)
+
 if __name__ == '__main__':
     unittest.main()
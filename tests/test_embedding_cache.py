@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from src.utils.embedding_cache import EmbeddingCache, cache_key
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_key_ignores_whitespace_but_not_model(self):
+        self.assertEqual(cache_key("limitation  period\n", "m"), cache_key("limitation period", "m"))
+        self.assertNotEqual(cache_key("limitation period", "a"), cache_key("limitation period", "b"))
+
+    def test_hit_and_miss_counters(self):
+        cache = EmbeddingCache()
+        self.assertIsNone(cache.get("text", "m"))
+        cache.put("text", "m", [0.5, 0.25])
+        self.assertEqual(cache.get("text", "m"), [0.5, 0.25])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_peek_leaves_counters_and_order_alone(self):
+        cache = EmbeddingCache(max_entries=2)
+        cache.put("a", "m", [1.0])
+        cache.put("b", "m", [2.0])
+        self.assertEqual(cache.peek("a", "m"), [1.0])
+        self.assertIsNone(cache.peek("missing", "m"))
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (0, 0))
+        # "a" was not promoted by the peek, so it is still the one evicted
+        cache.put("c", "m", [3.0])
+        self.assertIsNone(cache.peek("a", "m"))
+
+    def test_lru_eviction(self):
+        cache = EmbeddingCache(max_entries=2)
+        cache.put("a", "m", [1.0])
+        cache.put("b", "m", [2.0])
+        cache.get("a", "m")
+        cache.put("c", "m", [3.0])
+        self.assertIsNone(cache.get("b", "m"))
+        self.assertEqual(cache.get("a", "m"), [1.0])
+
+    def test_persistent_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "embeddings.sqlite")
+            EmbeddingCache(path=path).put("memo", "m", [0.5, -1.0])
+            cache = EmbeddingCache(path=path)
+            self.assertEqual(cache.get("memo", "m"), [0.5, -1.0])
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
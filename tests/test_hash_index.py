@@ -0,0 +1,50 @@
+import unittest
+
+from src.utils.hash_index import DocumentHashIndex, SimHasher, content_hash, simhash
+
+MEMO = ' '.join(f"Clause {i}. The limitation period for claim {i} is {i % 7 + 1} years from the date of breach, "
+                f"and notice must be served on party {i % 13} in writing." for i in range(100))
+
+
+class TestDocumentHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = DocumentHashIndex()
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_exact_duplicates(self):
+        self.assertFalse(self.index.has_document('abc'))
+        self.index.add_document('abc', 'memo.txt', [content_hash('chunk one'), content_hash('chunk two')])
+        self.assertTrue(self.index.has_document('abc'))
+
+    def test_near_duplicates(self):
+        self.index.add_document('abc', 'memo.txt', [], simhash(MEMO))
+        edited = MEMO.replace('Clause 42. The limitation period', 'Clause 42. The agreed limitation period')
+        unrelated = "Completion takes place on the tenth business day after all conditions are satisfied or waived."
+
+        self.assertEqual(self.index.find_near_duplicate(simhash(edited))['file_name'], 'memo.txt')
+        self.assertIsNone(self.index.find_near_duplicate(simhash(unrelated)))
+
+    def test_identical_text_has_distance_zero(self):
+        self.index.add_document('abc', 'memo.txt', [], simhash(MEMO))
+        self.assertEqual(self.index.find_near_duplicate(simhash(MEMO))['distance'], 0)
+
+
+class TestSimHasher(unittest.TestCase):
+    def test_streamed_blocks_match_the_joined_text(self):
+        blocks = MEMO.split('. ')
+        hasher = SimHasher()
+        for block in blocks:
+            hasher.update(block)
+        self.assertEqual(hasher.digest(), simhash('\n'.join(blocks)))
+
+    def test_short_text(self):
+        hasher = SimHasher()
+        hasher.update('Six')
+        hasher.update('years')
+        self.assertEqual(hasher.digest(), simhash('Six\nyears'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import re
+import unittest
+from types import SimpleNamespace
+
+from src.chunking import TextChunk
+from src.ingestion import IngestionEngine, reindex_document
+from src.utils.hash_index import DocumentHashIndex, document_id
+
+
+class LineChunker:
+    """Stand-in for FileTextPreprocessor: one chunk per line."""
+
+    def process(self, text, outputs=None):
+        chunks, start = [], 0
+        for line in text.split('\n'):
+            chunks.append(TextChunk(line, start, start + len(line)))
+            start += len(line) + 1
+        return SimpleNamespace(chunks=chunks)
+
+    def iter_stream_chunks(self, blocks):
+        return iter(self.process('\n'.join(blocks)).chunks)
+
+    def tokenize_text(self, text):
+        return re.findall(r'\w+', text.lower())
+
+    def tokenize_texts(self, texts):
+        return [self.tokenize_text(text) for text in texts]
+
+
+def line_chunker():
+    return LineChunker()
+
+
+class TestIngestionEngine(unittest.TestCase):
+    def setUp(self):
+        self.upserted = []
+        self.engine = IngestionEngine(
+            embed_fn=lambda texts: [[float(len(text))] for text in texts],
+            upsert_fn=self.upserted.extend,
+            preprocessor_factory=line_chunker,
+            max_workers=2,
+            hash_index=DocumentHashIndex(),
+        )
+
+    def tearDown(self):
+        self.engine.close()
+
+    def test_ingests_every_document(self):
+        documents = [(f'memo_{i}.txt', f'first line {i}\nsecond line'.encode()) for i in range(5)]
+        progress = []
+        results = self.engine.ingest(documents, on_progress=progress.append)
+
+        self.assertEqual(sorted(result.file_name for result in results), sorted(name for name, _ in documents))
+        self.assertEqual(progress, results)
+        self.assertTrue(all(result.ok and result.chunks == 2 for result in results))
+        self.assertEqual(len(self.upserted), 10)
+        self.assertEqual(len({vector['id'] for vector in self.upserted}), 10)
+
+    def test_failures_do_not_abort_the_batch(self):
+        documents = [('memo.txt', b'fine'), ('image.png', b'\x89PNG'), ('other.txt', b'also fine')]
+        results = {result.file_name: result for result in self.engine.ingest(documents)}
+
+        self.assertTrue(results['memo.txt'].ok)
+        self.assertTrue(results['other.txt'].ok)
+        self.assertIn('Unsupported file extension', results['image.png'].error)
+
+    def test_unchanged_documents_are_skipped_before_parsing(self):
+        self.engine.ingest([('memo.txt', b'first line\nsecond line')])
+        embed_calls = []
+        self.engine.embed_fn = lambda texts: embed_calls.append(texts)
+
+        results = self.engine.ingest([('memo copy.txt', b'first line\nsecond line')])
+
+        self.assertTrue(results[0].duplicate)
+        self.assertEqual(embed_calls, [])
+        self.assertEqual(len(self.upserted), 2)
+
+
+class TestReindexDocument(unittest.TestCase):
+    def setUp(self):
+        self.index = DocumentHashIndex()
+        self.embedded, self.upserted, self.deleted = [], {}, []
+
+    def reindex(self, file_hash, lines, doc_id=document_id('contracts/memo.txt')):
+        chunks = LineChunker().process('\n'.join(lines)).chunks
+
+        def upsert(vectors):
+            self.upserted.update((vector['id'], vector) for vector in vectors)
+
+        def delete(ids):
+            self.deleted.extend(ids)
+            for vector_id in ids:
+                del self.upserted[vector_id]
+
+        def embed(texts):
+            self.embedded.extend(texts)
+            return [[0.0] for _ in texts]
+
+        return reindex_document(file_hash, 'memo.txt', chunks, self.index, embed, upsert, delete, doc_id=doc_id)
+
+    def test_only_changed_chunks_are_embedded(self):
+        self.reindex('v1', ['intro', 'clause one', 'clause two'])
+        first_ids = set(self.upserted)
+        self.embedded.clear()
+
+        stats = self.reindex('v2', ['intro', 'clause one (amended)', 'clause two', 'clause three'])
+
+        self.assertEqual(stats, (2, 2, 1))
+        self.assertEqual(self.embedded, ['clause one (amended)', 'clause three'])
+        self.assertEqual(len(self.deleted), 1)
+        self.assertEqual(len(self.upserted), 4)
+        self.assertEqual(len(first_ids & set(self.upserted)), 2)
+        self.assertEqual({vector['metadata']['document_id'] for vector in self.upserted.values()}, {
+            next(iter(self.upserted.values()))['metadata']['document_id']})
+
+    def test_new_version_replaces_old_one_in_the_index(self):
+        self.reindex('v1', ['intro'])
+        self.reindex('v2', ['intro', 'more'])
+        self.assertFalse(self.index.has_document('v1'))
+        self.assertTrue(self.index.has_document('v2'))
+
+    def test_unrelated_files_with_the_same_name_are_kept(self):
+        # No document ID: two uploads that happen to share a name are separate documents
+        self.reindex('first', ['intro', 'clause one'], doc_id=None)
+        stats = self.reindex('second', ['preamble'], doc_id=None)
+        self.assertEqual(stats, (1, 0, 0))
+        self.assertEqual(self.deleted, [])
+        self.assertEqual(len(self.upserted), 3)
+        self.assertTrue(self.index.has_document('first'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from src.ingestion import IngestionWorker
+from src.utils.bm25_index import BM25Index
+from src.utils.hash_index import DocumentHashIndex
+from src.utils.job_queue import DONE, DUPLICATE, FAILED, QUEUED, RUNNING, JobQueue, LeaseLost
+from tests.test_ingestion import line_chunker
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue(lease_seconds=60, max_attempts=2, retry_delay=0)
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_enqueue_is_idempotent(self):
+        job = self.queue.enqueue('memo.txt', b'first line')
+        self.assertEqual(job.status, QUEUED)
+        self.assertEqual(self.queue.enqueue('memo copy.txt', b'first line').id, job.id)
+        self.assertNotEqual(self.queue.enqueue('other.txt', b'other').id, job.id)
+        self.assertEqual(self.queue.content(job.id), b'first line')
+
+    def test_document_key_is_kept_with_the_job(self):
+        self.assertIsNone(self.queue.enqueue('memo.txt', b'first line').document_key)
+        job = self.queue.enqueue('memo.txt', b'second line', document_key='contracts/memo.txt')
+        self.assertEqual(self.queue.claim().document_key, None)
+        self.assertEqual(self.queue.claim().document_key, 'contracts/memo.txt')
+        self.assertEqual(self.queue.get(job.id).document_key, 'contracts/memo.txt')
+
+    def test_finished_job_is_queued_again_once_its_document_is_no_longer_stored(self):
+        stored = set()
+        queue = JobQueue(is_stored=stored.__contains__)
+        try:
+            job = queue.enqueue('memo.txt', b'first line')
+            queue.complete(queue.claim(), DONE)
+            stored.add(job.file_hash)
+            self.assertEqual(queue.enqueue('memo.txt', b'first line').status, DONE)
+
+            # e.g. replaced by another version of the document
+            stored.clear()
+            requeued = queue.enqueue('memo.txt', b'first line')
+            self.assertEqual((requeued.id, requeued.status), (job.id, QUEUED))
+            self.assertEqual(queue.content(job.id), b'first line')
+        finally:
+            queue.close()
+
+    def test_claimed_job_is_held_until_completed(self):
+        job = self.queue.enqueue('memo.txt', b'first line')
+        claimed = self.queue.claim()
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (job.id, RUNNING, 1))
+        self.assertIsNone(self.queue.claim())
+
+        self.assertTrue(self.queue.heartbeat(claimed, 'embedding', 0.5))
+        self.assertEqual(self.queue.get(job.id).stage, 'embedding')
+        self.assertTrue(self.queue.complete(claimed, message='1 chunk'))
+        finished = self.queue.get(job.id)
+        self.assertEqual((finished.status, finished.progress, finished.message), (DONE, 1.0, '1 chunk'))
+        # The content is only kept until the job is done
+        self.assertIsNone(self.queue.content(job.id))
+
+    def test_failed_attempts_are_retried_then_given_up(self):
+        job = self.queue.enqueue('memo.txt', b'first line')
+        self.assertEqual(self.queue.fail(self.queue.claim(), 'reset'), QUEUED)
+        self.assertEqual(self.queue.fail(self.queue.claim(), 'reset'), FAILED)
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.get(job.id).error, 'reset')
+
+        # Uploading it again gives it a fresh set of attempts
+        self.assertEqual(self.queue.enqueue('memo.txt', b'first line').status, QUEUED)
+        self.assertEqual(self.queue.claim().attempts, 1)
+
+    def test_jobs_of_a_dead_worker_are_taken_over(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'jobs.sqlite')
+            crashed = JobQueue(path, lease_seconds=0.05)
+            job = crashed.enqueue('memo.txt', b'first line')
+            lost = crashed.claim()
+            crashed.close()
+
+            # A new process opens the queue after the lease expired
+            time.sleep(0.1)
+            recovered = JobQueue(path, lease_seconds=60)
+            claimed = recovered.claim()
+            self.assertEqual((claimed.id, claimed.attempts), (job.id, 2))
+            # The old worker can no longer finish it
+            self.assertFalse(recovered.complete(lost))
+            self.assertTrue(recovered.complete(claimed))
+            recovered.close()
+
+
+class TestIngestionWorker(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue(retry_delay=0)
+        self.upserted = []
+        self.worker = IngestionWorker(self.queue, lambda texts: [[float(len(text))] for text in texts],
+                                      self.upserted.extend, DocumentHashIndex(),
+                                      preprocessor_factory=line_chunker, workers=1)
+
+    def tearDown(self):
+        self.worker.stop()
+        self.queue.close()
+
+    def test_runs_queued_jobs(self):
+        job = self.queue.enqueue('memo.txt', b'first line\nsecond line')
+        other = self.queue.enqueue('other.txt', b'third line')
+        self.worker.start()
+        deadline = time.monotonic() + 60
+        while not all(queued.finished for queued in self.queue.jobs()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        finished = self.queue.get(job.id)
+        self.assertEqual(finished.status, DONE)
+        self.assertIn('2 embedded', finished.message)
+        self.assertEqual(self.queue.get(other.id).status, DONE)
+        self.assertEqual(len(self.upserted), 3)
+
+        # The same content uploaded again is not ingested twice
+        self.assertEqual(self.queue.enqueue('memo.txt', b'first line\nsecond line').id, job.id)
+
+    def test_already_ingested_documents_are_marked_duplicate(self):
+        self.worker.hash_index.add_document(self.queue.enqueue('memo.txt', b'first line').file_hash,
+                                            'memo.txt', [])
+        self.assertEqual(self.worker.run_once().status, DUPLICATE)
+        self.assertEqual(self.upserted, [])
+
+    def test_unreadable_documents_fail_after_retries(self):
+        job = self.queue.enqueue('image.png', b'\x89PNG')
+        statuses = [self.worker.run_once().status for _ in range(self.queue.max_attempts)]
+        self.assertEqual(statuses, [QUEUED] * (self.queue.max_attempts - 1) + [FAILED])
+        self.assertIsNotNone(self.queue.get(job.id).error)
+
+
+    def test_job_taken_over_by_another_worker_is_stopped(self):
+        job = self.queue.enqueue('memo.txt', b'first line')
+        # The lease is lost while the document is being parsed
+        with mock.patch.object(self.queue, 'heartbeat', side_effect=[True, False]):
+            with self.assertRaises(LeaseLost):
+                self.worker._process(self.queue.claim())
+        self.assertEqual(self.upserted, [])
+        self.assertFalse(self.worker.hash_index.has_document(job.file_hash))
+
+        # Neither completed nor failed: the job is left to the worker that took it over
+        other = self.queue.enqueue('other.txt', b'other line')
+        with mock.patch.object(self.queue, 'heartbeat', side_effect=[True, False]):
+            self.assertEqual(self.worker.run_once().status, RUNNING)
+        self.assertIsNone(self.queue.get(other.id).error)
+
+
+class TestSharedQueueFile(unittest.TestCase):
+    def test_each_consumer_runs_only_its_own_jobs(self):
+        # The Streamlit app and the legacy API share one queue file; only the app has a BM25 index
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'jobs.sqlite')
+            embed = lambda texts: [[float(len(text))] for text in texts]
+            app_queue, api_queue = JobQueue(path, 'streamlit'), JobQueue(path, 'legacy_api')
+            app_vectors, api_vectors = [], []
+            term_index = BM25Index()
+            workers = [IngestionWorker(app_queue, embed, app_vectors.extend, DocumentHashIndex(),
+                                       term_index=term_index, preprocessor_factory=line_chunker, workers=2,
+                                       poll_interval=0.01),
+                       IngestionWorker(api_queue, embed, api_vectors.extend, DocumentHashIndex(),
+                                       preprocessor_factory=line_chunker, workers=2, poll_interval=0.01)]
+            # Started before anything is queued, so both are polling when the jobs arrive
+            for worker in workers:
+                worker.start()
+            try:
+                app_jobs = [app_queue.enqueue(f'app_{i}.txt', f'app line {i}'.encode()) for i in range(4)]
+                api_job = api_queue.enqueue('api.txt', b'api line')
+                self.assertIsNone(api_queue.get(app_jobs[0].id))
+
+                deadline = time.monotonic() + 60
+                while time.monotonic() < deadline and not all(
+                        job.finished for job in app_queue.jobs() + api_queue.jobs()):
+                    time.sleep(0.05)
+            finally:
+                for worker in workers:
+                    worker.stop()
+
+            self.assertTrue(all(job.status == DONE for job in app_queue.jobs()))
+            self.assertEqual(api_queue.get(api_job.id).status, DONE)
+            self.assertEqual(sorted(vector['metadata']['file_name'] for vector in app_vectors),
+                             [f'app_{i}.txt' for i in range(4)])
+            self.assertEqual([vector['metadata']['file_name'] for vector in api_vectors], ['api.txt'])
+            # Every app upload reached the app's BM25 index
+            self.assertEqual(len(term_index), 4)
+            app_queue.close()
+            api_queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from src.utils import openai_utils
+
+
+def fake_create(input, model, **kwargs):
+    # Return items in reverse order to check results are reassembled by index
+    data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+    return SimpleNamespace(data=list(reversed(data)))
+
+
+class TestBatchTexts(unittest.TestCase):
+    def test_respects_batch_size(self):
+        batches = openai_utils.batch_texts(["a"] * 5, max_batch_size=2)
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+
+    def test_respects_token_budget(self):
+        texts = ["x" * 40, "x" * 40, "x" * 40]  # 10 estimated tokens each
+        batches = openai_utils.batch_texts(texts, max_batch_tokens=25)
+        self.assertEqual(batches, [[0, 1], [2]])
+
+    def test_oversized_text_gets_its_own_batch(self):
+        batches = openai_utils.batch_texts(["x" * 400, "y"], max_batch_tokens=10)
+        self.assertEqual(batches, [[0], [1]])
+
+
+class TestGetEmbeddings(unittest.TestCase):
+    def setUp(self):
+        openai_utils.embedding_cache.clear()
+
+    def test_results_follow_input_order(self):
+        texts = ["a" * n for n in range(1, 12)]
+        with mock.patch.object(openai_utils.get_client().embeddings, "create", side_effect=fake_create) as create:
+            embeddings = openai_utils.get_embeddings(texts, max_batch_size=3, max_workers=3)
+        self.assertEqual(create.call_count, 4)
+        self.assertEqual(embeddings, [[float(len(t))] for t in texts])
+
+    def test_empty_input_makes_no_requests(self):
+        with mock.patch.object(openai_utils.get_client().embeddings, "create") as create:
+            self.assertEqual(openai_utils.get_embeddings([]), [])
+        create.assert_not_called()
+
+    def test_cached_texts_are_not_re_embedded(self):
+        with mock.patch.object(openai_utils.get_client().embeddings, "create", side_effect=fake_create) as create:
+            openai_utils.get_embeddings(["first", "second"])
+            embeddings = openai_utils.get_embeddings(["second", "third"])
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(create.call_args.kwargs["input"], ["third"])
+        self.assertEqual(embeddings, [[6.0], [5.0]])
+
+    def test_dimensions_are_requested_and_cached_separately(self):
+        with mock.patch.object(openai_utils.get_client().embeddings, "create", side_effect=fake_create) as create:
+            openai_utils.get_embeddings(["first"], dimensions=256)
+            openai_utils.get_embeddings(["first"], dimensions=512)
+            openai_utils.get_embeddings(["first"], model="text-embedding-ada-002")
+        self.assertEqual([call.kwargs.get("dimensions") for call in create.call_args_list], [256, 512, None])
+
+    def test_async_batches_share_the_cache(self):
+        client = SimpleNamespace(embeddings=SimpleNamespace(create=mock.AsyncMock(side_effect=fake_create)))
+        with mock.patch.object(openai_utils, "get_async_client", return_value=client), \
+                mock.patch.object(openai_utils.get_client().embeddings, "create", side_effect=fake_create):
+            openai_utils.get_embeddings(["first"])
+            embeddings = asyncio.run(openai_utils.aget_embeddings(["first", "second", "third", "fourth"],
+                                                                  max_batch_size=2))
+        self.assertEqual([call.kwargs["input"] for call in client.embeddings.create.call_args_list],
+                         [["second", "third"], ["fourth"]])
+        self.assertEqual(embeddings, [[5.0], [6.0], [5.0], [6.0]])
+
+
+class TestStreamAnswer(unittest.TestCase):
+    def test_yields_fragments_as_they_arrive(self):
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+                  for content in ("Six", None, " years.")]
+        with mock.patch.object(openai_utils.get_client().chat.completions, "create", return_value=iter(chunks)) as create:
+            fragments = list(openai_utils.stream_answer("How long?", "The limitation period is six years."))
+        self.assertEqual(fragments, ["Six", " years."])
+        self.assertTrue(create.call_args.kwargs["stream"])
+
+    def test_empty_context_skips_the_model(self):
+        with mock.patch.object(openai_utils.get_client().chat.completions, "create") as create:
+            fragments = list(openai_utils.stream_answer("How long?", "  "))
+        self.assertEqual(fragments, [openai_utils.NO_CONTEXT_ANSWER])
+        create.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
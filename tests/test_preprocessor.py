@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+
+from src.preprocessor import FastTokenizer, FileTextPreprocessor, PIPELINE_STAGES, load_tokenizer, setup_nltk
+
+
+class WordTokenizer:
+    """Minimal stand-in for a Hugging Face tokenizer: one token per word."""
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {'input_ids': [text.split() for text in texts]}
+
+
+class TestPreprocessPipeline(unittest.TestCase):
+    def setUp(self):
+        # Avoid depending on downloaded NLTK corpora
+        stopwords = mock.Mock(**{'words.return_value': ['the']})
+        with mock.patch('src.preprocessor.stopwords', new=stopwords), mock.patch('src.preprocessor.WordNetLemmatizer'):
+            self.preprocessor = FileTextPreprocessor(WordTokenizer(), chunk_size=50, chunking='structure')
+        self.text = 'Section 1 Scope\nThe buyer pays.\n\nSection 2 Term\nSix years.'
+
+    def test_only_requested_stages_run(self):
+        with mock.patch.object(self.preprocessor, 'tokenize_text') as tokenize_text:
+            document = self.preprocessor.process(self.text, outputs=('chunks',))
+        tokenize_text.assert_not_called()
+        self.assertEqual(set(document.timings), {'cleaned_text', 'chunks'})
+        self.assertEqual([chunk.section for chunk in document.chunks], ['Section 1 Scope', 'Section 2 Term'])
+
+    def test_stages_are_memoized(self):
+        document = self.preprocessor.process(self.text)
+        with mock.patch.object(self.preprocessor, 'clean_special_characters',
+                               wraps=self.preprocessor.clean_special_characters) as clean:
+            document.structured_text
+            document.chunks
+        clean.assert_called_once()
+
+    def test_preprocess_doc_keeps_its_tuple(self):
+        with mock.patch.object(self.preprocessor, 'tokenize_text', return_value=['buyer']):
+            result = self.preprocessor.preprocess_doc(self.text)
+        self.assertEqual(len(result), 1 + len(PIPELINE_STAGES))
+        self.assertEqual(result[3], ['buyer'])
+        self.assertTrue(all(isinstance(chunk, str) for chunk in result[5]))
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            self.preprocessor.process(self.text, outputs=('summary',))
+
+
+class TestTokenizeText(unittest.TestCase):
+    def setUp(self):
+        stopwords = mock.Mock(**{'words.return_value': ['the', 'of']})
+        with mock.patch('src.preprocessor.stopwords', new=stopwords), \
+                mock.patch('src.preprocessor.WordNetLemmatizer') as lemmatizer:
+            self.lemmatize = lemmatizer.return_value.lemmatize
+            self.lemmatize.side_effect = lambda word: word[:-1] if word.endswith('s') else word
+            self.preprocessor = FileTextPreprocessor(WordTokenizer())
+
+    def test_lowercases_filters_and_lemmatizes(self):
+        tokens = self.preprocessor.tokenize_text("The Buyer's claims under Section 4.2 of 42 U.S.C. § 1983.")
+        self.assertEqual(tokens, ["buyer'", 'claim', 'under', 'section', '4.2', '42', 'u.s.c', '.', '§', '1983', '.'])
+
+    def test_lemmas_are_memoized(self):
+        self.preprocessor.tokenize_text('claims Claims claims')
+        self.assertEqual(self.lemmatize.call_count, 1)
+
+    def test_batch_matches_single_texts(self):
+        texts = ['The claims', 'Section 2 of the lease', '']
+        self.assertEqual(self.preprocessor.tokenize_texts(texts),
+                         [self.preprocessor.tokenize_text(text) for text in texts])
+
+
+class TestColdStart(unittest.TestCase):
+    def make_tokenizer(self):
+        vocab = {'<s>': 0, '</s>': 1, '[UNK]': 2, 'six': 3, 'years': 4}
+        tokenizer = Tokenizer(models.WordLevel(vocab, unk_token='[UNK]'))
+        tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        tokenizer.post_processor = processors.TemplateProcessing(single='<s> $A </s>', pair='<s> $A </s> $B </s>',
+                                                                 special_tokens=[('<s>', 0), ('</s>', 1)])
+        return tokenizer
+
+    def test_fast_tokenizer_matches_the_chunker_interface(self):
+        tokenizer = FastTokenizer(self.make_tokenizer())
+        self.assertEqual(tokenizer(['six years', 'six'], add_special_tokens=False)['input_ids'], [[3, 4], [3]])
+        self.assertEqual(tokenizer(['six'])['input_ids'], [[0, 3, 1]])
+        self.assertEqual(tokenizer.num_special_tokens_to_add(pair=False), 2)
+
+    def test_baked_tokenizer_is_loaded_without_transformers(self):
+        with tempfile.TemporaryDirectory() as assets_dir:
+            self.make_tokenizer().save(os.path.join(assets_dir, 'tokenizer.json'))
+            with mock.patch.dict('sys.modules', {'transformers': None}):
+                tokenizer = load_tokenizer(assets_dir=assets_dir)
+        self.assertIsInstance(tokenizer, FastTokenizer)
+        self.assertEqual(tokenizer(['years'], add_special_tokens=False)['input_ids'], [[4]])
+
+    def test_setup_nltk_only_downloads_missing_resources(self):
+        def find(path):
+            if path == 'corpora/wordnet':
+                raise LookupError(path)
+
+        with mock.patch('nltk.data.find', side_effect=find), mock.patch('nltk.download') as download:
+            setup_nltk()
+        download.assert_called_once_with('wordnet', quiet=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from src.utils import openai_utils
+from src.utils.rate_limiter import (BULK, INTERACTIVE, RateLimitScheduler, TokenBucket, is_rate_limited,
+                                    retry_after, wait_retry_after)
+from src.utils.telemetry import metrics
+
+
+class TooManyRequests(Exception):
+    def __init__(self, headers):
+        super().__init__('Rate limit reached')
+        self.status_code = 429
+        self.response = SimpleNamespace(headers=headers)
+
+
+def one_per_tenth(service, name):
+    # Ten requests a second and a bucket holding one
+    return 600, 0
+
+
+class TestRetryAfter(unittest.TestCase):
+    def test_reads_seconds_milliseconds_and_dates(self):
+        self.assertEqual(retry_after(TooManyRequests({'Retry-After': '2'})), 2.0)
+        self.assertEqual(retry_after(TooManyRequests({'retry-after-ms': '250'})), 0.25)
+        self.assertEqual(retry_after(TooManyRequests({'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})), 0.0)
+        self.assertIsNone(retry_after(ValueError('no headers')))
+
+    def test_recognises_rate_limit_errors(self):
+        self.assertTrue(is_rate_limited(TooManyRequests({})))
+        self.assertTrue(is_rate_limited(SimpleNamespace(status=429)))
+        self.assertFalse(is_rate_limited(ConnectionError('reset')))
+
+    def test_wait_strategy_leaves_announced_delays_to_the_scheduler(self):
+        wait = wait_retry_after(lambda retry_state: 30.0)
+        state = lambda error: SimpleNamespace(outcome=SimpleNamespace(exception=lambda: error))
+        self.assertEqual(wait(state(TooManyRequests({'retry-after': '1'}))), 0.0)
+        self.assertEqual(wait(state(TooManyRequests({}))), 30.0)
+        self.assertEqual(wait(state(ConnectionError('reset'))), 30.0)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_delay_leaves_the_reserve(self):
+        bucket = TokenBucket(per_minute=600, burst_seconds=1)
+        self.assertEqual(bucket.capacity, 10)
+        self.assertEqual(bucket.delay(5), 0)
+        bucket.take(8)
+        self.assertAlmostEqual(bucket.delay(1), 0)
+        self.assertAlmostEqual(bucket.delay(1, reserve=0.2), 0.1)
+
+    def test_oversized_cost_waits_for_a_full_bucket(self):
+        bucket = TokenBucket(per_minute=600, burst_seconds=1)
+        bucket.take(5)
+        self.assertAlmostEqual(bucket.delay(50), 0.5)
+
+
+class TestRateLimitScheduler(unittest.TestCase):
+    def test_interactive_requests_go_before_waiting_bulk_ones(self):
+        scheduler = RateLimitScheduler(one_per_tenth, burst_seconds=0.1)
+        scheduler.acquire('openai', 'model', priority=BULK)
+        order = []
+
+        def request(priority, name):
+            scheduler.acquire('openai', 'model', priority=priority)
+            order.append(name)
+
+        bulk = threading.Thread(target=request, args=(BULK, 'bulk'))
+        bulk.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(target=request, args=(INTERACTIVE, 'interactive'))
+        interactive.start()
+        bulk.join()
+        interactive.join()
+        self.assertEqual(order, ['interactive', 'bulk'])
+
+    def test_requests_are_paced_at_the_limit(self):
+        scheduler = RateLimitScheduler(one_per_tenth, burst_seconds=0.1)
+
+        async def requests():
+            start = time.perf_counter()
+            await asyncio.gather(*(scheduler.aacquire('pinecone', 'query') for _ in range(4)))
+            return time.perf_counter() - start
+
+        self.assertGreaterEqual(asyncio.run(requests()), 0.29)
+
+    def test_retry_after_pauses_every_request(self):
+        scheduler = RateLimitScheduler(lambda service, name: (0, 0))
+        with self.assertRaises(TooManyRequests):
+            with scheduler.request('openai', 'model'):
+                raise TooManyRequests({'retry-after': '0.2'})
+        start = time.perf_counter()
+        scheduler.acquire('openai', 'model', priority=BULK)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)
+        self.assertGreaterEqual(metrics.value('luthor_rate_limited_total', service='openai', limit='model'), 1)
+
+    def test_settle_refunds_overestimated_tokens(self):
+        scheduler = RateLimitScheduler(lambda service, name: (0, 600), burst_seconds=1)
+        reservation = scheduler.acquire('openai', 'model', tokens=8)
+        reservation.settle(2)
+        # The refund is made with the next request
+        scheduler.acquire('openai', 'model')
+        bucket = scheduler._limit('openai', 'model').tokens
+        self.assertGreater(bucket.level, 7)
+
+
+class TestSharedLimits(unittest.TestCase):
+    # Two schedulers on one state file stand for two processes, e.g. the app and the API
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'limits.sqlite')
+        self.schedulers = [RateLimitScheduler(one_per_tenth, burst_seconds=0.1, state_path=self.path)
+                           for _ in range(2)]
+
+    def tearDown(self):
+        for scheduler in self.schedulers:
+            scheduler._state.close()
+        self.tmp.cleanup()
+
+    def test_processes_share_one_quota(self):
+        first, second = self.schedulers
+        start = time.perf_counter()
+        for _ in range(2):
+            first.acquire('openai', 'model')
+            second.acquire('openai', 'model')
+        # Four requests at ten a second, not two in each process at the same time
+        self.assertGreaterEqual(time.perf_counter() - start, 0.29)
+
+    def test_retry_after_pauses_other_processes(self):
+        first, second = self.schedulers
+        first.rejected('openai', 'model', TooManyRequests({'retry-after': '0.2'}))
+        start = time.perf_counter()
+        second.acquire('openai', 'model')
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)
+
+
+    def test_busy_state_file_does_not_hold_up_the_process(self):
+        first, _ = self.schedulers
+        first.acquire('openai', 'model')
+        holder = sqlite3.connect(self.path, isolation_level=None)
+        holder.execute('BEGIN IMMEDIATE')
+        try:
+            acquired = threading.Event()
+            thread = threading.Thread(target=lambda: (first.acquire('openai', 'model'), acquired.set()))
+            thread.start()
+            time.sleep(0.2)
+            self.assertFalse(acquired.is_set())
+            # The waiting request does not keep the scheduler locked meanwhile
+            start = time.perf_counter()
+            with first._condition:
+                pass
+            self.assertLess(time.perf_counter() - start, 0.1)
+        finally:
+            holder.execute('ROLLBACK')
+            holder.close()
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_async_requests_share_the_quota(self):
+        first, second = self.schedulers
+
+        async def requests():
+            for _ in range(2):
+                await first.aacquire('openai', 'model')
+                async with second.arequest('openai', 'model'):
+                    pass
+
+        start = time.perf_counter()
+        asyncio.run(requests())
+        self.assertGreaterEqual(time.perf_counter() - start, 0.29)
+
+
+class TestScheduledCalls(unittest.TestCase):
+    def setUp(self):
+        openai_utils.embedding_cache.clear()
+
+    def test_rate_limited_batch_is_retried_after_the_announced_delay(self):
+        responses = [TooManyRequests({'retry-after': '0.05'}),
+                     SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[1.0])])]
+
+        def create(**kwargs):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        with mock.patch.object(openai_utils, 'scheduler', RateLimitScheduler()), \
+                mock.patch.object(openai_utils.get_client().embeddings, 'create', side_effect=create):
+            start = time.perf_counter()
+            self.assertEqual(openai_utils.get_embeddings(['six years']), [[1.0]])
+        # Not the one-second minimum of the exponential backoff
+        self.assertLess(time.perf_counter() - start, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
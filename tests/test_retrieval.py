@@ -0,0 +1,51 @@
+import unittest
+
+from src.retrieval import HybridRetriever, is_exact_lookup, reciprocal_rank_fusion
+from src.utils.bm25_index import BM25Index
+
+
+def match(vector_id, score=0.5):
+    return {'id': vector_id, 'score': score, 'metadata': {'text': vector_id}}
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    def test_items_ranked_well_by_both_lists_win(self):
+        fused = reciprocal_rank_fusion([[match('a'), match('b'), match('c')], [match('b'), match('c')]])
+        self.assertEqual([m['id'] for m in fused], ['b', 'c', 'a'])
+        self.assertLessEqual(fused[0]['score'], 1.0)
+
+
+class TestHybridRetriever(unittest.TestCase):
+    def setUp(self):
+        index = BM25Index()
+        index.add([
+            ('s4', ['section', '4.2', 'force', 'majeure'], {'text': 'Section 4.2 Force Majeure applies'}),
+            ('s5', ['section', '5', 'majeure', 'force'], {'text': 'Majeure force under Section 5'}),
+        ])
+        self.vector_calls = []
+
+        def query_fn(vector, filters=None, top_k=5):
+            self.vector_calls.append(vector)
+            return [match('v1', 0.9), match('s5', 0.8)]
+
+        self.retriever = HybridRetriever(index, lambda text: text.lower().replace('"', '').split(), query_fn)
+
+    def test_detects_exact_lookups(self):
+        self.assertTrue(is_exact_lookup('What does Section 4.2 say?'))
+        self.assertTrue(is_exact_lookup('"force majeure"'))
+        self.assertFalse(is_exact_lookup('Can we terminate the contract early?'))
+
+    def test_exact_lookup_requires_the_phrase(self):
+        self.assertEqual([m['id'] for m in self.retriever.exact_lookup('"force majeure"')], ['s4'])
+        self.assertIsNone(self.retriever.exact_lookup('"force majeure clause"'))
+        self.assertIsNone(self.retriever.exact_lookup('force majeure'))
+
+    def test_search_fuses_vector_and_lexical_results(self):
+        matches = self.retriever.search('force majeure', [0.1, 0.2], top_k=3)
+        self.assertEqual(self.vector_calls, [[0.1, 0.2]])
+        self.assertEqual(matches[0]['id'], 's5')
+        self.assertEqual({m['id'] for m in matches}, {'v1', 's4', 's5'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from tenacity import retry, stop_after_attempt, wait_none
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from src.utils import openai_utils, telemetry
+from src.utils.embedding_cache import EmbeddingCache
+from src.utils.telemetry import metrics, record_retry, span
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def test_renders_prometheus_text(self):
+        metrics.inc('luthor_api_calls_total', service='openai', operation='chat')
+        metrics.observe('luthor_stage_duration_seconds', 0.02, stage='embed')
+        metrics.observe('luthor_stage_duration_seconds', 100, stage='embed')
+        text = metrics.render()
+        self.assertIn('# TYPE luthor_api_calls_total counter', text)
+        self.assertIn('luthor_api_calls_total{operation="chat",service="openai"} 1', text)
+        self.assertIn('luthor_stage_duration_seconds_bucket{stage="embed",le="0.01"} 0', text)
+        self.assertIn('luthor_stage_duration_seconds_bucket{stage="embed",le="0.025"} 1', text)
+        self.assertIn('luthor_stage_duration_seconds_bucket{stage="embed",le="+Inf"} 2', text)
+        self.assertIn('luthor_stage_duration_seconds_count{stage="embed"} 2', text)
+
+    def test_span_records_duration_errors_and_nesting(self):
+        with span('rerank') as outer:
+            with span('lexical') as inner:
+                self.assertIs(inner.parent, outer)
+        with self.assertRaises(ValueError):
+            with span('read'):
+                raise ValueError('unsupported')
+        self.assertGreaterEqual(outer.duration, inner.duration)
+        self.assertEqual(metrics.value('luthor_stage_duration_seconds', stage='rerank'), 1)
+        self.assertEqual(metrics.value('luthor_stage_errors_total', stage='read', error='ValueError'), 1)
+
+    def test_retries_are_counted(self):
+        calls = []
+
+        @retry(wait=wait_none(), stop=stop_after_attempt(3), before_sleep=record_retry)
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ConnectionError('reset')
+            return 'ok'
+
+        with self.assertLogs(telemetry.logger, 'WARNING'):
+            self.assertEqual(flaky(), 'ok')
+        self.assertEqual(metrics.value('luthor_api_retries_total', function='flaky'), 2)
+
+    def test_cache_lookups_are_counted(self):
+        cache = EmbeddingCache()
+        cache.get('six years', 'model')
+        cache.put('six years', 'model', [1.0])
+        cache.get('six years', 'model')
+        self.assertEqual(metrics.value('luthor_cache_requests_total', cache='embedding', result='hit'), 1)
+        self.assertEqual(metrics.value('luthor_cache_requests_total', cache='embedding', result='miss'), 1)
+
+    def test_streamed_answer_reports_tokens(self):
+        usage = SimpleNamespace(prompt_tokens=120, completion_tokens=2)
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='Six years.'))], usage=None),
+                  SimpleNamespace(choices=[], usage=usage)]
+        with mock.patch.object(openai_utils.get_client().chat.completions, "create", return_value=iter(chunks)):
+            self.assertEqual(''.join(openai_utils.stream_answer('How long?', 'Six years.')), 'Six years.')
+        self.assertEqual(metrics.value('luthor_tokens_total', model='gpt-4o-mini', type='prompt'), 120)
+        self.assertEqual(metrics.value('luthor_tokens_total', model='gpt-4o-mini', type='completion'), 2)
+        self.assertEqual(metrics.value('luthor_api_calls_total', service='openai', operation='chat'), 1)
+        self.assertEqual(metrics.value('luthor_stage_duration_seconds', stage='generate'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src.utils import pinecone_utils
+from src.utils.vector_store import LocalVectorStore, dequantize, hnswlib, matches_filter, quantize
+
+
+def vector(vector_id, values, **metadata):
+    return {'id': vector_id, 'values': values, 'metadata': metadata}
+
+
+class TestMatchesFilter(unittest.TestCase):
+    def test_create_filters_syntax(self):
+        metadata = {'doc_type': 'memo', 'legal_area': 'tax', 'date': '2024-03-01'}
+        self.assertTrue(matches_filter(metadata, {'doc_type': {'$in': ['memo', 'contract']}, 'legal_area': 'tax'}))
+        self.assertTrue(matches_filter(metadata, {'date': {'$gte': '2024-01-01', '$lte': '2024-12-31'}}))
+        self.assertFalse(matches_filter(metadata, {'legal_area': 'employment'}))
+        self.assertFalse(matches_filter({}, {'date': {'$gte': '2024-01-01'}}))
+        self.assertTrue(matches_filter(metadata, {'$or': [{'legal_area': 'employment'}, {'doc_type': 'memo'}]}))
+
+
+class TestLocalVectorStore(unittest.TestCase):
+    def setUp(self):
+        self.store = LocalVectorStore(dimension=3, initial_capacity=2)
+        self.store.upsert([
+            vector('a', [1, 0, 0], doc_type='memo'),
+            vector('b', [0.9, 0.1, 0], doc_type='contract'),
+            vector('c', [0, 1, 0], doc_type='memo'),
+        ])
+
+    def test_cosine_top_k(self):
+        matches = self.store.query([1, 0, 0], top_k=2)
+        self.assertEqual([match['id'] for match in matches], ['a', 'b'])
+        self.assertAlmostEqual(matches[0]['score'], 1.0, places=5)
+
+    def test_filters(self):
+        matches = self.store.query([1, 0, 0], filters={'doc_type': 'memo'}, top_k=5)
+        self.assertEqual([match['id'] for match in matches], ['a', 'c'])
+
+    def test_upsert_overwrites_and_delete_removes(self):
+        self.store.upsert([vector('a', [0, 0, 1], doc_type='memo')])
+        self.store.delete(['b', 'missing'])
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.query([0, 0, 1], top_k=1)[0]['id'], 'a')
+        self.assertNotIn('b', [match['id'] for match in self.store.query([1, 0, 0], top_k=5)])
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalVectorStore(path=tmp, dimension=3, initial_capacity=1)
+            store.upsert([vector('a', [1, 0, 0], text='first'), vector('b', [0, 1, 0], text='second')])
+            store.delete(['a'])
+            reopened = LocalVectorStore(path=tmp, dimension=3)
+            matches = reopened.query([0, 1, 0], top_k=5)
+            self.assertEqual([(match['id'], match['metadata']['text']) for match in matches], [('b', 'second')])
+
+    def test_query_pinecone_uses_the_configured_store(self):
+        pinecone_utils.set_vector_store(self.store)
+        try:
+            matches = pinecone_utils.query_pinecone([0, 1, 0], top_k=1)
+        finally:
+            pinecone_utils.set_vector_store(None)
+        self.assertEqual(matches[0]['id'], 'c')
+
+    @unittest.skipUnless(hnswlib, 'hnswlib is not installed')
+    def test_hnsw_index_agrees_with_exact_search(self):
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=(500, 16))
+        exact = LocalVectorStore(dimension=16)
+        approximate = LocalVectorStore(dimension=16, ann='hnsw')
+        for store in (exact, approximate):
+            store.upsert([vector(str(i), row.tolist(), group=i % 3) for i, row in enumerate(values)])
+
+        query = values[7].tolist()
+        self.assertEqual(approximate.query(query, top_k=1)[0]['id'], '7')
+        self.assertEqual([match['id'] for match in approximate.query(query, filters={'group': 2}, top_k=3)],
+                         [match['id'] for match in exact.query(query, filters={'group': 2}, top_k=3)])
+
+
+class TestQuantizedStore(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.values = rng.normal(size=(300, 32))
+        self.vectors = [vector(str(i), row.tolist(), group=i % 3) for i, row in enumerate(self.values)]
+        self.exact = LocalVectorStore(dimension=32)
+        self.exact.upsert(self.vectors)
+
+    def ids(self, store, query, **kwargs):
+        return [match['id'] for match in store.query(query, top_k=5, **kwargs)]
+
+    def test_quantize_round_trip(self):
+        unit = self.values / np.linalg.norm(self.values, axis=1, keepdims=True)
+        for quantization, tolerance in (('float16', 1e-3), ('int8', 1e-2)):
+            codes, scales = quantize(unit.astype(np.float32), quantization)
+            self.assertLess(np.abs(dequantize(codes, scales) - unit).max(), tolerance)
+
+    def test_rescored_results_match_float32(self):
+        for quantization in ('float16', 'int8'):
+            store = LocalVectorStore(dimension=32, quantization=quantization, rescore=True)
+            store.upsert(self.vectors)
+            for row in (0, 7, 42):
+                query = self.values[row].tolist()
+                self.assertEqual(self.ids(store, query), self.ids(self.exact, query))
+                self.assertEqual(self.ids(store, query, filters={'group': 1}),
+                                 self.ids(self.exact, query, filters={'group': 1}))
+            self.assertAlmostEqual(store.query(self.values[7].tolist(), top_k=1)[0]['score'], 1.0, places=5)
+
+    def test_without_rescoring_only_codes_are_kept(self):
+        # Rescoring is off by default, so quantization shrinks the storage
+        store = LocalVectorStore(dimension=32, quantization='int8')
+        store.upsert(self.vectors)
+        self.assertIsNone(store._vectors)
+        match = store.query(self.values[7].tolist(), top_k=1, include_values=True)[0]
+        self.assertEqual(match['id'], '7')
+        self.assertEqual(len(match['values']), 32)
+
+    def test_reopening_with_another_quantization(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            LocalVectorStore(path=tmp, dimension=32, initial_capacity=64).upsert(self.vectors)
+            reopened = LocalVectorStore(path=tmp, dimension=32, quantization='int8', rescore=True)
+            query = self.values[3].tolist()
+            self.assertEqual(self.ids(reopened, query), self.ids(self.exact, query))
+
+
+class TestPineconeUpsert(unittest.TestCase):
+    def test_batches_by_count_and_size(self):
+        vectors = [vector(str(i), [0.5] * 8) for i in range(7)]
+        self.assertEqual([len(batch) for batch in pinecone_utils.batch_vectors(vectors, max_batch_size=3)], [3, 3, 1])
+        size = len(pinecone_utils.json.dumps(vectors[0]))
+        self.assertEqual([len(batch) for batch in pinecone_utils.batch_vectors(vectors, max_batch_bytes=2 * size)],
+                         [2, 2, 2, 1])
+
+    def test_upsert_reports_per_batch_stats(self):
+        index = mock.Mock()
+        with mock.patch.object(pinecone_utils, '_index', index):
+            stats = pinecone_utils.PineconeVectorStore().upsert([vector(str(i), [0.5]) for i in range(250)])
+        self.assertEqual([batch['vectors'] for batch in stats], [100, 100, 50])
+        self.assertEqual(index.upsert.call_count, 3)
+
+    def test_only_the_failed_batch_is_retried(self):
+        failures = {'100': 1}
+
+        def upsert(vectors):
+            # The second batch fails once
+            if failures.get(vectors[0]['id']):
+                failures[vectors[0]['id']] -= 1
+                raise ConnectionError('reset')
+
+        index = mock.Mock(upsert=mock.Mock(side_effect=upsert))
+        with mock.patch.object(pinecone_utils, '_index', index), mock.patch('time.sleep'):
+            stats = pinecone_utils.PineconeVectorStore().upsert([vector(str(i), [0.5]) for i in range(250)])
+        self.assertEqual([batch['attempts'] for batch in stats], [1, 2, 1])
+        self.assertEqual(index.upsert.call_count, 4)
+
+    def test_failure_is_raised_after_the_other_batches(self):
+        def upsert(vectors):
+            if vectors[0]['id'] == '0':
+                raise ConnectionError('reset')
+
+        index = mock.Mock(upsert=mock.Mock(side_effect=upsert))
+        with mock.patch.object(pinecone_utils, '_index', index), mock.patch('time.sleep'):
+            with self.assertRaises(ConnectionError):
+                pinecone_utils.PineconeVectorStore().upsert([vector(str(i), [0.5]) for i in range(250)])
+        # Three attempts of the failing batch, one of each other batch
+        self.assertEqual(index.upsert.call_count, 5)
+
+
+class TestAsyncIndex(unittest.TestCase):
+    def test_concurrent_first_queries_share_one_client(self):
+        async def describe_index(name):
+            await asyncio.sleep(0.01)
+            return mock.Mock(host='index.example')
+
+        async def connect():
+            return await asyncio.gather(*(pinecone_utils.get_async_index() for _ in range(5)))
+
+        client = mock.Mock(describe_index=describe_index)
+        with mock.patch('pinecone.PineconeAsyncio', return_value=client) as PineconeAsyncio, \
+                mock.patch.object(pinecone_utils, '_async_index', None), \
+                mock.patch.object(pinecone_utils, '_async_client', None):
+            indexes = asyncio.run(connect())
+        self.assertEqual(PineconeAsyncio.call_count, 1)
+        self.assertTrue(all(index is client.IndexAsyncio.return_value for index in indexes))
+
+
+if __name__ == '__main__':
+    unittest.main()